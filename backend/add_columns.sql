@@ -3,3 +3,89 @@ ALTER TABLE attendance
 ADD COLUMN IF NOT EXISTS captured_image TEXT,
 ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION,
 ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION;
+
+-- Reference into the blob store (BLOB_STORE_DIR) instead of inline base64
+ALTER TABLE attendance 
+ADD COLUMN IF NOT EXISTS image_key TEXT;
+
+-- Compact binary face encodings (base64 float32, see face_auth.encode_embedding).
+-- Existing rows are converted by migrate_embeddings.py.
+ALTER TABLE users 
+ADD COLUMN IF NOT EXISTS face_embedding TEXT;
+
+-- Incremental gallery sync (see gallery_sync.py): a row version bumped on
+-- every insert/update, and a tombstone per deleted user.
+ALTER TABLE users
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS users_updated_at_id_idx ON users (updated_at, id);
+
+CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_touch_updated_at ON users;
+CREATE TRIGGER users_touch_updated_at BEFORE INSERT OR UPDATE ON users
+FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+-- Deletions (including clear_database.py) leave a tombstone. Rows older than
+-- a few days can be pruned; instances that fall further behind are repaired
+-- by the periodic reconcile.
+CREATE TABLE IF NOT EXISTS user_tombstones (
+    user_id UUID PRIMARY KEY,
+    deleted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS user_tombstones_deleted_at_idx ON user_tombstones (deleted_at, user_id);
+
+CREATE OR REPLACE FUNCTION record_user_tombstone() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO user_tombstones (user_id, deleted_at) VALUES (OLD.id, clock_timestamp())
+    ON CONFLICT (user_id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_record_tombstone ON users;
+CREATE TRIGGER users_record_tombstone AFTER DELETE ON users
+FOR EACH ROW EXECUTE FUNCTION record_user_tombstone();
+
+-- One-row digest of (id, updated_at) over all users, compared with
+-- gallery_sync.version_checksum() by the reconcile.
+CREATE OR REPLACE FUNCTION gallery_checksum()
+RETURNS TABLE (row_count BIGINT, checksum TEXT) AS $$
+    SELECT count(*),
+           md5(coalesce(string_agg(id::text || '@' || round(extract(epoch FROM updated_at) * 1000000)::bigint,
+                                   ',' ORDER BY id::text COLLATE "C"), ''))
+    FROM users;
+$$ LANGUAGE sql STABLE;
+
+-- Class sessions (see sessions.py): a time window, an optional geofence and a
+-- roster. /mark_attendance with a session_id only searches the roster.
+CREATE TABLE IF NOT EXISTS class_sessions (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    name TEXT NOT NULL,
+    starts_at TIMESTAMPTZ NOT NULL,
+    ends_at TIMESTAMPTZ NOT NULL,
+    latitude DOUBLE PRECISION,
+    longitude DOUBLE PRECISION,
+    radius_m DOUBLE PRECISION,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS class_sessions_window_idx ON class_sessions (starts_at, ends_at);
+
+CREATE TABLE IF NOT EXISTS session_roster (
+    session_id UUID NOT NULL REFERENCES class_sessions(id) ON DELETE CASCADE,
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    PRIMARY KEY (session_id, user_id)
+);
+
+ALTER TABLE attendance
+ADD COLUMN IF NOT EXISTS session_id UUID REFERENCES class_sessions(id);
+
+-- Attendance cooldown sync (attendance_dedup.py) reads the most recent rows
+CREATE INDEX IF NOT EXISTS attendance_timestamp_idx ON attendance (timestamp);
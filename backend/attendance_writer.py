@@ -0,0 +1,188 @@
+import os
+import time
+import asyncio
+from utils.metrics import stage_seconds
+
+# --- CONFIGURATION ---
+# Rows per multi-row insert, and how long the first buffered row may wait
+ATTENDANCE_BATCH_SIZE = int(os.getenv("ATTENDANCE_BATCH_SIZE", "100"))
+ATTENDANCE_FLUSH_SECONDS = float(os.getenv("ATTENDANCE_FLUSH_SECONDS", "0.05"))
+# "commit": the request waits until its rows are in the database.
+# "queued": the request returns once rows are buffered (write-behind; rows
+#           still failing after all retries are only logged).
+ATTENDANCE_DURABILITY = os.getenv("ATTENDANCE_DURABILITY", "commit")
+ATTENDANCE_MAX_RETRIES = int(os.getenv("ATTENDANCE_MAX_RETRIES", "3"))
+
+# Image columns a row can be saved without if the database lacks them
+# (see add_columns.sql)
+OPTIONAL_COLUMNS = ("captured_image", "image_key")
+
+
+class AttendanceWriter:
+    """
+    Collects attendance rows across faces and requests and writes them to
+    Supabase as multi-row inserts, flushed on a size or time threshold.
+
+    write() returns one outcome per row: {"ok": bool, "image_saved": bool}.
+    image_saved is False when the row had to be stored without its image column.
+    Callables in `listeners` are called from the event loop with the inserted
+    rows (as returned by the database, so including ids) after every
+    successful insert, e.g. to invalidate caches or push live updates.
+    """
+
+    def __init__(self, client, table="attendance", batch_size=ATTENDANCE_BATCH_SIZE,
+                 flush_seconds=ATTENDANCE_FLUSH_SECONDS, durability=ATTENDANCE_DURABILITY,
+                 max_retries=ATTENDANCE_MAX_RETRIES):
+        self.client = client
+        self.table = table
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.durability = durability
+        self.max_retries = max_retries
+        self.stats = {"rows": 0, "inserts": 0, "retries": 0, "failed_rows": 0, "images_dropped": 0}
+        self._buffer = []
+        self._has_rows = None
+        self._full = None
+        self._task = None
+        self._in_flight = False
+        self.listeners = []
+
+    @property
+    def pending(self):
+        return len(self._buffer)
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._has_rows = asyncio.Event()
+            self._full = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def write(self, rows):
+        """
+        Buffers rows for the next batch. With "commit" durability this waits
+        for the batch to be inserted; with "queued" it returns immediately.
+        """
+        if not rows:
+            return []
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for row in rows:
+            future = loop.create_future()
+            self._buffer.append((row, future))
+            futures.append(future)
+        self._has_rows.set()
+        if len(self._buffer) >= self.batch_size:
+            self._full.set()
+
+        if self.durability == "queued":
+            return [{"ok": True, "queued": True, "image_saved": self._has_image(row)} for row in rows]
+        return await asyncio.gather(*futures)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._has_rows.wait()
+            # Give other requests a short window to join this batch
+            deadline = loop.time() + self.flush_seconds
+            while len(self._buffer) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            batch, self._buffer = self._buffer[:self.batch_size], self._buffer[self.batch_size:]
+            if not self._buffer:
+                self._has_rows.clear()
+            self._in_flight = True
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                print(f"🔥 Attendance writer flush failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result({"ok": False, "image_saved": False})
+            finally:
+                self._in_flight = False
+
+    @staticmethod
+    def _has_image(row):
+        return any(col in row for col in OPTIONAL_COLUMNS)
+
+    def _insert(self, rows):
+        start = time.perf_counter()
+        response = self.client.table(self.table).insert(rows).execute()
+        stage_seconds.observe(time.perf_counter() - start, "db_insert")
+        return getattr(response, "data", None) or rows
+
+    async def _insert_with_retry(self, rows):
+        """
+        Returns (ok, image_saved, inserted_rows) for the whole group of rows.
+        """
+        delay = 0.1
+        for attempt in range(self.max_retries + 1):
+            try:
+                inserted = await asyncio.to_thread(self._insert, rows)
+                self.stats["inserts"] += 1
+                return True, self._has_image(rows[0]), inserted
+            except Exception as e:
+                print(f"🔥 DB Insert Error ({len(rows)} rows, attempt {attempt + 1}): {e}")
+                # Missing column (see add_columns.sql): retry straight away without the image
+                if any(col in rows[0] and col in str(e) for col in OPTIONAL_COLUMNS):
+                    break
+                if attempt < self.max_retries:
+                    self.stats["retries"] += 1
+                    await asyncio.sleep(delay)
+                    delay *= 2
+
+        if self._has_image(rows[0]):
+            print("Retrying without image column...")
+            stripped = [{k: v for k, v in row.items() if k not in OPTIONAL_COLUMNS} for row in rows]
+            try:
+                inserted = await asyncio.to_thread(self._insert, stripped)
+                self.stats["inserts"] += 1
+                self.stats["images_dropped"] += len(rows)
+                return True, False, inserted
+            except Exception as retry_e:
+                print(f"Retry failed: {retry_e}")
+        self.stats["failed_rows"] += len(rows)
+        return False, False, []
+
+    async def _flush(self, batch):
+        # PostgREST bulk inserts need identical keys, so group rows by shape
+        groups = {}
+        for row, future in batch:
+            groups.setdefault(tuple(sorted(row)), []).append((row, future))
+        for entries in groups.values():
+            rows = [row for row, _ in entries]
+            ok, image_saved, inserted = await self._insert_with_retry(rows)
+            if ok:
+                self.stats["rows"] += len(entries)
+                for listener in self.listeners:
+                    try:
+                        listener(inserted)
+                    except Exception as e:
+                        print(f"Warning: attendance listener failed: {e}")
+            for _, future in entries:
+                if not future.done():
+                    future.set_result({"ok": ok, "image_saved": image_saved})
+
+    async def close(self):
+        """
+        Flushes whatever is still buffered and stops the background task.
+        """
+        if self._task is None:
+            return
+        # Let the flusher drain the buffer rather than cancelling mid-insert
+        while (self._buffer or self._in_flight) and not self._task.done():
+            self._full.set()
+            await asyncio.sleep(0.01)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Bulk geofence audit of historical attendance rows.
+
+Checks every attendance row that has a latitude/longitude against the
+registered geofences in one vectorized pass (utils.geo.GeofenceRegistry.audit).
+Rows recorded for a class session are judged against that session's fence;
+other rows against the nearest fence.
+
+Usage:
+    python audit_geofences.py [--fences geofences.json] [--batch-size 1000] [--csv violations.csv]
+
+--fences defaults to GEOFENCES_FILE. Session fences (class_sessions with a
+location) are always added.
+"""
+import os
+import sys
+import csv
+import time
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import supabase
+from utils.geo import GeofenceRegistry, RadiusFence
+
+DEFAULT_RADIUS_M = 200
+
+
+def fetch_rows(columns, batch_size):
+    rows, last_id = [], None
+    while True:
+        query = supabase.table("attendance").select(columns) \
+            .not_.is_("latitude", "null").not_.is_("longitude", "null").order("id").limit(batch_size)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        page = query.execute().data or []
+        rows.extend(page)
+        if len(page) < batch_size:
+            return rows
+        last_id = page[-1]["id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audit attendance locations against geofences")
+    parser.add_argument("--fences", default=os.getenv("GEOFENCES_FILE", ""))
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--csv", help="Write rows outside their fence to this file")
+    args = parser.parse_args()
+
+    registry = GeofenceRegistry()
+    if args.fences:
+        registry.load_json(args.fences)
+    try:
+        sessions = supabase.table("class_sessions").select("id, name, latitude, longitude, radius_m").execute().data or []
+    except Exception as e:
+        print(f"⚠️ class_sessions not readable ({e}); auditing against --fences only.")
+        sessions = []
+    for s in sessions:
+        if s.get("latitude") is not None and s.get("longitude") is not None:
+            registry.add(RadiusFence(s["id"], s["latitude"], s["longitude"], s.get("radius_m") or DEFAULT_RADIUS_M, s.get("name")))
+    if not len(registry):
+        print("❌ No geofences: pass --fences (or set GEOFENCES_FILE) or give class sessions a location.")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    try:
+        rows = fetch_rows("id, user_id, timestamp, latitude, longitude, session_id", args.batch_size)
+    except Exception:
+        rows = fetch_rows("id, user_id, timestamp, latitude, longitude", args.batch_size)
+    fetched = time.perf_counter()
+    if not rows:
+        print("No attendance rows with a location.")
+        return
+
+    lats = np.array([float(r["latitude"]) for r in rows])
+    lngs = np.array([float(r["longitude"]) for r in rows])
+    expected = [r.get("session_id") if r.get("session_id") in registry.fences else None for r in rows]
+    report = registry.audit(lats, lngs, expected=expected)
+    audited = time.perf_counter()
+
+    violations = np.flatnonzero(~report["inside"])
+    print("=" * 70)
+    print(f"✅ Audited {len(rows)} rows against {len(registry)} fences "
+          f"(fetch {fetched - start:.1f}s, check {(audited - fetched) * 1000:.0f} ms)")
+    print(f"📍 {len(rows) - len(violations)} inside, {len(violations)} outside their fence")
+    worst = violations[np.argsort(-report["meters_outside"][violations])][:10]
+    for i in worst:
+        print(f"   attendance {rows[i]['id']}: user {rows[i]['user_id']} at {rows[i]['timestamp']}, "
+              f"{report['meters_outside'][i]:.0f} m outside {report['fence_ids'][i]}")
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["attendance_id", "user_id", "timestamp", "latitude", "longitude", "fence_id", "meters_outside"])
+            for i in violations:
+                writer.writerow([rows[i]["id"], rows[i]["user_id"], rows[i]["timestamp"], lats[i], lngs[i],
+                                 report["fence_ids"][i], round(float(report["meters_outside"][i]), 1)])
+        print(f"📝 Wrote {len(violations)} violations to {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Latency vs. recall of the detection profiles (face_auth.DETECTION_PROFILES).
+
+Each image is also rescaled to common capture sizes. Recall is measured
+against the "accurate" profile on the same image: a face counts as found if
+a box overlaps an accurate box with IoU >= 0.5. With no arguments, synthetic
+frames are used (latency only: they contain no faces).
+
+Usage: python bench_detection.py [photo.jpg ...]
+"""
+import sys
+import time
+import cv2
+import numpy as np
+from face_auth import FaceAuthSystem, DETECTION_PROFILES, face_recognition_available
+
+SIZES = [(640, 480), (1280, 720), (1920, 1080), (4032, 3024)]
+# "accurate" runs first: it is the recall reference for the others
+PROFILES = ["accurate"] + [name for name in DETECTION_PROFILES if name != "accurate"]
+REPEATS = 3
+
+
+def iou(a, b):
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, bottom - top) * max(0, right - left)
+    area = lambda r: (r[2] - r[0]) * (r[1] - r[3])
+    return inter / float(area(a) + area(b) - inter) if inter else 0.0
+
+
+def load_images(paths):
+    if not paths:
+        rng = np.random.default_rng(0)
+        base = rng.integers(0, 255, size=(480, 640, 3), dtype=np.uint8)
+        return [("synthetic", base)]
+    images = []
+    for path in paths:
+        bgr = cv2.imread(path)
+        if bgr is None:
+            print(f"Skipping unreadable image: {path}")
+            continue
+        images.append((path, cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)))
+    return images
+
+
+def main():
+    if not face_recognition_available():
+        print("face_recognition is not installed; timings below are for FALLBACK MODE only.")
+    auth = FaceAuthSystem()
+    print(f"{'image':<24} {'size':>10} {'profile':>9} {'ms':>9} {'faces':>6} {'recall':>7}")
+    for name, image in load_images(sys.argv[1:]):
+        for w, h in SIZES:
+            frame = cv2.resize(image, (w, h), interpolation=cv2.INTER_AREA if w < image.shape[1] else cv2.INTER_CUBIC)
+            reference = None
+            for profile in PROFILES:
+                timings = []
+                for _ in range(REPEATS):
+                    start = time.perf_counter()
+                    boxes, _ = auth.extract_faces_from_array(frame, profile)
+                    timings.append((time.perf_counter() - start) * 1000)
+                if reference is None:
+                    reference = boxes
+                found = sum(any(iou(r, b) >= 0.5 for b in boxes) for r in reference)
+                recall = found / len(reference) if reference else float("nan")
+                print(f"{name[-24:]:<24} {f'{w}x{h}':>10} {profile:>9} {np.median(timings):>9.1f} {len(boxes):>6} {recall:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
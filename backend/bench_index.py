@@ -0,0 +1,55 @@
+"""
+Recall/latency report for the face gallery indexes.
+
+Builds a synthetic roster that mimics 128-d face encodings (same-person
+distance ~0.35, different-person distance ~0.9), then compares IVFIndex at
+several nprobe settings against exact brute-force search.
+
+Usage: python bench_index.py [num_users] [num_probes]
+"""
+import sys
+import time
+import numpy as np
+from face_auth import BruteForceIndex, IVFIndex, recall_report, DEFAULT_TOLERANCE, ENCODING_DIM
+
+
+def synthetic_roster(num_users, num_probes, seed=42):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0.0, 0.056, size=(num_users, ENCODING_DIM)).astype(np.float32)
+    enrolled = centers + rng.normal(0.0, 0.022, size=centers.shape).astype(np.float32)
+    # Half the probes are enrolled students, half are strangers
+    known = rng.choice(num_users, size=num_probes // 2, replace=False)
+    probes_known = centers[known] + rng.normal(0.0, 0.022, size=(len(known), ENCODING_DIM))
+    probes_unknown = rng.normal(0.0, 0.056, size=(num_probes - len(known), ENCODING_DIM))
+    probes = np.vstack([probes_known, probes_unknown]).astype(np.float32)
+    return enrolled, [f"user-{i}" for i in range(num_users)], probes
+
+
+def main():
+    num_users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    num_probes = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    vectors, ids, probes = synthetic_roster(num_users, num_probes)
+
+    exact = BruteForceIndex()
+    exact.build(vectors, ids)
+
+    start = time.perf_counter()
+    ivf = IVFIndex()
+    ivf.build(vectors, ids)
+    print(f"Users: {num_users}, probes: {num_probes}, IVF cells: {len(ivf._cells)}, "
+          f"build: {time.perf_counter() - start:.2f}s, tolerance: {DEFAULT_TOLERANCE}")
+    print(f"{'nprobe':>8} {'recall@1':>9} {'agree':>7} {'exact ms':>9} {'ivf ms':>8}")
+    for nprobe in (1, 2, 4, 8, 16, 32):
+        ivf.nprobe = nprobe
+        # One probe per search, as a request would issue it
+        report = {"recall_at_k": 0.0, "decision_agreement": 0.0, "exact_ms_per_probe": 0.0, "approx_ms_per_probe": 0.0}
+        for p in range(num_probes):
+            r = recall_report(ivf, exact, probes[p:p + 1])
+            for key in report:
+                report[key] += r[key] / num_probes
+        print(f"{nprobe:>8} {report['recall_at_k']:>9.3f} {report['decision_agreement']:>7.3f} "
+              f"{report['exact_ms_per_probe']:>9.3f} {report['approx_ms_per_probe']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
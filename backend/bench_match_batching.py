@@ -0,0 +1,51 @@
+"""
+Throughput and latency of gallery matching under a burst of concurrent
+requests (one probe each, like a class checking in), with and without
+cross-request micro-batching (match_batcher.MatchBatcher).
+
+Usage: python bench_match_batching.py [num_users] [num_requests] [concurrency]
+"""
+import sys
+import time
+import asyncio
+import numpy as np
+from face_auth import FaceGallery
+from match_batcher import MatchBatcher
+from bench_index import synthetic_roster
+
+WINDOWS_MS = [0, 1, 3, 5]
+
+
+async def burst(batcher, gallery, probes, concurrency):
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(probe):
+        async with slots:
+            start = time.perf_counter()
+            await batcher.match(gallery, [probe])
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(p) for p in probes))
+    return time.perf_counter() - start, np.array(latencies) * 1000
+
+
+def main():
+    num_users = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    num_requests = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+    vectors, ids, probes = synthetic_roster(num_users, num_requests)
+    gallery = FaceGallery()
+    gallery.load_matrix(vectors, ids, {i: {"id": i} for i in ids})
+    print(f"{num_users} users, {num_requests} requests, {concurrency} in flight")
+    print(f"{'window ms':>9} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'probes/scan':>12}")
+    for window in WINDOWS_MS:
+        batcher = MatchBatcher(window_seconds=window / 1000)
+        seconds, latencies = asyncio.run(burst(batcher, gallery, probes, concurrency))
+        print(f"{window:>9} {num_requests / seconds:>9.0f} {np.percentile(latencies, 50):>8.2f} "
+              f"{np.percentile(latencies, 99):>8.2f} {batcher.stats['probes'] / batcher.stats['batches']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Latency of encoding every face in a group photo: one worker vs. the faces
+split across the pool (FaceWorkerPool.encode_faces), by number of faces.
+
+With a photo, its detected faces are used (repeated to reach the larger
+counts); without one, a synthetic 1920x1080 frame with a grid of face-sized
+boxes. Without face_recognition the encoder is the FALLBACK histogram, which
+is too cheap for parallelism to pay off; run it where dlib is installed.
+
+Usage: python bench_parallel_encoding.py [group_photo.jpg] [--mode process|thread] [--workers N]
+"""
+import sys
+import time
+import asyncio
+import argparse
+import cv2
+import numpy as np
+from face_auth import FaceAuthSystem, face_recognition_available
+from face_worker import FaceWorkerPool
+
+FACE_COUNTS = [1, 5, 10, 20, 40, 60]
+REPEATS = 3
+
+
+def load_frame(path):
+    if path:
+        bgr = cv2.imread(path)
+        if bgr is None:
+            sys.exit(f"Unreadable image: {path}")
+        rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        boxes = FaceAuthSystem().locate_faces_from_array(rgb, "accurate")
+        print(f"{path}: {rgb.shape[1]}x{rgb.shape[0]}, {len(boxes)} faces detected")
+        return rgb, boxes
+    rng = np.random.default_rng(0)
+    rgb = rng.integers(0, 255, size=(1080, 1920, 3), dtype=np.uint8)
+    boxes = [(top, left + 120, top + 120, left) for top in range(0, 960, 160) for left in range(0, 1800, 160)]
+    return rgb, boxes
+
+
+async def best_of(fn):
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        await fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+async def run(args):
+    rgb, detected = load_frame(args.photo)
+    if not detected:
+        sys.exit("No faces to encode.")
+    pool = FaceWorkerPool(workers=args.workers, mode=args.mode, max_pending=1000, stage_timeout=600)
+    await pool.warm_up()
+    print(f"{pool.workers} {pool.mode} workers{'' if face_recognition_available() else ' (FALLBACK MODE)'}")
+    print(f"{'faces':>6} {'1 worker ms':>12} {'parallel ms':>12} {'speedup':>8}")
+    for count in FACE_COUNTS:
+        boxes = (detected * (count // len(detected) + 1))[:count]
+        serial = await best_of(lambda: pool.run("encode_faces_from_array", rgb, boxes, "accurate"))
+        parallel = await best_of(lambda: pool.encode_faces(rgb, boxes, "accurate", min_faces=1))
+        print(f"{count:>6} {serial:>12.1f} {parallel:>12.1f} {serial / parallel:>7.2f}x")
+    pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("photo", nargs="?")
+    parser.add_argument("--mode", default="process", choices=("process", "thread"))
+    parser.add_argument("--workers", type=int, default=4)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Accuracy/latency/memory report for the quantized gallery indexes.
+
+Compares QuantizedIndex (int8 scan, float32 re-ranking) against exact
+float32 brute force on two synthetic rosters: dlib-like 128-d encodings at
+DEFAULT_TOLERANCE, and non-negative L2-normalized colour histograms (FALLBACK
+MODE) at FALLBACK_TOLERANCE.
+
+Usage: python bench_quantization.py [num_users] [num_probes]
+"""
+import sys
+import time
+import numpy as np
+from face_auth import BruteForceIndex, QuantizedIndex, recall_report, DEFAULT_TOLERANCE, FALLBACK_TOLERANCE, ENCODING_DIM
+from bench_index import synthetic_roster
+
+
+def histogram_roster(num_users, num_probes, seed=7):
+    rng = np.random.default_rng(seed)
+    centers = rng.gamma(0.3, 1.0, size=(num_users, ENCODING_DIM))
+    enrolled = centers * rng.uniform(0.8, 1.2, size=centers.shape)
+    known = rng.choice(num_users, size=num_probes // 2, replace=False)
+    probes_known = centers[known] * rng.uniform(0.8, 1.2, size=(len(known), ENCODING_DIM))
+    probes_unknown = rng.gamma(0.3, 1.0, size=(num_probes - len(known), ENCODING_DIM))
+    probes = np.vstack([probes_known, probes_unknown])
+    normalize = lambda m: (m / np.linalg.norm(m, axis=1, keepdims=True)).astype(np.float32)
+    return normalize(enrolled), [f"user-{i}" for i in range(num_users)], normalize(probes)
+
+
+def report(name, vectors, ids, probes, tolerance):
+    exact = BruteForceIndex()
+    exact.build(vectors, ids)
+    print(f"\n{name}: {len(ids)} users, {len(probes)} probes, tolerance {tolerance}")
+    print(f"{'rerank':>7} {'recall@1':>9} {'agree':>7} {'exact ms':>9} {'quant ms':>9} {'resident MB':>12} {'x smaller':>9}")
+    for rerank in (8, 32):
+        index = QuantizedIndex(rerank=rerank)
+        index.build(vectors, ids)
+        # Probes are matched in small batches, as a frame of faces would be
+        totals = {"recall_at_k": 0.0, "decision_agreement": 0.0, "exact_ms_per_probe": 0.0, "approx_ms_per_probe": 0.0}
+        batches = range(0, len(probes), 4)
+        for b in batches:
+            r = recall_report(index, exact, probes[b:b + 4], tolerance=tolerance)
+            for key in totals:
+                totals[key] += r[key] / len(batches)
+        print(f"{rerank:>7} {totals['recall_at_k']:>9.4f} {totals['decision_agreement']:>7.4f} "
+              f"{totals['exact_ms_per_probe']:>9.3f} {totals['approx_ms_per_probe']:>9.3f} "
+              f"{index.nbytes / 1e6:>12.1f} {exact.nbytes / index.nbytes:>9.1f}")
+
+
+def main():
+    num_users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    num_probes = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    start = time.perf_counter()
+    report("dlib encodings", *synthetic_roster(num_users, num_probes), DEFAULT_TOLERANCE)
+    report("fallback histograms", *histogram_roster(num_users, num_probes), FALLBACK_TOLERANCE)
+    print(f"\nTotal: {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
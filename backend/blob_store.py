@@ -0,0 +1,124 @@
+import os
+import re
+import hashlib
+import tempfile
+import cv2
+
+# --- CONFIGURATION ---
+BLOB_STORE = os.getenv("BLOB_STORE", "local")
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "blobs"))
+# Longest side of the per-face thumbnails stored with each attendance row
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "160"))
+
+# <sha256>.jpg for frames, <sha256>_<top>_<right>_<bottom>_<left>.jpg for face crops
+KEY_PATTERN = re.compile(r"^([0-9a-f]{64})(?:_(\d+)_(\d+)_(\d+)_(\d+))?\.jpg$")
+
+
+def content_key(data):
+    return hashlib.sha256(data).hexdigest() + ".jpg"
+
+
+def crop_key(frame_key, box):
+    """
+    Key of the thumbnail for face `box` (top, right, bottom, left) in a frame.
+    Derived from the frame key, so rows can reference crops before they exist.
+    """
+    top, right, bottom, left = (int(v) for v in box)
+    return f"{frame_key[:-4]}_{top}_{right}_{bottom}_{left}.jpg"
+
+
+def make_face_thumbnail(rgb_image, box, size=THUMBNAIL_SIZE):
+    """
+    JPEG bytes of the face in `box`, with some margin, scaled to at most `size` px.
+    """
+    top, right, bottom, left = box
+    h, w = rgb_image.shape[:2]
+    margin = int(0.25 * max(bottom - top, right - left))
+    crop = rgb_image[max(0, top - margin):min(h, bottom + margin), max(0, left - margin):min(w, right + margin)]
+    if crop.size == 0:
+        crop = rgb_image
+    scale = size / max(crop.shape[:2])
+    if scale < 1:
+        crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    _, buffer = cv2.imencode(".jpg", cv2.cvtColor(crop, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 85])
+    return buffer.tobytes()
+
+
+class BlobStore:
+    """
+    Content-addressed image storage. Backends implement put_key/get/exists/delete.
+    """
+
+    def put(self, data):
+        """
+        Stores bytes under their content hash (once, however often it's called).
+        Returns the key.
+        """
+        key = content_key(data)
+        if not self.exists(key):
+            self.put_key(key, data)
+        return key
+
+    def put_key(self, key, data):
+        raise NotImplementedError
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Blobs as files under `root`, fanned out by hash prefix (ab/cd/<key>).
+    """
+
+    def __init__(self, root=BLOB_STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        if not KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid blob key: {key}")
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put_key(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write-then-rename so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+def make_blob_store(kind=BLOB_STORE):
+    if kind == "local":
+        return LocalBlobStore()
+    raise ValueError(f"Unknown blob store: {kind}")
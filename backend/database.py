@@ -1,6 +1,6 @@
 
 import os
-from supabase import create_client, Client
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,5 +11,34 @@ key: str = os.environ.get("SUPABASE_KEY")
 if not url or not key:
     # Fallback/Error if env vars missing
     print("Warning: SUPABASE_URL or SUPABASE_KEY not set")
-    
-supabase: Client = create_client(url, key)
+
+
+class LazyClient:
+    """
+    Stands in for the Supabase client and creates it on first use, so that
+    importing this module doesn't import the supabase SDK or open a client.
+    Attribute access (supabase.table(...), ...) is forwarded to the real client.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def _create_client():
+    from supabase import create_client
+    return create_client(url, key)
+
+
+supabase = LazyClient(_create_client)
@@ -0,0 +1,55 @@
+import os
+import asyncio
+
+# Events buffered per subscriber before it is considered too slow
+HUB_CLIENT_BUFFER = int(os.getenv("HUB_CLIENT_BUFFER", "256"))
+
+
+class Subscriber:
+    def __init__(self, maxsize):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.resyncs = 0
+
+
+class EventHub:
+    """
+    In-process fan-out of events to any number of subscribers.
+
+    Each subscriber has a bounded queue. publish() never blocks: when a
+    subscriber's queue is full its backlog is dropped and replaced by a single
+    {"type": "resync"} event, telling that consumer to reload a snapshot
+    instead of slowing everyone else down.
+    """
+
+    def __init__(self, buffer_size=HUB_CLIENT_BUFFER):
+        self.buffer_size = max(2, buffer_size)
+        self.seq = 0
+        self.published = 0
+        self._subscribers = set()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self):
+        sub = Subscriber(self.buffer_size)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        self._subscribers.discard(sub)
+
+    def publish(self, event):
+        """
+        Must be called from the event loop thread.
+        """
+        self.seq += 1
+        self.published += 1
+        event = dict(event, seq=self.seq)
+        for sub in list(self._subscribers):
+            try:
+                sub.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                while not sub.queue.empty():
+                    sub.queue.get_nowait()
+                sub.queue.put_nowait({"type": "resync", "seq": self.seq})
+                sub.resyncs += 1
@@ -1,88 +1,558 @@
 import cv2
 import numpy as np
 import base64
+import json
+import struct
+import zlib
+import mmap
+import importlib.util
 import os
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
 
-# Try to import face_recognition, handle failure gracefully
-try:
-    import face_recognition
-    FACE_REC_AVAILABLE = True
-except BaseException as e:
-    print(f"WARNING: Face recognition import failed: {e}. Running in FALLBACK MODE (Color Histogram).")
-    FACE_REC_AVAILABLE = False
-
-# Try to import MediaPipe for liveness
-try:
-    import mediapipe as mp
-    MEDIAPIPE_AVAILABLE = True
-except ImportError as e:
-    print(f"WARNING: MediaPipe import failed: {e}. Liveness check will be mocked.")
-    MEDIAPIPE_AVAILABLE = False
+# face_recognition (dlib) and MediaPipe take seconds to import, so they are
+# imported on first use (or by FaceAuthSystem.warm_up()), not with this module.
+# The *_AVAILABLE flags stay None until the first import attempt.
+face_recognition = None
+mp = None
+FACE_REC_AVAILABLE = None
+MEDIAPIPE_AVAILABLE = None
+# Seconds spent importing each optional dependency
+import_seconds = {}
+_import_lock = threading.Lock()
+
+
+def face_recognition_available():
+    """
+    Imports face_recognition on first call, handling failure gracefully.
+    """
+    global face_recognition, FACE_REC_AVAILABLE
+    if FACE_REC_AVAILABLE is None:
+        with _import_lock:
+            if FACE_REC_AVAILABLE is None:
+                start = time.perf_counter()
+                try:
+                    import face_recognition as module
+                    face_recognition = module
+                    FACE_REC_AVAILABLE = True
+                except BaseException as e:
+                    print(f"WARNING: Face recognition import failed: {e}. Running in FALLBACK MODE (Color Histogram).")
+                    FACE_REC_AVAILABLE = False
+                import_seconds["face_recognition"] = time.perf_counter() - start
+    return FACE_REC_AVAILABLE
+
+
+def mediapipe_available():
+    """
+    Imports MediaPipe (used for liveness) on first call.
+    """
+    global mp, MEDIAPIPE_AVAILABLE
+    if MEDIAPIPE_AVAILABLE is None:
+        with _import_lock:
+            if MEDIAPIPE_AVAILABLE is None:
+                start = time.perf_counter()
+                try:
+                    import mediapipe as module
+                    mp = module
+                    MEDIAPIPE_AVAILABLE = True
+                except ImportError as e:
+                    print(f"WARNING: MediaPipe import failed: {e}. Liveness check will be mocked.")
+                    MEDIAPIPE_AVAILABLE = False
+                import_seconds["mediapipe"] = time.perf_counter() - start
+    return MEDIAPIPE_AVAILABLE
 
 # Global Face Match Threshold
 DEFAULT_TOLERANCE = 0.5
+# Threshold for the colour-histogram encodings used in FALLBACK MODE
+FALLBACK_TOLERANCE = 0.65
+ENCODING_DIM = 128
+
+# Detection pipelines, selectable per endpoint. HOG cost scales with pixel
+# count, so faces are detected on a copy whose longest side is at most
+# max_side (None = full resolution); boxes are scaled back and encodings are
+# always computed from the full-resolution image.
+#   model:    dlib detector ("hog" on CPU, "cnn" needs a CUDA build of dlib)
+#   upsample: times the detection image is upsampled to find small faces
+#   jitters:  re-samplings averaged per encoding (slower, more stable)
+DETECTION_PROFILES = {
+    "fast": {"model": "hog", "max_side": 480, "upsample": 0, "jitters": 1},
+    "balanced": {"model": "hog", "max_side": 960, "upsample": 1, "jitters": 1},
+    # Extra jitters are opt-in: they multiply encode cost and shift new
+    # registrations' embeddings away from those stored with num_jitters=1
+    "accurate": {"model": os.getenv("FACE_ACCURATE_MODEL", "hog"), "max_side": None, "upsample": 1,
+                 "jitters": int(os.getenv("FACE_ACCURATE_JITTERS", "1"))},
+}
+DEFAULT_DETECTION_PROFILE = "accurate"
+
+# Multi-frame (blink) liveness. FaceMesh eye landmarks in EAR order
+# (corner, upper, upper, corner, lower, lower) for each eye.
+LEFT_EYE = (362, 385, 387, 263, 373, 380)
+RIGHT_EYE = (33, 160, 158, 133, 153, 144)
+EAR_CLOSED = 0.21        # eyes count as closed below this
+EAR_OPEN = 0.25          # ...and open again above this (hysteresis)
+LIVENESS_MAX_FRAMES = int(os.getenv("LIVENESS_MAX_FRAMES", "45"))
+LIVENESS_BUDGET_SECONDS = float(os.getenv("LIVENESS_BUDGET_SECONDS", "3"))
+
+# FaceMesh graphs per FaceAuthSystem (0 = one per CPU). Graphs are created
+# on demand up to this many and are never shared by two concurrent calls.
+FACE_MESH_POOL_SIZE = int(os.getenv("FACE_MESH_POOL_SIZE", "0"))
+
+# Image-quality gate (check_quality), run before liveness and encoding.
+# Sharpness is the variance of the Laplacian measured at QUALITY_ANALYSIS_SIDE
+# (on the face crop when a face is found, else the whole frame); brightness
+# is the mean grey level (0-255) of the same region.
+QUALITY_ANALYSIS_SIDE = 320
+QUALITY_MIN_SHARPNESS = float(os.getenv("QUALITY_MIN_SHARPNESS", "40"))
+QUALITY_MIN_BRIGHTNESS = float(os.getenv("QUALITY_MIN_BRIGHTNESS", "40"))
+QUALITY_MAX_BRIGHTNESS = float(os.getenv("QUALITY_MAX_BRIGHTNESS", "220"))
+# Rejected when more than this fraction of pixels is crushed black / blown white
+QUALITY_MAX_CLIPPED = float(os.getenv("QUALITY_MAX_CLIPPED", "0.4"))
+# Width in pixels (at full resolution) below which the largest face is too small
+QUALITY_MIN_FACE_PIXELS = int(os.getenv("QUALITY_MIN_FACE_PIXELS", "60"))
+# Nose offset from the eye midpoint, as a fraction of the eye distance, above
+# which a lone face counts as turned away
+QUALITY_MAX_YAW = float(os.getenv("QUALITY_MAX_YAW", "0.6"))
+
+QUALITY_MESSAGES = {
+    "blurry": "Image is blurry. Hold the camera still and make sure it is focused.",
+    "too_dark": "Image is too dark. Move to a brighter spot or face the light.",
+    "overexposed": "Image is overexposed. Avoid direct light or glare behind or on the face.",
+    "face_too_small": "Face is too small. Move closer to the camera.",
+    "face_turned": "Face is turned away. Look straight at the camera.",
+}
+
+
+def eye_aspect_ratio(landmarks, eye, width, height):
+    """
+    EAR = (|p2-p6| + |p3-p5|) / (2 |p1-p4|) from normalized FaceMesh landmarks.
+    """
+    p = np.array([(landmarks[i].x * width, landmarks[i].y * height) for i in eye])
+    vertical = np.linalg.norm(p[1] - p[5]) + np.linalg.norm(p[2] - p[4])
+    horizontal = np.linalg.norm(p[0] - p[3])
+    return float(vertical / (2.0 * horizontal)) if horizontal else 0.0
+
+
+class BlinkDetector:
+    """
+    Incremental blink detection: feed one EAR per frame; a blink is an
+    open -> closed -> open transition.
+    """
+
+    def __init__(self, closed=EAR_CLOSED, opened=EAR_OPEN):
+        self.closed_threshold = closed
+        self.open_threshold = opened
+        self.seen_open = False
+        self.eyes_closed = False
+        self.blinks = 0
+
+    def update(self, ear):
+        if ear >= self.open_threshold:
+            if self.eyes_closed:
+                self.blinks += 1
+                self.eyes_closed = False
+            self.seen_open = True
+        elif ear < self.closed_threshold and self.seen_open:
+            self.eyes_closed = True
+        return self.blinks > 0
+
+
+class FaceMeshPool:
+    """
+    Pool of initialized MediaPipe graphs. A graph must not run two process()
+    calls at once, so each call checks one out for its exclusive use.
+
+    The pool starts with `initial` warmed-up graphs and grows lazily up to
+    max_size; past that, checkout() waits for a graph to be checked back in.
+    Graphs are reused for the life of the pool, never rebuilt per call.
+    """
+
+    def __init__(self, factory, max_size=1, initial=1):
+        self.factory = factory
+        self.max_size = max(1, max_size)
+        self.created = 0
+        self.waits = 0
+        self._idle = []
+        self._cond = threading.Condition()
+        self.warm(initial)
+
+    def __len__(self):
+        return self.created
+
+    def _create(self):
+        mesh = self.factory()
+        # The first process() call builds the graph's calculators; pay that
+        # here rather than inside a request.
+        mesh.process(np.zeros((64, 64, 3), dtype=np.uint8))
+        return mesh
+
+    def warm(self, count):
+        """
+        Creates graphs until `count` exist (capped at max_size).
+        """
+        while True:
+            with self._cond:
+                if self.created >= min(count, self.max_size):
+                    return
+                self.created += 1
+            mesh = self._checked_create()
+            self.checkin(mesh)
+
+    def _checked_create(self):
+        try:
+            return self._create()
+        except BaseException:
+            with self._cond:
+                self.created -= 1
+                self._cond.notify()
+            raise
+
+    def checkout(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._idle:
+                if self.created < self.max_size:
+                    self.created += 1
+                    break
+                self.waits += 1
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No FaceMesh graph available")
+                self._cond.wait(remaining)
+            else:
+                return self._idle.pop()
+        return self._checked_create()
+
+    def checkin(self, mesh):
+        with self._cond:
+            self._idle.append(mesh)
+            self._cond.notify()
+
+    @contextmanager
+    def mesh(self, timeout=None):
+        mesh = self.checkout(timeout)
+        try:
+            yield mesh
+        finally:
+            self.checkin(mesh)
+
 
 class FaceAuthSystem:
-    def __init__(self):
+    def __init__(self, mesh_pool_size=None, detector_pool_size=None):
+        """
+        mesh_pool_size bounds how many liveness calls may run in parallel on
+        this instance (default FACE_MESH_POOL_SIZE); size it to the number of
+        threads sharing the instance. detector_pool_size does the same for
+        check_quality() (default mesh_pool_size). Graphs are only created
+        when a call needs one.
+        """
         self.mp_face_mesh = None
-        self.face_mesh = None
-        
-        if MEDIAPIPE_AVAILABLE:
-            try:
-                self.mp_face_mesh = mp.solutions.face_mesh
-                self.face_mesh = self.mp_face_mesh.FaceMesh(
-                    static_image_mode=True,
-                    max_num_faces=1,
-                    refine_landmarks=True,
-                    min_detection_confidence=0.5
-                )
-                print("MediaPipe initialized successfully.")
-            except Exception as e:
-                print(f"WARNING: MediaPipe initialization failed: {e}. Liveness check will be MOCKED.")
-                self.face_mesh = None
-        else:
-             print("MediaPipe not available. Liveness check will be MOCKED.")
+        # Single-image and video-mode (tracking) FaceMesh graphs, built on first use
+        self.mesh_pool = None
+        self.tracking_pool = None
+        # BlazeFace graphs for the face-size/pose part of check_quality()
+        self.detector_pool = None
+        self._pools_loaded = False
+        self._pools_lock = threading.Lock()
+        self._warm_lock = threading.Lock()
+        self.warm_up_timings = None
+        # Stage timings are per thread, so threads can share one instance
+        self._local = threading.local()
+        if mesh_pool_size is None:
+            mesh_pool_size = FACE_MESH_POOL_SIZE or os.cpu_count() or 1
+        self.mesh_pool_size = mesh_pool_size
+        self.detector_pool_size = detector_pool_size or mesh_pool_size
+
+    def _load_mesh_pools(self):
+        """
+        Imports MediaPipe and creates the FaceMesh pools on first call.
+        Returns the single-image pool, or None when liveness is mocked.
+        """
+        if self._pools_loaded:
+            return self.mesh_pool
+        with self._pools_lock:
+            if self._pools_loaded:
+                return self.mesh_pool
+            if mediapipe_available():
+                try:
+                    self.mp_face_mesh = mp.solutions.face_mesh
+                    self.mesh_pool = FaceMeshPool(lambda: self.mp_face_mesh.FaceMesh(
+                        static_image_mode=True,
+                        max_num_faces=1,
+                        refine_landmarks=True,
+                        min_detection_confidence=0.5
+                    ), max_size=self.mesh_pool_size, initial=0)
+                    # Video-mode graph: landmarks are tracked from frame to frame and
+                    # the face detector only re-runs when tracking is lost.
+                    self.tracking_pool = FaceMeshPool(lambda: self.mp_face_mesh.FaceMesh(
+                        static_image_mode=False,
+                        max_num_faces=1,
+                        refine_landmarks=True,
+                        min_detection_confidence=0.5,
+                        min_tracking_confidence=0.5
+                    ), max_size=self.mesh_pool_size, initial=0)
+                    self.detector_pool = FaceMeshPool(lambda: mp.solutions.face_detection.FaceDetection(
+                        model_selection=1,  # full-range model: faces up to ~5 m away
+                        min_detection_confidence=0.5
+                    ), max_size=self.detector_pool_size, initial=0)
+                    print(f"MediaPipe initialized successfully (up to {self.mesh_pool_size} FaceMesh graphs).")
+                except Exception as e:
+                    print(f"WARNING: MediaPipe initialization failed: {e}. Liveness check will be MOCKED.")
+                    self.mesh_pool = None
+                    self.tracking_pool = None
+                    self.detector_pool = None
+            else:
+                print("MediaPipe not available. Liveness check will be MOCKED.")
+            self._pools_loaded = True
+        return self.mesh_pool
+
+    def warm_up(self):
+        """
+        Imports the models and runs one dummy detection, encoding and liveness
+        pass, and fills the FaceMesh pools, so the first real request doesn't
+        pay for model page-in. Runs once per instance; returns seconds per step.
+        """
+        with self._warm_lock:
+            if self.warm_up_timings is not None:
+                return self.warm_up_timings
+            timings = {}
+            start = time.perf_counter()
+            face_recognition_available()
+            self._load_mesh_pools()
+            timings["models"] = time.perf_counter() - start
+
+            image = np.full((240, 320, 3), 128, dtype=np.uint8)
+            cv2.ellipse(image, (160, 120), (60, 80), 0, 0, 360, (200, 170, 150), -1)
+            start = time.perf_counter()
+            self.locate_faces_from_array(image, "fast")
+            timings["detect"] = time.perf_counter() - start
+            start = time.perf_counter()
+            self.encode_faces_from_array(image, [(40, 220, 200, 100)], "fast")
+            timings["encode"] = time.perf_counter() - start
+            start = time.perf_counter()
+            self.check_liveness_from_array(image)
+            if self.mesh_pool is not None:
+                self.mesh_pool.warm(self.mesh_pool.max_size)
+                self.tracking_pool.warm(self.tracking_pool.max_size)
+            timings["liveness"] = time.perf_counter() - start
+            self.warm_up_timings = timings
+            return timings
+
+    def warm_up_quality_gate(self):
+        """
+        warm_up() for an instance that only runs check_quality() (the API
+        process, whose face stages run in the workers): loads MediaPipe and
+        one face detector graph, not the dlib models or FaceMesh graphs.
+        """
+        with self._warm_lock:
+            if self.warm_up_timings is not None:
+                return self.warm_up_timings
+            start = time.perf_counter()
+            self._load_mesh_pools()
+            timings = {"models": time.perf_counter() - start}
+            start = time.perf_counter()
+            self.check_quality(np.full((240, 320, 3), 128, dtype=np.uint8))
+            timings["quality"] = time.perf_counter() - start
+            self.warm_up_timings = timings
+            return timings
+
+    @staticmethod
+    def embedding_model():
+        """
+        current_embedding_model() as seen by this instance's process (run as
+        a stage, it reports what a face worker loaded).
+        """
+        return current_embedding_model()
+
+    @property
+    def stage_timings(self):
+        """
+        Seconds spent per stage by this thread's most recent call ({"detect": ..., "encode": ...}).
+        """
+        timings = getattr(self._local, "stage_timings", None)
+        if timings is None:
+            timings = self._local.stage_timings = {}
+        return timings
+
+    @stage_timings.setter
+    def stage_timings(self, value):
+        self._local.stage_timings = value
+
+    @staticmethod
+    def decode_image(data):
+        """
+        Decodes uploaded image bytes exactly once, in memory.
+        Returns an RGB ndarray (the layout both dlib and MediaPipe expect),
+        or None if the bytes are not a readable image.
+        """
+        if not data:
+            return None
+        bgr = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if bgr is None:
+            return None
+        return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
 
-    def extract_face_encodings(self, image_path):
+    @staticmethod
+    def _load_rgb(image_path):
+        if not os.path.exists(image_path):
+            print(f"Error: Image path not found: {image_path}")
+            return None
+        bgr = cv2.imread(image_path)
+        if bgr is None:
+            return None
+        return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+
+    def extract_face_encodings(self, image_path, profile=DEFAULT_DETECTION_PROFILE):
         """
         Loads image and returns a list of 128-d face encodings.
         Returns empty list if no face found.
         """
-        if FACE_REC_AVAILABLE:
-            try:
-                # Load image file
-                if not os.path.exists(image_path):
-                     print(f"Error: Image path not found: {image_path}")
-                     return []
+        rgb_image = self._load_rgb(image_path)
+        if rgb_image is None:
+            return []
+        return self.extract_face_encodings_from_array(rgb_image, profile)
 
-                image = face_recognition.load_image_file(image_path)
-                face_locations = face_recognition.face_locations(image)
+    def extract_face_encodings_from_array(self, rgb_image, profile=DEFAULT_DETECTION_PROFILE):
+        """
+        Same as extract_face_encodings() but takes an already-decoded RGB ndarray.
+        """
+        return self.extract_faces_from_array(rgb_image, profile)[1]
+
+    @staticmethod
+    def detect_faces(rgb_image, profile=DEFAULT_DETECTION_PROFILE):
+        """
+        Face boxes (top, right, bottom, left) in full-resolution coordinates,
+        detected on a copy downscaled per the profile's max_side.
+        """
+        settings = DETECTION_PROFILES[profile]
+        h, w = rgb_image.shape[:2]
+        scale = 1.0
+        detect_image = rgb_image
+        if settings["max_side"] and max(h, w) > settings["max_side"]:
+            scale = settings["max_side"] / max(h, w)
+            detect_image = cv2.resize(rgb_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        boxes = face_recognition.face_locations(detect_image, number_of_times_to_upsample=settings["upsample"],
+                                                model=settings["model"])
+        if scale == 1.0:
+            return boxes
+        return [
+            (max(0, int(round(top / scale))), min(w, int(round(right / scale))),
+             min(h, int(round(bottom / scale))), max(0, int(round(left / scale))))
+            for top, right, bottom, left in boxes
+        ]
+
+    @staticmethod
+    def largest_faces(face_locations, max_faces):
+        """
+        The max_faces biggest boxes, kept in their original order.
+        """
+        if max_faces is None or len(face_locations) <= max_faces:
+            return face_locations
+        areas = [(bottom - top) * (right - left) for top, right, bottom, left in face_locations]
+        keep = sorted(sorted(range(len(face_locations)), key=lambda i: -areas[i])[:max_faces])
+        print(f"⚠️ {len(face_locations)} faces detected; encoding the {max_faces} largest.")
+        return [face_locations[i] for i in keep]
+
+    def extract_faces_from_array(self, rgb_image, profile=DEFAULT_DETECTION_PROFILE, max_faces=None, encode_limit=None):
+        """
+        Returns (face_locations, encodings) for an RGB ndarray. Locations are
+        (top, right, bottom, left) boxes in the same order as the encodings;
+        in fallback mode the single "face" is the whole image.
+        profile is a DETECTION_PROFILES key. Only the max_faces largest faces
+        are kept; with more than encode_limit faces, encodings is None and
+        the caller encodes them (in parallel, see FaceWorkerPool.encode_faces).
+        """
+        if profile not in DETECTION_PROFILES:
+            raise ValueError(f"Unknown detection profile: {profile}")
+        if face_recognition_available():
+            try:
+                start = time.perf_counter()
+                face_locations = self.largest_faces(self.detect_faces(rgb_image, profile), max_faces)
+                self.stage_timings["detect"] = time.perf_counter() - start
                 
                 if not face_locations:
                     print("No faces detected.")
-                    return []
+                    return [], []
+                if encode_limit is not None and len(face_locations) > encode_limit:
+                    return face_locations, None
                     
-                encodings = face_recognition.face_encodings(image, face_locations)
-                return encodings
+                start = time.perf_counter()
+                encodings = face_recognition.face_encodings(rgb_image, face_locations,
+                                                            num_jitters=DETECTION_PROFILES[profile]["jitters"])
+                self.stage_timings["encode"] = time.perf_counter() - start
+                return face_locations, encodings
             except Exception as e:
                 print(f"Error in face_recognition: {e}. Switching to fallback.")
-                return self._get_fallback_encoding(image_path)
-        else:
-            return self._get_fallback_encoding(image_path)
+        start = time.perf_counter()
+        encodings = self._get_fallback_encoding(rgb_image)
+        self.stage_timings["encode"] = time.perf_counter() - start
+        h, w = rgb_image.shape[:2]
+        return [(0, w, h, 0)] * len(encodings), encodings
+
+    def locate_faces_from_array(self, rgb_image, profile=DEFAULT_DETECTION_PROFILE):
+        """
+        Detection only: face boxes (top, right, bottom, left) without encodings.
+        In fallback mode the whole image is the single "face".
+        """
+        if profile not in DETECTION_PROFILES:
+            raise ValueError(f"Unknown detection profile: {profile}")
+        if face_recognition_available():
+            try:
+                start = time.perf_counter()
+                face_locations = self.detect_faces(rgb_image, profile)
+                self.stage_timings["detect"] = time.perf_counter() - start
+                return face_locations
+            except Exception as e:
+                print(f"Error in face_recognition: {e}. Switching to fallback.")
+        h, w = rgb_image.shape[:2]
+        return [(0, w, h, 0)]
+
+    def encode_faces_from_array(self, rgb_image, face_locations, profile=DEFAULT_DETECTION_PROFILE):
+        """
+        Encodings for already-located faces, in the order of face_locations.
+        """
+        if not face_locations:
+            return []
+        start = time.perf_counter()
+        try:
+            if face_recognition_available():
+                try:
+                    return face_recognition.face_encodings(rgb_image, face_locations,
+                                                           num_jitters=DETECTION_PROFILES[profile]["jitters"])
+                except Exception as e:
+                    print(f"Error in face_recognition: {e}. Switching to fallback.")
+            h, w = rgb_image.shape[:2]
+            encodings = []
+            for top, right, bottom, left in face_locations:
+                crop = rgb_image[max(0, top):min(h, bottom), max(0, left):min(w, right)]
+                encodings.extend(self._get_fallback_encoding(crop if crop.size else rgb_image))
+            return encodings
+        finally:
+            self.stage_timings["encode"] = time.perf_counter() - start
+
+    def encode_faces_shared(self, frame, face_locations, profile=DEFAULT_DETECTION_PROFILE):
+        """
+        encode_faces_from_array() on a frame in shared memory (a
+        face_worker.SharedFrame), so process workers read the caller's pixels
+        instead of receiving a pickled copy of the whole frame each.
+        """
+        shm, rgb_image = frame.attach()
+        try:
+            return self.encode_faces_from_array(rgb_image, face_locations, profile)
+        finally:
+            # The view must be gone before the mapping can be closed
+            del rgb_image
+            shm.close()
 
-    def _get_fallback_encoding(self, image_path):
+    def _get_fallback_encoding(self, rgb_image):
         """
         FALLBACK MODE: Color Histogram Encoding (Deterministic)
         """
         print("FALLBACK MODE: Generating Histogram encoding.")
         try:
-            img = cv2.imread(image_path)
-            if img is None:
-                print(f"Error reading image for fallback: {image_path}")
-                return []
-            
             # Convert to HSV (better than RGB for color/lighting)
-            hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+            hsv = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2HSV)
             
             # Calculate histogram: 8 bins for H, 4 for S, 4 for V = 128 dims
             hist = cv2.calcHist([hsv], [0, 1, 2], None, [8, 4, 4], [0, 180, 0, 256, 0, 256])
@@ -100,20 +570,109 @@ class FaceAuthSystem:
         """
         Simple liveness check based on Eye Aspect Ratio (EAR) from a single image.
         """
-        if not os.path.exists(image_path):
+        rgb_image = self._load_rgb(image_path)
+        if rgb_image is None:
             return False, 0.0
+        return self.check_liveness_from_array(rgb_image)
+
+    def _quality_faces(self, small):
+        """
+        BlazeFace on the downscaled frame: [(x, y, w, h, keypoints)] in
+        relative coordinates, or None when MediaPipe is not available.
+        """
+        if self._load_mesh_pools() is None or self.detector_pool is None:
+            return None
+        try:
+            with self.detector_pool.mesh() as detector:
+                results = detector.process(small)
+        except Exception as e:
+            print(f"Quality: Face detection failed: {e}")
+            return None
+        faces = []
+        for detection in results.detections or []:
+            box = detection.location_data.relative_bounding_box
+            keypoints = [(k.x, k.y) for k in detection.location_data.relative_keypoints]
+            faces.append((box.xmin, box.ymin, box.width, box.height, keypoints))
+        return faces
+
+    def check_quality(self, rgb_image):
+        """
+        Cheap pre-filter for frames that would fail or mis-match after paying
+        for liveness and encoding: blur (variance of the Laplacian), exposure
+        (mean grey level and clipped pixels) and, when MediaPipe is available,
+        the size of the largest face and the pose of a lone face. Everything
+        runs on a copy downscaled to QUALITY_ANALYSIS_SIDE, in a few ms.
+
+        Returns {"ok", "reasons" (codes, see QUALITY_MESSAGES), "messages",
+        "sharpness", "brightness", "face_pixels"}.
+        """
+        start = time.perf_counter()
+        height, width = rgb_image.shape[:2]
+        scale = min(1.0, QUALITY_ANALYSIS_SIDE / max(height, width))
+        small = rgb_image
+        if scale < 1.0:
+            small = cv2.resize(rgb_image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+        small = np.ascontiguousarray(small)
+        gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+        reasons = []
+
+        region, face_pixels = gray, None
+        faces = self._quality_faces(small)
+        if faces:
+            x, y, w, h, keypoints = max(faces, key=lambda f: f[2] * f[3])
+            face_pixels = int(w * width)
+            if face_pixels < QUALITY_MIN_FACE_PIXELS:
+                reasons.append("face_too_small")
+            # Pose only for a lone face: one person turned away in a group
+            # photo shouldn't reject everyone else
+            if len(faces) == 1 and len(keypoints) >= 3:
+                (rx, _), (lx, _), (nx, _) = keypoints[:3]
+                eye_distance = abs(lx - rx)
+                if eye_distance and abs(nx - (lx + rx) / 2) / eye_distance > QUALITY_MAX_YAW:
+                    reasons.append("face_turned")
+            gh, gw = gray.shape
+            x0, y0 = max(0, int(x * gw)), max(0, int(y * gh))
+            x1, y1 = min(gw, int((x + w) * gw)), min(gh, int((y + h) * gh))
+            if x1 - x0 >= 16 and y1 - y0 >= 16:
+                region = gray[y0:y1, x0:x1]
 
-        image = cv2.imread(image_path)
-        if image is None:
+        sharpness = float(cv2.Laplacian(region, cv2.CV_64F).var())
+        if sharpness < QUALITY_MIN_SHARPNESS:
+            reasons.append("blurry")
+        histogram = np.bincount(region.ravel(), minlength=256) / region.size
+        brightness = float(np.dot(histogram, np.arange(256)))
+        if brightness < QUALITY_MIN_BRIGHTNESS or histogram[:16].sum() > QUALITY_MAX_CLIPPED:
+            reasons.append("too_dark")
+        elif brightness > QUALITY_MAX_BRIGHTNESS or histogram[240:].sum() > QUALITY_MAX_CLIPPED:
+            reasons.append("overexposed")
+
+        self.stage_timings["quality"] = time.perf_counter() - start
+        return {
+            "ok": not reasons,
+            "reasons": reasons,
+            "messages": [QUALITY_MESSAGES[r] for r in reasons],
+            "sharpness": round(sharpness, 1),
+            "brightness": round(brightness, 1),
+            "face_pixels": face_pixels,
+        }
+
+    def check_liveness_from_array(self, rgb_image):
+        """
+        Same as check_liveness() but takes an already-decoded RGB ndarray.
+        """
+        if rgb_image is None:
             return False, 0.0
             
-        if self.face_mesh is None:
+        if self._load_mesh_pools() is None:
              # print("Liveness: MediaPipe not available (Mocking success).")
              return True, 0.95
 
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         try:
-            results = self.face_mesh.process(rgb_image)
+            start = time.perf_counter()
+            with self.mesh_pool.mesh() as mesh:
+                results = mesh.process(rgb_image)
+            self.stage_timings["liveness"] = time.perf_counter() - start
         except Exception as e:
              print(f"Liveness: Error processing image: {e}")
              return True, 0.95
@@ -126,15 +685,87 @@ class FaceAuthSystem:
             
         # Mocking success if landmarks found
         # Real liveness check needs EAR calculation, blinking detection over video, etc.
-        # Single image liveness is hard.
+        # Single image liveness is hard (see check_liveness_burst for the blink check).
         return True, 0.95
 
+    def check_liveness_burst(self, frame_blobs, max_frames=LIVENESS_MAX_FRAMES, budget_seconds=LIVENESS_BUDGET_SECONDS):
+        """
+        Blink liveness over a burst of encoded frames (JPEG/PNG bytes).
+        Frames are decoded one at a time, so nothing past the confirming
+        frame is ever decoded.
+        """
+        def frames():
+            for blob in frame_blobs:
+                rgb_image = self.decode_image(blob)
+                if rgb_image is not None:
+                    yield rgb_image
+        return self._liveness_from_frames(frames(), max_frames, budget_seconds)
+
+    def check_liveness_clip(self, clip_bytes, max_frames=LIVENESS_MAX_FRAMES, budget_seconds=LIVENESS_BUDGET_SECONDS):
+        """
+        Blink liveness over a short video clip. OpenCV can only open video
+        from a path, so the clip is spooled to a temporary file.
+        """
+        with tempfile.NamedTemporaryFile(suffix=".clip") as clip_file:
+            clip_file.write(clip_bytes)
+            clip_file.flush()
+            capture = cv2.VideoCapture(clip_file.name)
+
+            def frames():
+                try:
+                    while True:
+                        ok, bgr = capture.read()
+                        if not ok:
+                            return
+                        yield cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+                finally:
+                    capture.release()
+            return self._liveness_from_frames(frames(), max_frames, budget_seconds)
+
+    def _liveness_from_frames(self, frames, max_frames, budget_seconds):
+        """
+        Feeds frames through the tracking FaceMesh and a BlinkDetector,
+        stopping at the first confirmed blink or when the frame/time budget
+        runs out. Returns a dict with is_live, score, blink and frames.
+        """
+        start = time.perf_counter()
+        result = {"is_live": False, "score": 0.0, "blink": False, "frames": 0, "face_frames": 0}
+
+        if self._load_mesh_pools() is None:
+            # Same mock as check_liveness_from_array, after one readable frame
+            for _ in frames:
+                result.update(is_live=True, score=0.95, frames=1)
+                break
+            return result
+
+        mesh = self.tracking_pool.checkout()
+        mesh.reset()
+        detector = BlinkDetector()
+        try:
+            for rgb_image in frames:
+                result["frames"] += 1
+                landmarks = mesh.process(rgb_image).multi_face_landmarks
+                if landmarks:
+                    result["face_frames"] += 1
+                    h, w = rgb_image.shape[:2]
+                    points = landmarks[0].landmark
+                    ear = (eye_aspect_ratio(points, LEFT_EYE, w, h) + eye_aspect_ratio(points, RIGHT_EYE, w, h)) / 2
+                    if detector.update(ear):
+                        result.update(is_live=True, score=0.99, blink=True)
+                        break
+                if result["frames"] >= max_frames or time.perf_counter() - start > budget_seconds:
+                    break
+        finally:
+            self.tracking_pool.checkin(mesh)
+            self.stage_timings["liveness"] = time.perf_counter() - start
+        return result
+
     def match_face(self, unknown_encoding, known_encoding_list, tolerance=0.5):
         """
         Compares unknown encoding with a known encoding.
         Returns (is_match: bool, distance: float)
         """
-        if FACE_REC_AVAILABLE:
+        if face_recognition_available():
             try:
                 known_encoding = np.array(known_encoding_list)
                 # Face distance returns array, we take first element
@@ -166,8 +797,808 @@ class FaceAuthSystem:
             # print(f"FALLBACK MATCH: Dist={dist}")
             
             # Threshold for histograms (tuned loosely)
-            fallback_tolerance = 0.65 
-            return dist < fallback_tolerance, dist
+            return dist < FALLBACK_TOLERANCE, dist
         except Exception as e:
             print(f"Fallback match error: {e}")
             return False, 1.0
+
+
+# --- EMBEDDING STORAGE FORMAT ---
+# users.face_embedding holds base64 text of a 12-byte little-endian header
+#   magic "FE" | version u8 | dtype u8 | dim u16 | model u8 | normalization u8 | crc32 u32
+# followed by dim float32 LE values. Legacy rows keep a JSON float list in
+# users.face_encoding; both are readable.
+EMBEDDING_MAGIC = b"FE"
+EMBEDDING_VERSION = 1
+EMBEDDING_HEADER = struct.Struct("<2sBBHBBI")
+EMBEDDING_DTYPES = {1: np.dtype("<f4")}
+EMBEDDING_MODELS = {"unknown": 0, "dlib_resnet_v1": 1, "hsv_histogram_v1": 2}
+EMBEDDING_MODEL_NAMES = {v: k for k, v in EMBEDDING_MODELS.items()}
+NORM_NONE = 0
+NORM_L2 = 1
+
+
+# Set from the face workers at warm-up (see set_embedding_model)
+_embedding_model = None
+
+
+def current_embedding_model():
+    """
+    Model that produces this process's encodings: dlib when face_recognition
+    is usable, the colour histogram in FALLBACK MODE.
+
+    Never imports face_recognition itself (the import loads the dlib models):
+    it uses the import result if this process already has it, else the name
+    reported by the face workers, else whether the package is installed.
+    """
+    if FACE_REC_AVAILABLE is not None:
+        return "dlib_resnet_v1" if FACE_REC_AVAILABLE else "hsv_histogram_v1"
+    if _embedding_model is not None:
+        return _embedding_model
+    return "dlib_resnet_v1" if importlib.util.find_spec("face_recognition") else "hsv_histogram_v1"
+
+
+def set_embedding_model(model):
+    """
+    Records the model the face workers actually loaded (an API process that
+    doesn't run face stages itself). Returns True if that changes
+    current_embedding_model(), i.e. rows decoded before were filtered by a
+    wrong guess.
+    """
+    global _embedding_model
+    previous = current_embedding_model()
+    _embedding_model = model
+    return current_embedding_model() != previous
+
+
+def encode_embedding(vector, model=None, normalization=None):
+    """
+    Serializes one encoding to the versioned binary format (base64 text).
+    model defaults to current_embedding_model(); histograms are L2-normalized.
+    """
+    model = model or current_embedding_model()
+    if normalization is None:
+        normalization = NORM_L2 if model == "hsv_histogram_v1" else NORM_NONE
+    payload = np.asarray(vector, dtype="<f4").reshape(-1).tobytes()
+    header = EMBEDDING_HEADER.pack(EMBEDDING_MAGIC, EMBEDDING_VERSION, 1, len(payload) // 4,
+                                   EMBEDDING_MODELS[model], normalization, zlib.crc32(payload))
+    return base64.b64encode(header + payload).decode("ascii")
+
+
+def decode_embedding(value):
+    """
+    Parses a stored encoding in either format. Returns (vector, model):
+    vector is a float32 view over the decoded bytes (no per-element parsing),
+    or None when unreadable; model is None for legacy JSON encodings.
+    """
+    if value is None:
+        return None, None
+    if isinstance(value, str):
+        if value.lstrip().startswith("["):
+            value = json.loads(value)  # Legacy list stored as JSON text
+        else:
+            try:
+                raw = base64.b64decode(value, validate=True)
+                magic, version, dtype, dim, model, _, crc = EMBEDDING_HEADER.unpack_from(raw)
+            except (ValueError, struct.error):
+                return None, None
+            payload = memoryview(raw)[EMBEDDING_HEADER.size:]
+            if (magic != EMBEDDING_MAGIC or version != EMBEDDING_VERSION or dtype not in EMBEDDING_DTYPES
+                    or len(payload) != dim * 4 or zlib.crc32(payload) != crc):
+                return None, None
+            vector = np.frombuffer(raw, dtype=EMBEDDING_DTYPES[dtype], count=dim, offset=EMBEDDING_HEADER.size)
+            return vector, EMBEDDING_MODEL_NAMES.get(model, "unknown")
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return np.asarray(value, dtype=np.float32).reshape(-1), None
+    return None, None
+
+
+def guess_legacy_model(vector):
+    """
+    Best guess at which model produced a legacy encoding: dlib descriptors
+    have negative components, colour histograms never do.
+    """
+    return "dlib_resnet_v1" if np.any(np.asarray(vector) < 0) else "hsv_histogram_v1"
+
+
+# --- NEAREST-NEIGHBOUR INDEXES ---
+
+def _exact_topk(probes, matrix, sq_norms, k):
+    """
+    Top-k nearest rows of `matrix` for every probe.
+    Candidates are ranked with the GEMM form of the distance, then the winners
+    are re-measured exactly (float64) so tolerance checks match match_face().
+    Returns (distances[n, k], row_indices[n, k]) sorted nearest first.
+    """
+    k = min(k, matrix.shape[0])
+    p_norms = np.einsum("ij,ij->i", probes, probes)
+    d2 = p_norms[:, None] + sq_norms[None, :] - 2.0 * (probes @ matrix.T)
+    if k < matrix.shape[0]:
+        rows = np.argpartition(d2, k - 1, axis=1)[:, :k]
+    else:
+        rows = np.broadcast_to(np.arange(matrix.shape[0]), (probes.shape[0], k))
+    diff = matrix[rows].astype(np.float64) - probes[:, None, :].astype(np.float64)
+    exact = np.sqrt(np.einsum("nkd,nkd->nk", diff, diff))
+    order = np.argsort(exact, axis=1)
+    return np.take_along_axis(exact, order, axis=1), np.take_along_axis(rows, order, axis=1)
+
+
+def _positions(ids):
+    return {item_id: row for row, item_id in enumerate(ids)}
+
+
+def _position(ids, n, positions, item_id):
+    """
+    Row of item_id in a (ids, size, positions) view, or None.
+    """
+    row = positions.get(item_id)
+    return row if row is not None and row < n and ids[row] == item_id else None
+
+
+def _rows_of(ids, n, positions, item_ids):
+    """
+    Rows (ascending) of the given ids that are in the view: one dict lookup
+    per requested id, however large the index.
+    """
+    rows = (_position(ids, n, positions, item_id) for item_id in set(item_ids))
+    return sorted(row for row in rows if row is not None)
+
+
+class BruteForceIndex:
+    """
+    Exact search over one contiguous float32 matrix. This is the baseline
+    every approximate index is measured against.
+    """
+
+    def __init__(self, dim=ENCODING_DIM):
+        self.dim = dim
+        # (matrix, sq_norms, ids, size, positions) is swapped as one tuple so
+        # searches running concurrently with add/remove always see a consistent
+        # view. positions maps id -> row; add() extends it in place, so readers
+        # only trust rows below their own size.
+        self._state = (np.empty((0, dim), dtype=np.float32), np.empty(0, dtype=np.float32), [], 0, {})
+
+    def __len__(self):
+        return self._state[3]
+
+    @property
+    def nbytes(self):
+        matrix, norms, _, n, _ = self._state
+        return matrix[:n].nbytes + norms[:n].nbytes
+
+    def build(self, vectors, ids):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        ids = list(ids)
+        self._state = (vectors, np.einsum("ij,ij->i", vectors, vectors), ids, len(ids), _positions(ids))
+
+    def add(self, vector, item_id):
+        vector = np.asarray(vector, dtype=np.float32).reshape(self.dim)
+        matrix, norms, ids, n, positions = self._state
+        if n == matrix.shape[0]:
+            # Grow geometrically so repeated registrations stay amortised O(1);
+            # rows [:n] never move once written.
+            grown = np.empty((max(16, n * 2), self.dim), dtype=np.float32)
+            grown[:n] = matrix[:n]
+            grown_norms = np.empty(grown.shape[0], dtype=np.float32)
+            grown_norms[:n] = norms[:n]
+            matrix, norms = grown, grown_norms
+        matrix[n] = vector
+        norms[n] = vector @ vector
+        positions[item_id] = n
+        self._state = (matrix, norms, ids + [item_id], n + 1, positions)
+
+    def remove(self, item_id):
+        matrix, norms, ids, n, positions = self._state
+        idx = _position(ids, n, positions, item_id)
+        if idx is None:
+            return False
+        keep = np.ones(n, dtype=bool)
+        keep[idx] = False
+        # Copy rather than compact in place so concurrent readers keep a valid view
+        ids = ids[:idx] + ids[idx + 1:]
+        self._state = (np.ascontiguousarray(matrix[:n][keep]), norms[:n][keep], ids, n - 1, _positions(ids))
+        return True
+
+    def vectors(self, item_ids):
+        """
+        Returns (matrix, ids) for the given ids that are in the index.
+        """
+        matrix, _, ids, n, positions = self._state
+        rows = _rows_of(ids, n, positions, item_ids)
+        return matrix[rows], [ids[r] for r in rows]
+
+    def search(self, probes, k=1):
+        """
+        Returns (distances[n, k], ids) where ids is a list of n lists.
+        """
+        matrix, norms, ids, n, _ = self._state
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        if n == 0:
+            return np.empty((probes.shape[0], 0)), [[] for _ in range(probes.shape[0])]
+        dists, rows = _exact_topk(probes, matrix[:n], norms[:n], k)
+        return dists, [[ids[r] for r in row] for row in rows]
+
+
+class IVFIndex:
+    """
+    Inverted-file index: a k-means coarse quantizer splits the gallery into
+    `nlist` cells and each search only scans the `nprobe` cells whose
+    centroids are closest to the probe. Raising nprobe trades latency for
+    recall; nprobe == nlist is exact search.
+    """
+
+    def __init__(self, dim=ENCODING_DIM, nlist=None, nprobe=16, kmeans_iters=15, seed=0):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.kmeans_iters = kmeans_iters
+        self.seed = seed
+        self._centroids = np.empty((0, dim), dtype=np.float32)
+        self._cells = []        # per cell: (matrix, sq_norms, ids)
+        self._cell_of = {}      # id -> cell number
+        self._trained_size = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _train(self, vectors):
+        n = vectors.shape[0]
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(self.seed)
+        # k-means on a bounded sample keeps build time flat for huge rosters
+        sample = vectors[rng.choice(n, size=min(n, nlist * 256), replace=False)]
+        centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iters):
+            assign = self._nearest_centroid(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            nonempty = counts > 0
+            centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+            # Re-seed empty cells from random points instead of leaving them dead
+            if not nonempty.all():
+                centroids[~nonempty] = sample[rng.choice(sample.shape[0], size=(~nonempty).sum())]
+        return np.ascontiguousarray(centroids, dtype=np.float32)
+
+    @staticmethod
+    def _nearest_centroid(vectors, centroids):
+        c_norms = np.einsum("ij,ij->i", centroids, centroids)
+        return np.argmin(c_norms[None, :] - 2.0 * (vectors @ centroids.T), axis=1)
+
+    def build(self, vectors, ids):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        ids = list(ids)
+        if not ids:
+            self._centroids = np.empty((0, self.dim), dtype=np.float32)
+            self._cells, self._cell_of = [], {}
+            self._trained_size = self._size = 0
+            return
+        centroids = self._train(vectors)
+        assign = self._nearest_centroid(vectors, centroids)
+        cells, cell_of = [], {}
+        for c in range(centroids.shape[0]):
+            rows = np.flatnonzero(assign == c)
+            matrix = np.ascontiguousarray(vectors[rows])
+            cell_ids = [ids[r] for r in rows]
+            cells.append((matrix, np.einsum("ij,ij->i", matrix, matrix), cell_ids))
+            cell_of.update((i, c) for i in cell_ids)
+        self._centroids, self._cells, self._cell_of = centroids, cells, cell_of
+        self._trained_size = self._size = len(ids)
+
+    def _all_vectors(self):
+        matrices = [cell[0] for cell in self._cells]
+        ids = [i for cell in self._cells for i in cell[2]]
+        if not matrices:
+            return np.empty((0, self.dim), dtype=np.float32), ids
+        return np.vstack(matrices), ids
+
+    def rebuild(self):
+        """
+        Retrains the quantizer on the current contents.
+        """
+        vectors, ids = self._all_vectors()
+        self.build(vectors, ids)
+
+    def add(self, vector, item_id):
+        vector = np.asarray(vector, dtype=np.float32).reshape(1, self.dim)
+        if item_id in self._cell_of:
+            self.remove(item_id)
+        if not self._cells:
+            self.build(vector, [item_id])
+            return
+        c = int(self._nearest_centroid(vector, self._centroids)[0])
+        matrix, norms, ids = self._cells[c]
+        # Copy-on-write per cell: searches holding the old tuple stay consistent
+        self._cells[c] = (
+            np.vstack([matrix, vector]),
+            np.append(norms, np.float32(vector[0] @ vector[0])),
+            ids + [item_id],
+        )
+        self._cell_of[item_id] = c
+        self._size += 1
+        # The quantizer was trained on a much smaller roster; re-fit it
+        if self._size > 4 * max(self._trained_size, 16):
+            self.rebuild()
+
+    def remove(self, item_id):
+        c = self._cell_of.pop(item_id, None)
+        if c is None:
+            return False
+        matrix, norms, ids = self._cells[c]
+        idx = ids.index(item_id)
+        keep = np.ones(len(ids), dtype=bool)
+        keep[idx] = False
+        self._cells[c] = (np.ascontiguousarray(matrix[keep]), norms[keep], ids[:idx] + ids[idx + 1:])
+        self._size -= 1
+        return True
+
+    def vectors(self, item_ids):
+        rows, found = [], []
+        for item_id in item_ids:
+            c = self._cell_of.get(item_id)
+            if c is not None:
+                matrix, _, ids = self._cells[c]
+                rows.append(matrix[ids.index(item_id)])
+                found.append(item_id)
+        return (np.vstack(rows) if rows else np.empty((0, self.dim), dtype=np.float32)), found
+
+    def search(self, probes, k=1, nprobe=None):
+        """
+        Returns (distances[n, k], ids) like BruteForceIndex.search().
+        Distances are exact for the candidates found; only recall is approximate.
+        """
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        cells, centroids = list(self._cells), self._centroids
+        n_probes = probes.shape[0]
+        if not cells or self._size == 0:
+            return np.empty((n_probes, 0)), [[] for _ in range(n_probes)]
+
+        nprobe = min(nprobe or self.nprobe, len(cells))
+        c_norms = np.einsum("ij,ij->i", centroids, centroids)
+        coarse = c_norms[None, :] - 2.0 * (probes @ centroids.T)
+        probe_cells = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe]
+
+        k = min(k, self._size)
+        all_dists = np.full((n_probes, k), np.inf)
+        all_ids = []
+        for p in range(n_probes):
+            chosen = [cells[c] for c in probe_cells[p] if len(cells[c][2])]
+            if not chosen:
+                all_ids.append([])
+                continue
+            matrix = np.vstack([c[0] for c in chosen])
+            norms = np.concatenate([c[1] for c in chosen])
+            ids = [i for c in chosen for i in c[2]]
+            dists, rows = _exact_topk(probes[p:p + 1], matrix, norms, k)
+            all_dists[p, :dists.shape[1]] = dists[0]
+            all_ids.append([ids[r] for r in rows[0]])
+        return all_dists, all_ids
+
+
+def _is_mapped(array):
+    """
+    True if `array` is (a view of) a memory-mapped file.
+    """
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+
+def _spill_rows(vectors, directory=None):
+    """
+    Writes float32 rows to an anonymous (already unlinked) temporary file and
+    maps them read-only, so they live in the page cache rather than the heap.
+    """
+    if not len(vectors):
+        return np.empty((0, vectors.shape[1]), dtype=np.float32)
+    with tempfile.TemporaryFile(dir=directory) as f:
+        f.write(np.ascontiguousarray(vectors, dtype="<f4").tobytes())
+        f.flush()
+        return np.memmap(f, dtype="<f4", mode="r", shape=vectors.shape)
+
+
+class QuantizedIndex:
+    """
+    Brute-force search over an int8 copy of the gallery (per-dimension
+    offset and scale, 4x smaller than float32), converted to float32 one
+    cache-sized block at a time.
+
+    The best `rerank` candidates per probe are then re-measured exactly
+    against the float32 rows, so the reported distances (and the tolerance
+    check on them) are those of full precision; only a true match ranked
+    below `rerank` by the quantized scan could be missed. The float32 rows
+    are not kept on the heap: a memory-mapped matrix (the gallery snapshot)
+    is used in place, anything else is spilled to a mapped temporary file,
+    and a search only pages in its shortlisted rows. Rows add()ed since the
+    last build are held in memory until the next rebuild.
+    """
+
+    BLOCK_ROWS = 1024
+
+    def __init__(self, dim=ENCODING_DIM, rerank=32, spill_dir=None):
+        self.dim = dim
+        self.rerank = rerank
+        self.spill_dir = spill_dir
+        self._mid = np.zeros(dim, dtype=np.float32)
+        self._scale = np.ones(dim, dtype=np.float32)
+        self._fitted_size = 0
+        # (codes, code_norms, ids, size, slots, mapped, added, added_count, positions),
+        # swapped as one tuple like BruteForceIndex. slots[i] is row i's float32
+        # row: mapped[slot], or added[slot - len(mapped)] for rows added since build.
+        self._state = (np.empty((0, dim), dtype=np.int8), np.empty(0, dtype=np.float32), [], 0,
+                       np.empty(0, dtype=np.int32), np.empty((0, dim), dtype=np.float32),
+                       np.empty((0, dim), dtype=np.float32), 0, {})
+
+    def __len__(self):
+        return self._state[3]
+
+    @property
+    def scan_nbytes(self):
+        """
+        Bytes read by every search (codes and their norms).
+        """
+        codes, code_norms, _, n = self._state[:4]
+        return codes[:n].nbytes + code_norms[:n].nbytes
+
+    @property
+    def nbytes(self):
+        """
+        Resident bytes: the codes, their row slots and the rows added since
+        the last build. Mapped float32 rows are page cache, not counted.
+        """
+        n, slots, _, added, added_count = self._state[3:8]
+        return self.scan_nbytes + slots[:n].nbytes + added[:added_count].nbytes
+
+    def _fit(self, vectors):
+        if not len(vectors):
+            return
+        self._fitted_size = len(vectors)
+        lo, hi = vectors.min(axis=0), vectors.max(axis=0)
+        # Headroom so later registrations rarely fall outside the fitted range
+        pad = 0.1 * (hi - lo) + 1e-6
+        self._mid = ((hi + lo) / 2).astype(np.float32)
+        self._scale = ((hi - lo + 2 * pad) / 254).astype(np.float32)
+
+    def _encode(self, vectors):
+        """
+        Returns (codes, squared norms of the decoded rows relative to _mid).
+        """
+        codes = np.clip(np.rint((vectors - self._mid) / self._scale), -127, 127).astype(np.int8)
+        decoded = codes.astype(np.float32) * self._scale
+        return codes, np.einsum("ij,ij->i", decoded, decoded)
+
+    @staticmethod
+    def _rows(state, positions):
+        """
+        float32 rows for an array of index positions, gathered from the
+        mapped matrix (only those pages are read) and the added rows.
+        """
+        slots, mapped, added = state[4][positions], state[5], state[6]
+        out = np.empty(slots.shape + (mapped.shape[1],), dtype=np.float32)
+        in_mapped = slots < len(mapped)
+        out[in_mapped] = mapped[slots[in_mapped]]
+        out[~in_mapped] = added[slots[~in_mapped] - len(mapped)]
+        return out
+
+    def build(self, vectors, ids):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        ids = list(ids)
+        self._fit(vectors)
+        codes, code_norms = self._encode(vectors)
+        mapped = vectors if _is_mapped(vectors) else _spill_rows(vectors, self.spill_dir)
+        self._state = (codes, code_norms, ids, len(ids), np.arange(len(ids), dtype=np.int32),
+                       mapped, np.empty((0, self.dim), dtype=np.float32), 0, _positions(ids))
+
+    def rebuild(self):
+        """
+        Refits the int8 scales on the current contents and moves the rows
+        added since the last build out of memory.
+        """
+        state = self._state
+        n = state[3]
+        self.build(self._rows(state, np.arange(n)), state[2][:n])
+
+    def add(self, vector, item_id):
+        vector = np.asarray(vector, dtype=np.float32).reshape(1, self.dim)
+        codes, code_norms, ids, n, slots, mapped, added, added_count, positions = self._state
+        if n == codes.shape[0]:
+            # Geometric growth; rows [:n] never move once written
+            size = max(16, n * 2)
+            grown = (np.empty((size, self.dim), dtype=np.int8), np.empty(size, dtype=np.float32),
+                     np.empty(size, dtype=np.int32))
+            for new, old in zip(grown, (codes, code_norms, slots)):
+                new[:n] = old[:n]
+            codes, code_norms, slots = grown
+        if added_count == added.shape[0]:
+            grown_added = np.empty((max(16, added_count * 2), self.dim), dtype=np.float32)
+            grown_added[:added_count] = added[:added_count]
+            added = grown_added
+        code, norm = self._encode(vector)
+        codes[n], code_norms[n] = code[0], norm[0]
+        added[added_count] = vector[0]
+        slots[n] = len(mapped) + added_count
+        positions[item_id] = n
+        self._state = (codes, code_norms, ids + [item_id], n + 1, slots, mapped, added, added_count + 1, positions)
+        # The int8 ranges were fitted on a much smaller gallery (or none), or
+        # the in-memory rows have piled up; re-fit and re-map
+        if n + 1 > max(4 * self._fitted_size, self.rerank) or added_count + 1 > max(self.BLOCK_ROWS, n // 8):
+            self.rebuild()
+
+    def remove(self, item_id):
+        codes, code_norms, ids, n, slots, mapped, added, added_count, positions = self._state
+        idx = _position(ids, n, positions, item_id)
+        if idx is None:
+            return False
+        keep = np.ones(n, dtype=bool)
+        keep[idx] = False
+        # The float32 row stays where it is (unreferenced) until the next build
+        ids = ids[:idx] + ids[idx + 1:]
+        self._state = (np.ascontiguousarray(codes[:n][keep]), code_norms[:n][keep], ids,
+                       n - 1, slots[:n][keep], mapped, added, added_count, _positions(ids))
+        return True
+
+    def vectors(self, item_ids):
+        state = self._state
+        ids, n = state[2], state[3]
+        rows = _rows_of(ids, n, state[8], item_ids)
+        return self._rows(state, np.asarray(rows, dtype=np.int32)), [ids[r] for r in rows]
+
+    def search(self, probes, k=1):
+        """
+        Returns (distances[n, k], ids) like BruteForceIndex.search().
+        """
+        state = self._state
+        codes, code_norms, ids, n = state[:4]
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, self.dim)
+        if n == 0:
+            return np.empty((probes.shape[0], 0)), [[] for _ in range(probes.shape[0])]
+
+        # ||p - x||^2 with x = mid + scale * code  ==  ||r||^2 + ||scale*code||^2 - 2 (r*scale) . code
+        residual = probes - self._mid
+        weighted = np.ascontiguousarray(residual * self._scale * -2.0, dtype=np.float32)
+        d2 = np.empty((probes.shape[0], n), dtype=np.float32)
+        # One small reusable float32 buffer: the full matrix is never widened at once
+        buffer = np.empty((min(n, self.BLOCK_ROWS), self.dim), dtype=np.float32)
+        for start in range(0, n, self.BLOCK_ROWS):
+            end = min(n, start + self.BLOCK_ROWS)
+            block = buffer[:end - start]
+            np.copyto(block, codes[start:end], casting="unsafe")
+            np.matmul(weighted, block.T, out=d2[:, start:end])
+        d2 += code_norms[:n]
+        d2 += np.einsum("ij,ij->i", residual, residual)[:, None]
+
+        candidates = min(n, max(k, self.rerank))
+        if candidates < n:
+            rows = np.argpartition(d2, candidates - 1, axis=1)[:, :candidates]
+        else:
+            rows = np.broadcast_to(np.arange(n), (probes.shape[0], n))
+        # Exact float32 re-rank of the shortlisted rows
+        diff = self._rows(state, rows).astype(np.float64) - probes[:, None, :].astype(np.float64)
+        dists = np.sqrt(np.einsum("nkd,nkd->nk", diff, diff))
+        order = np.argsort(dists, axis=1)[:, :min(k, n)]
+        rows = np.take_along_axis(rows, order, axis=1)
+        return np.take_along_axis(dists, order, axis=1), [[ids[r] for r in row] for row in rows]
+
+
+INDEX_TYPES = {
+    "brute": BruteForceIndex,
+    "ivf": IVFIndex,
+    "int8": QuantizedIndex,
+}
+
+
+def make_index(kind="brute", **kwargs):
+    """
+    Builds an empty index by name ("brute", "ivf" or "int8").
+    """
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown face index type: {kind}")
+    return INDEX_TYPES[kind](**kwargs)
+
+
+def recall_report(index, exact_index, probes, k=1, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compares an approximate index against exact search on the same contents.
+    Reports recall@k, how often the match/no-match decision at `tolerance`
+    agrees with exact search, and mean per-probe latency of both.
+    """
+    probes = np.asarray(probes, dtype=np.float32)
+    start = time.perf_counter()
+    exact_d, exact_ids = exact_index.search(probes, k=k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(probes)
+
+    start = time.perf_counter()
+    approx_d, approx_ids = index.search(probes, k=k)
+    approx_ms = (time.perf_counter() - start) * 1000 / len(probes)
+
+    hits = sum(len(set(a) & set(e)) for a, e in zip(approx_ids, exact_ids))
+    total = sum(len(e) for e in exact_ids) or 1
+    decisions_agree = 0
+    for p in range(len(probes)):
+        exact_match = exact_ids[p][0] if exact_d.shape[1] and exact_d[p, 0] <= tolerance else None
+        approx_match = approx_ids[p][0] if approx_ids[p] and approx_d[p, 0] <= tolerance else None
+        decisions_agree += exact_match == approx_match
+    return {
+        "recall_at_k": hits / total,
+        "decision_agreement": decisions_agree / len(probes),
+        "exact_ms_per_probe": exact_ms,
+        "approx_ms_per_probe": approx_ms,
+    }
+
+
+class FaceGallery:
+    """
+    Process-resident gallery of every enrolled face.
+
+    Encodings live in a nearest-neighbour index (exact brute force by default)
+    so a whole frame of probes is matched against all users in one vectorized
+    search instead of one match_face() call per user.
+    """
+
+    def __init__(self, dim=ENCODING_DIM, index=None):
+        self.dim = dim
+        self.loaded = False
+        self.index = index if index is not None else BruteForceIndex(dim)
+        self._lock = threading.Lock()
+        self._users = {}
+        # Rows add()ed since the last load, re-applied by load_matrix(keep_local=True)
+        self._local_rows = {}
+        # Bumped on every change, so derived structures (session sub-galleries) know to rebuild
+        self.version = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    @staticmethod
+    def _user_record(user):
+        # Keep everything except the (large) encoding for notifications/results
+        return {k: v for k, v in user.items() if k not in ("face_encoding", "face_embedding")}
+
+    def _coerce_encoding(self, user):
+        """
+        The row's encoding as a float32 vector, from face_embedding (binary
+        format) or the legacy face_encoding list. None if missing, malformed
+        or produced by a different model than this process uses.
+        """
+        vec, model = decode_embedding(user.get("face_embedding"))
+        if vec is None:
+            vec, model = decode_embedding(user.get("face_encoding"))
+        if vec is None or vec.shape[0] != self.dim:
+            return None
+        if model not in (None, "unknown") and model != current_embedding_model():
+            return None
+        return vec
+
+    def decode_rows(self, users):
+        """
+        Decodes user rows (as returned by supabase: dicts with id, name and
+        face_embedding or the legacy face_encoding) into (matrix, ids, records),
+        skipping rows without a usable encoding.
+        """
+        rows, ids, records = [], [], {}
+        for user in users:
+            vec = self._coerce_encoding(user)
+            if vec is None:
+                continue
+            rows.append(vec)
+            ids.append(user["id"])
+            records[user["id"]] = self._user_record(user)
+        matrix = np.vstack(rows) if rows else np.empty((0, self.dim), dtype=np.float32)
+        return matrix, ids, records
+
+    def load(self, users):
+        """
+        Replaces the gallery contents with the given user rows.
+        """
+        self.load_matrix(*self.decode_rows(users))
+
+    def load_matrix(self, matrix, ids, records, keep_local=False):
+        """
+        Replaces the gallery contents with an already-decoded float32 matrix
+        (which may be a read-only memory map; indexes keep a view where they
+        can). With keep_local, rows add()ed since the previous load that the
+        new contents don't include yet are added back on top.
+        """
+        with self._lock:
+            self.index.build(matrix, ids)
+            self._users = dict(records)
+            local, self._local_rows = self._local_rows, {}
+            self.loaded = True
+            self.version += 1
+        if keep_local:
+            for user_id, user in local.items():
+                if user_id not in records:
+                    self.add(user)
+        print(f"Gallery loaded with {len(ids)} encodings ({type(self.index).__name__}).")
+
+    def add(self, user):
+        """
+        Adds (or replaces) a single user, e.g. after a successful /register.
+        Returns False if the row has no usable encoding.
+        """
+        vec = self._coerce_encoding(user)
+        if vec is None:
+            return False
+        with self._lock:
+            if user["id"] in self._users:
+                self.index.remove(user["id"])
+            self.index.add(vec, user["id"])
+            self._users[user["id"]] = self._user_record(user)
+            self._local_rows[user["id"]] = user
+            self.version += 1
+        return True
+
+    def get_user(self, user_id):
+        return self._users.get(user_id)
+
+    def subset(self, user_ids):
+        """
+        A new exact-search gallery holding only the given users (e.g. one
+        class roster). Ids without a usable encoding are left out.
+        """
+        with self._lock:
+            matrix, ids = self.index.vectors(user_ids)
+            records = {i: self._users[i] for i in ids}
+        sub = FaceGallery(self.dim)
+        with sub._lock:
+            sub.index.build(matrix, ids)
+            sub._users = records
+            sub.loaded = True
+        return sub
+
+    def records(self):
+        return list(self._users.values())
+
+    def export(self):
+        """
+        (matrix, ids, records) of the current contents, the shape
+        decode_rows() returns, e.g. to write a snapshot generation.
+        """
+        with self._lock:
+            matrix, ids = self.index.vectors(list(self._users))
+            records = {i: self._users[i] for i in ids}
+        return matrix, ids, records
+
+    def remove(self, user_id):
+        with self._lock:
+            self._local_rows.pop(user_id, None)
+            if self._users.pop(user_id, None) is None:
+                return False
+            self.version += 1
+            return self.index.remove(user_id)
+
+    def match(self, encodings, tolerance=None):
+        """
+        Matches every probe encoding against every enrolled user at once.
+        Returns a list (one per probe) of (user_record or None, distance).
+        Tolerance semantics follow match_face(): <= DEFAULT_TOLERANCE with
+        face_recognition, < FALLBACK_TOLERANCE for histogram encodings.
+        """
+        encodings = list(encodings)
+        if not encodings:
+            return []
+        probes = np.vstack([np.asarray(e, dtype=np.float32).reshape(1, -1) for e in encodings])
+        dists, ids = self.index.search(probes, k=1)
+        users = self._users
+
+        results = []
+        for p, found in enumerate(ids):
+            if not found:
+                results.append((None, 1.0))
+                continue
+            dist = float(dists[p, 0])
+            if tolerance is not None:
+                is_match = dist <= tolerance
+            elif current_embedding_model() == "dlib_resnet_v1":
+                is_match = dist <= DEFAULT_TOLERANCE
+            else:
+                is_match = dist < FALLBACK_TOLERANCE
+            results.append((users.get(found[0]) if is_match else None, dist))
+        return results
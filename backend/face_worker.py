@@ -0,0 +1,257 @@
+import os
+import math
+import time
+import asyncio
+import threading
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+
+from face_auth import FaceAuthSystem
+from utils.metrics import metrics, stage_seconds
+
+# --- CONFIGURATION ---
+# "process" sidesteps the GIL for dlib; "thread" avoids pickling frames and
+# is fine where the native code releases the GIL.
+FACE_WORKER_MODE = os.getenv("FACE_WORKER_MODE", "process")
+FACE_WORKERS = int(os.getenv("FACE_WORKERS", os.cpu_count() or 1))
+# How process workers are started. By the time the pool starts this process
+# runs MediaPipe/dlib/BLAS threads, and forking a threaded process can leave
+# a child deadlocked on a lock one of them held, so "fork" is not the default.
+FACE_WORKER_START_METHOD = os.getenv(
+    "FACE_WORKER_START_METHOD", "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+# Tasks allowed to be running or queued before new requests get a 503
+FACE_QUEUE_LIMIT = int(os.getenv("FACE_QUEUE_LIMIT", FACE_WORKERS * 4))
+# Seconds a single stage (liveness, encoding, ...) may take before a 504
+FACE_STAGE_TIMEOUT = float(os.getenv("FACE_STAGE_TIMEOUT", "15"))
+# Seconds allowed for a worker's first model load and warm-up pass
+FACE_WARMUP_TIMEOUT = float(os.getenv("FACE_WARMUP_TIMEOUT", "180"))
+# A frame's encodings are split across workers in tasks of at least this many
+# faces, so from twice this many faces on (see bench_parallel_encoding.py)
+FACE_PARALLEL_MIN_FACES = int(os.getenv("FACE_PARALLEL_MIN_FACES", "8"))
+
+
+class PoolSaturated(Exception):
+    """
+    Raised when the worker queue is full. retry_after is a hint in seconds.
+    """
+    def __init__(self, retry_after):
+        super().__init__(f"Face worker pool is busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class StageTimeout(Exception):
+    pass
+
+
+class SharedFrame:
+    """
+    An image copied once into shared memory. It pickles as just the segment
+    name, shape and dtype, so every process worker maps the same pages
+    instead of receiving its own copy of the frame.
+    """
+
+    def __init__(self, array):
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        self.name = self._shm.name
+        np.ndarray(self.shape, self.dtype, buffer=self._shm.buf)[...] = array
+
+    def __getstate__(self):
+        return {"name": self.name, "shape": self.shape, "dtype": self.dtype}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, _shm=None)
+
+    def attach(self):
+        """
+        Returns (segment, read-only ndarray view). Close the segment once the
+        view is no longer referenced.
+        """
+        shm = shared_memory.SharedMemory(name=self.name)
+        view = np.ndarray(self.shape, self.dtype, buffer=shm.buf)
+        view.flags.writeable = False
+        return shm, view
+
+    def close(self):
+        """
+        Owner only: releases the segment. Workers still mapping it keep a
+        valid view until they close theirs.
+        """
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+queue_wait_seconds = metrics.histogram(
+    "face_worker_queue_wait_seconds", "Time face tasks waited for a free worker.", ("stage",))
+rejected_total = metrics.counter(
+    "face_worker_rejected_total", "Face tasks rejected because the queue was full, or timed out.", ("reason",))
+
+
+# Each process worker owns a FaceAuthSystem with a single FaceMesh graph.
+# Thread workers share one instance whose FaceMesh pool has a graph per
+# thread, so concurrent liveness checks never touch the same graph.
+_local = threading.local()
+
+def _init_worker(face_auth=None):
+    _local.face_auth = face_auth or FaceAuthSystem(mesh_pool_size=1)
+    # Load models before taking the first task (runs once per shared instance)
+    try:
+        _local.face_auth.warm_up()
+    except Exception as e:
+        print(f"WARNING: Face worker warm-up failed: {e}")
+
+def _run_stage(stage, args):
+    face_auth = getattr(_local, "face_auth", None)
+    if face_auth is None:
+        _init_worker()
+        face_auth = _local.face_auth
+    face_auth.stage_timings = {}
+    start = time.perf_counter()
+    result = getattr(face_auth, stage)(*args)
+    # Timings travel back with the result so process workers can report them too
+    return result, time.perf_counter() - start, face_auth.stage_timings
+
+
+class FaceWorkerPool:
+    """
+    Runs CPU-bound FaceAuthSystem stages off the event loop, with a bounded
+    queue (fast PoolSaturated instead of unbounded waiting) and a per-stage timeout.
+    """
+
+    def __init__(self, workers=FACE_WORKERS, mode=FACE_WORKER_MODE,
+                 max_pending=FACE_QUEUE_LIMIT, stage_timeout=FACE_STAGE_TIMEOUT):
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.max_pending = max(1, max_pending)
+        self.stage_timeout = stage_timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        # Smoothed task duration, used for the Retry-After hint
+        self._avg_seconds = 0.5
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def _get_executor(self):
+        # Created lazily so importing main.py doesn't fork workers
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.mode == "thread":
+                        shared = FaceAuthSystem(mesh_pool_size=self.workers)
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                            initargs=(shared,), thread_name_prefix="face-worker")
+                    else:
+                        # Workers must share this process's resource tracker: one of
+                        # their own would "clean up" SharedFrame segments at exit.
+                        # Started first, so the fork server and workers inherit it.
+                        resource_tracker.ensure_running()
+                        context = multiprocessing.get_context(FACE_WORKER_START_METHOD)
+                        if FACE_WORKER_START_METHOD == "forkserver":
+                            # Imported once in the fork server rather than in every
+                            # worker (preloading __main__ stops each child re-running it)
+                            context.set_forkserver_preload(["__main__", __name__])
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                             mp_context=context)
+                    print(f"Face worker pool started: {self.workers} {self.mode} workers, queue limit {self.max_pending}.")
+        return self._executor
+
+    def _retry_after(self):
+        return max(1, math.ceil(self._avg_seconds * self._pending / self.workers))
+
+    def _on_done(self, future):
+        with self._lock:
+            self._pending -= 1
+            if not future.cancelled() and future.exception() is None:
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * future.result()[1]
+
+    async def run(self, stage, *args, timeout=None):
+        """
+        Runs FaceAuthSystem.<stage>(*args) in a worker and awaits the result.
+        Raises PoolSaturated when the queue is full and StageTimeout when the
+        stage exceeds its timeout.
+        """
+        executor = self._get_executor()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                rejected_total.inc("queue_full")
+                raise PoolSaturated(self._retry_after())
+            self._pending += 1
+        try:
+            future = executor.submit(_run_stage, stage, args)
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+        # The slot is released when the task really finishes, even after a
+        # timeout, so abandoned work still counts against the queue limit.
+        future.add_done_callback(self._on_done)
+        submitted = time.perf_counter()
+        try:
+            result, seconds, timings = await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.stage_timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            rejected_total.inc("timeout")
+            raise StageTimeout(f"{stage} exceeded {timeout or self.stage_timeout}s")
+        queue_wait_seconds.observe(max(0.0, time.perf_counter() - submitted - seconds), stage)
+        for name, value in timings.items():
+            stage_seconds.observe(value, name)
+        return result
+
+    def encode_limit(self, min_faces=FACE_PARALLEL_MIN_FACES):
+        """
+        Most faces encode_faces() would still encode as a single chunk (None
+        with one worker: it never splits). Detection stages should encode up
+        to this many inline rather than ship the frame to another worker.
+        """
+        if self.workers < 2:
+            return None
+        return 2 * max(1, min_faces) - 1
+
+    async def encode_faces(self, rgb_image, face_locations, profile, min_faces=FACE_PARALLEL_MIN_FACES):
+        """
+        Encodes the faces of one frame, split into contiguous chunks of at
+        least min_faces across the workers (a lecture-hall photo), and
+        returns the encodings in box order. Process workers get the frame
+        through shared memory.
+        """
+        n = len(face_locations)
+        chunks = min(self.workers, n // max(1, min_faces))
+        if chunks <= 1:
+            return await self.run("encode_faces_from_array", rgb_image, face_locations, profile)
+        # Near-equal parts, so none falls below min_faces (n // chunks >= min_faces)
+        bounds = [n * i // chunks for i in range(chunks + 1)]
+        parts = [face_locations[a:b] for a, b in zip(bounds, bounds[1:])]
+        if self.mode == "thread":
+            results = await asyncio.gather(*(self.run("encode_faces_from_array", rgb_image, part, profile) for part in parts))
+        else:
+            frame = SharedFrame(rgb_image)
+            try:
+                results = await asyncio.gather(*(self.run("encode_faces_shared", frame, part, profile) for part in parts))
+            finally:
+                frame.close()
+        return [encoding for part in results for encoding in part]
+
+    async def warm_up(self, timeout=FACE_WARMUP_TIMEOUT):
+        """
+        Starts every worker (each loads its models before taking work) and
+        returns the slowest time per warm-up step across them.
+        """
+        results = await asyncio.gather(*(self.run("warm_up", timeout=timeout) for _ in range(self.workers)))
+        slowest = {}
+        for timings in results:
+            for step, seconds in timings.items():
+                slowest[step] = max(seconds, slowest.get(step, 0.0))
+        return slowest
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
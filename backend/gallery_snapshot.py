@@ -0,0 +1,285 @@
+"""
+On-disk face gallery snapshot shared by every worker on a host.
+
+Layout (little-endian):
+    [0, 4096)        header: magic, version, dim, count, generation, model,
+                     created_at, meta offset/length (rest zero-padded)
+    [4096, ...)      count x dim float32 matrix, C order
+    [meta offset..)  JSON: user records (id, name, email, phone) in row order,
+                     and [id, updated_at micros] of every user row read
+
+Workers np.memmap the matrix read-only, so all processes share one
+page-cache copy and a restart reads a local file instead of the network.
+Writers build a temporary file and os.replace() it over the old one, so
+readers never see a partial snapshot; each write bumps the generation.
+A worker that registers users publishes a new generation with them, so
+a worker restarted before the snapshot ages out still sees them.
+
+Usage:
+    python gallery_snapshot.py rebuild [path]   # fetch users from Supabase and write
+    python gallery_snapshot.py info [path]
+"""
+import os
+import sys
+import json
+import time
+import struct
+import tempfile
+from contextlib import contextmanager, nullcontext
+import numpy as np
+from face_auth import FaceGallery, EMBEDDING_MODELS, EMBEDDING_MODEL_NAMES, current_embedding_model
+from gallery_sync import row_versions
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are not serialized
+    fcntl = None
+
+# --- CONFIGURATION ---
+# Empty disables the snapshot (every worker fetches from Supabase)
+GALLERY_SNAPSHOT = os.getenv("GALLERY_SNAPSHOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gallery.snapshot"))
+# Seconds between cheap stat() checks for a newer snapshot
+GALLERY_SNAPSHOT_POLL = float(os.getenv("GALLERY_SNAPSHOT_POLL", "5"))
+# Older snapshots are ignored at startup and rebuilt from Supabase
+GALLERY_SNAPSHOT_MAX_AGE = float(os.getenv("GALLERY_SNAPSHOT_MAX_AGE", "3600"))
+
+MAGIC = b"FGSNAP\x00\x01"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQB3xdQQ")
+DATA_OFFSET = 4096
+
+USER_COLUMNS = "id, name, email, phone"
+
+
+def fetch_user_rows(client):
+    """
+    Every user row with its encoding, binary format first, plus updated_at
+    for incremental sync. Older schemas (see add_columns.sql) get the
+    columns they have.
+    """
+    attempts = [f"{USER_COLUMNS}, updated_at, face_embedding, face_encoding",
+                f"{USER_COLUMNS}, face_embedding, face_encoding",
+                f"{USER_COLUMNS}, face_encoding"]
+    for columns in attempts[:-1]:
+        try:
+            return client.table("users").select(columns).execute().data or []
+        except Exception as e:
+            print(f"⚠️ Gallery query for ({columns}) failed ({e}); trying fewer columns.")
+    return client.table("users").select(attempts[-1]).execute().data or []
+
+
+class GallerySnapshot:
+    """
+    A snapshot opened for reading; `matrix` is a read-only memory map.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError(f"{path}: truncated header")
+            (magic, version, self.dim, self.count, self.generation, model,
+             self.created_at, meta_offset, meta_length) = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path}: not a gallery snapshot (version {version})")
+            f.seek(meta_offset)
+            meta = json.loads(f.read(meta_length))
+        # Snapshots written before sync versions were stored hold just the records
+        if isinstance(meta, list):
+            self.records, self.versions = meta, None
+        else:
+            self.records = meta["records"]
+            self.versions = {user_id: micros for user_id, micros in meta["versions"]}
+        self.model = EMBEDDING_MODEL_NAMES.get(model, "unknown")
+        if len(self.records) != self.count:
+            raise ValueError(f"{path}: {len(self.records)} records for {self.count} rows")
+        self.ids = [r["id"] for r in self.records]
+        if self.count:
+            self.matrix = np.memmap(path, dtype="<f4", mode="r", offset=DATA_OFFSET, shape=(self.count, self.dim))
+        else:
+            self.matrix = np.empty((0, self.dim), dtype=np.float32)
+
+
+def read_generation(path):
+    try:
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+        magic, _, _, _, generation = HEADER.unpack(header)[:5]
+        return generation if magic == MAGIC else 0
+    except (OSError, struct.error):
+        return 0
+
+
+@contextmanager
+def _writer_lock(path):
+    if fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def write_snapshot(path, matrix, ids, records, model=None, locked=False, created_at=None, versions=None):
+    """
+    Atomically replaces the snapshot at `path`. Returns the new generation.
+    Pass locked=True when the caller already holds the writer lock, and
+    created_at when the rows were read earlier than now. `versions` is
+    row_versions() of the rows the matrix was decoded from.
+    """
+    matrix = np.ascontiguousarray(matrix, dtype="<f4")
+    count, dim = matrix.shape
+    meta = json.dumps({"records": [records[i] for i in ids],
+                       "versions": list((versions or {}).items())}, default=str).encode()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with (nullcontext() if locked else _writer_lock(path)):
+        generation = read_generation(path) + 1
+        header = HEADER.pack(MAGIC, VERSION, dim, count, generation, EMBEDDING_MODELS[model or current_embedding_model()],
+                             created_at or time.time(), DATA_OFFSET + matrix.nbytes, len(meta))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(header.ljust(DATA_OFFSET, b"\0"))
+                f.write(matrix.tobytes())
+                f.write(meta)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    return generation
+
+
+class GallerySnapshotStore:
+    """
+    Connects a FaceGallery to the snapshot file: loads from it, writes it
+    after a network load, and picks up newer generations written by other
+    workers (or `gallery_snapshot.py rebuild`).
+    """
+
+    def __init__(self, path=GALLERY_SNAPSHOT, poll_seconds=GALLERY_SNAPSHOT_POLL, max_age=GALLERY_SNAPSHOT_MAX_AGE):
+        self.path = path
+        self.poll_seconds = poll_seconds
+        self.max_age = max_age
+        self.generation = 0
+        self.created_at = None  # build time of the loaded/written snapshot
+        self.versions = None    # its row_versions(), None for older snapshots
+        self.reloads = 0
+        self._signature = None
+        self._last_poll = 0.0
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    @contextmanager
+    def lock(self):
+        """
+        Held while checking for a snapshot and building one, so workers that
+        start together make one Supabase fetch between them.
+        """
+        with _writer_lock(self.path):
+            yield
+
+    def load_into(self, gallery, keep_local=False, max_age=None):
+        """
+        Loads the snapshot into `gallery`. Returns False if there is none,
+        it is unreadable, was built by another model, or is older than max_age.
+        """
+        signature = self._stat_signature()
+        if signature is None:
+            return False
+        try:
+            snapshot = GallerySnapshot(self.path)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring gallery snapshot {self.path}: {e}")
+            return False
+        if snapshot.model != current_embedding_model() or snapshot.dim != gallery.dim:
+            print(f"⚠️ Gallery snapshot was built for {snapshot.model}/{snapshot.dim}d; ignoring it.")
+            return False
+        if max_age is not None and time.time() - snapshot.created_at > max_age:
+            print(f"Gallery snapshot is older than {max_age:.0f}s; rebuilding from Supabase.")
+            return False
+        gallery.load_matrix(snapshot.matrix, snapshot.ids, {r["id"]: r for r in snapshot.records}, keep_local=keep_local)
+        self.generation = snapshot.generation
+        self.created_at = snapshot.created_at
+        self.versions = snapshot.versions
+        self._signature = signature
+        print(f"Gallery snapshot generation {snapshot.generation} mapped from {self.path}.")
+        return True
+
+    def save(self, matrix, ids, records, locked=False, created_at=None, versions=None):
+        try:
+            self.created_at = created_at or time.time()
+            self.versions = versions
+            self.generation = write_snapshot(self.path, matrix, ids, records, locked=locked,
+                                             created_at=self.created_at, versions=versions)
+            self._signature = self._stat_signature()
+        except OSError as e:
+            print(f"⚠️ Failed to write gallery snapshot {self.path}: {e}")
+
+    def publish(self, gallery, versions=None):
+        """
+        Writes the gallery's current contents (e.g. after a registration) as
+        a new generation, so workers that start later don't map a snapshot
+        without the new rows. A generation written meanwhile by another
+        worker is merged in first. Rows keep the age of the snapshot they
+        were loaded from (created_at is unchanged). Returns True if a newer
+        generation was merged.
+        """
+        with self.lock():
+            merged = read_generation(self.path) != self.generation and self.load_into(gallery, keep_local=True)
+            versions = {**(self.versions or {}), **(versions or {})} or None
+            self.save(*gallery.export(), locked=True, created_at=self.created_at, versions=versions)
+        return merged
+
+    def refresh(self, gallery):
+        """
+        Cheap poll (at most one stat() per poll_seconds): reloads the gallery
+        when another writer has replaced the snapshot. Returns True on reload.
+        """
+        now = time.monotonic()
+        if now - self._last_poll < self.poll_seconds:
+            return False
+        self._last_poll = now
+        signature = self._stat_signature()
+        if signature is None or signature == self._signature:
+            return False
+        if self.load_into(gallery, keep_local=True):
+            self.reloads += 1
+            return True
+        self._signature = signature  # Unusable file: don't retry until it changes again
+        return False
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "info"
+    path = sys.argv[2] if len(sys.argv) > 2 else GALLERY_SNAPSHOT
+    if command == "rebuild":
+        from database import supabase
+        start, fetched_at = time.perf_counter(), time.time()
+        rows = fetch_user_rows(supabase)
+        matrix, ids, records = FaceGallery().decode_rows(rows)
+        generation = write_snapshot(path, matrix, ids, records, created_at=fetched_at, versions=row_versions(rows))
+        print(f"✅ Wrote {len(ids)} encodings to {path} (generation {generation}) in {time.perf_counter() - start:.2f}s")
+    elif command == "info":
+        snapshot = GallerySnapshot(path)
+        age = time.time() - snapshot.created_at
+        print(f"{path}: generation {snapshot.generation}, {snapshot.count} x {snapshot.dim} ({snapshot.model}), "
+              f"{os.path.getsize(path) / 1e6:.1f} MB, {age:.0f}s old")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Incremental face gallery sync.
+
+Instead of re-selecting every user, each instance polls for rows whose
+updated_at is past its high-water mark and for deletions recorded in
+user_tombstones (both maintained by triggers, see add_columns.sql), so a
+refresh costs O(churn) rather than O(roster). A periodic reconcile compares
+a checksum of (id, updated_at) over the whole table with the local one and,
+only when they differ, diffs the id manifest and re-fetches the drifted rows.
+"""
+import os
+import re
+import time
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+
+# --- CONFIGURATION ---
+# Seconds between delta polls, and between full checksum reconciles
+GALLERY_SYNC_SECONDS = float(os.getenv("GALLERY_SYNC_SECONDS", "10"))
+GALLERY_RECONCILE_SECONDS = float(os.getenv("GALLERY_RECONCILE_SECONDS", "900"))
+# Each poll re-reads this many seconds before the high-water mark, so rows
+# committed late by slow transactions (or with clock skew) are not missed
+GALLERY_SYNC_OVERLAP = float(os.getenv("GALLERY_SYNC_OVERLAP", "30"))
+
+SYNC_PAGE = 500
+SYNC_COLUMNS = "id, name, email, phone, updated_at, face_embedding, face_encoding"
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+TIMESTAMP_PATTERN = re.compile(
+    r"(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(?:\.(\d{1,6})\d*)?\s*(Z|[+-]\d\d(?::?\d\d)?)?$")
+
+
+def timestamp_micros(value):
+    """
+    Microseconds since the epoch for a PostgREST timestamp string
+    ("2026-01-02T03:04:05.123+00:00"); naive values are taken as UTC.
+    """
+    m = TIMESTAMP_PATTERN.match(str(value).strip())
+    if m is None:
+        raise ValueError(f"Unrecognized timestamp: {value!r}")
+    year, month, day, hour, minute, second = (int(g) for g in m.groups()[:6])
+    fraction, zone = m.group(7) or "", m.group(8)
+    offset = 0
+    if zone and zone != "Z":
+        digits = zone[1:].replace(":", "")
+        offset = (int(digits[:2]) * 60 + int(digits[2:4] or 0)) * 60 * (1 if zone[0] == "+" else -1)
+    stamp = datetime(year, month, day, hour, minute, second, tzinfo=timezone.utc)
+    delta = stamp - EPOCH
+    return ((delta.days * 86400 + delta.seconds - offset) * 1_000_000) + int(fraction.ljust(6, "0") or 0)
+
+
+def format_micros(micros):
+    # UTC with a "Z" suffix: a "+00:00" offset would need escaping in filters
+    return (EPOCH + timedelta(microseconds=micros)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def row_versions(rows):
+    """
+    {id: updated_at micros} for every fetched user row, encoded or not, so a
+    full load seeds the same set gallery_checksum() is computed over.
+    """
+    return {row["id"]: timestamp_micros(row["updated_at"]) for row in rows if row.get("updated_at")}
+
+
+def version_checksum(versions):
+    """
+    Same digest as the gallery_checksum() SQL function: md5 of
+    "id@updated_at_micros" joined by "," in byte order of id.
+    """
+    body = ",".join(f"{user_id}@{versions[user_id]}" for user_id in sorted(versions, key=str))
+    return hashlib.md5(body.encode()).hexdigest()
+
+
+class GallerySync:
+    """
+    Keeps a FaceGallery in step with the users table. `versions` holds the
+    updated_at of every row this instance has seen (including rows without
+    a usable encoding), which is what the checksum is computed over.
+    """
+
+    def __init__(self, client, gallery, page_size=SYNC_PAGE, overlap=GALLERY_SYNC_OVERLAP):
+        self.client = client
+        self.gallery = gallery
+        self.page_size = page_size
+        self.overlap_us = int(overlap * 1_000_000)
+        self.enabled = None  # None until probe()
+        self.versions = {}
+        self.row_mark = None  # updated_at micros the next poll starts from
+        self.tombstone_mark = None
+        self.stats = {"polls": 0, "rows": 0, "deleted": 0, "reconciles": 0, "drift": 0}
+        self.last_poll_at = None
+        self._lock = threading.Lock()
+
+    def probe(self):
+        """
+        Checks that the sync columns/tables exist; sync stays off otherwise.
+        """
+        try:
+            self.client.table("users").select("id, updated_at").limit(1).execute()
+            self.client.table("user_tombstones").select("user_id, deleted_at").limit(1).execute()
+            self.enabled = True
+        except Exception as e:
+            print(f"⚠️ Incremental gallery sync unavailable ({e}). Run add_columns.sql to enable it.")
+            self.enabled = False
+        return self.enabled
+
+    def rebase(self, loaded_at, versions=None):
+        """
+        Resets the cursors after the gallery was (re)loaded in full, from
+        Supabase or a snapshot built at `loaded_at` (epoch seconds).
+        `versions` comes from row_versions() over every row read; without it
+        (older snapshots) only the gallery's encoded rows are known, and the
+        next reconcile diffs the manifest to pick up the rest.
+        """
+        with self._lock:
+            if versions is None:
+                versions = row_versions(self.gallery.records())
+            self.versions = dict(versions)
+            since = int(loaded_at * 1_000_000)
+            newest = max(versions.values(), default=since)
+            self.row_mark = min(newest, since) - self.overlap_us
+            self.tombstone_mark = since - self.overlap_us
+
+    def _apply(self, row):
+        version = timestamp_micros(row["updated_at"])
+        if self.versions.get(row["id"]) == version:
+            return 0
+        self.versions[row["id"]] = version
+        if not self.gallery.add(row):
+            # Encoding cleared or unreadable: the row can no longer match
+            self.gallery.remove(row["id"])
+        return 1
+
+    def _fetch_and_apply(self, user_ids):
+        changed = 0
+        for start in range(0, len(user_ids), self.page_size):
+            chunk = user_ids[start:start + self.page_size]
+            for row in self.client.table("users").select(SYNC_COLUMNS).in_("id", chunk).execute().data or []:
+                changed += self._apply(row)
+        return changed
+
+    def _pages(self, table, columns, time_column, id_column, since_us):
+        """
+        Rows with time_column >= since, in (time, id) keyset pages so a burst
+        of rows sharing one timestamp (a bulk insert) can't stall the cursor.
+        """
+        last = None
+        while True:
+            query = self.client.table(table).select(columns)
+            if last is None:
+                query = query.gte(time_column, format_micros(since_us))
+            else:
+                ts = format_micros(last[0])
+                query = query.or_(f"{time_column}.gt.{ts},and({time_column}.eq.{ts},{id_column}.gt.{last[1]})")
+            rows = query.order(time_column).order(id_column).limit(self.page_size).execute().data or []
+            yield from rows
+            if len(rows) < self.page_size:
+                return
+            last = (timestamp_micros(rows[-1][time_column]), rows[-1][id_column])
+
+    def poll(self):
+        """
+        Applies rows changed and deleted since the last poll.
+        Returns (changed, deleted).
+        """
+        if not self.enabled or self.row_mark is None:
+            return 0, 0
+        with self._lock:
+            deleted = 0
+            newest = self.row_mark + self.overlap_us
+            # Versions first: rows in the overlap window that were already
+            # applied cost a few bytes each, not a full encoding
+            stale = []
+            for row in self._pages("users", "id, updated_at", "updated_at", "id", self.row_mark):
+                version = timestamp_micros(row["updated_at"])
+                newest = max(newest, version)
+                if self.versions.get(row["id"]) != version:
+                    stale.append(row["id"])
+            changed = self._fetch_and_apply(stale)
+            newest_deletion = self.tombstone_mark + self.overlap_us
+            for row in self._pages("user_tombstones", "user_id, deleted_at", "deleted_at", "user_id", self.tombstone_mark):
+                when = timestamp_micros(row["deleted_at"])
+                newest_deletion = max(newest_deletion, when)
+                self.versions.pop(row["user_id"], None)
+                if self.gallery.remove(row["user_id"]):
+                    deleted += 1
+            self.row_mark = newest - self.overlap_us
+            self.tombstone_mark = newest_deletion - self.overlap_us
+            self.stats["polls"] += 1
+            self.stats["rows"] += changed
+            self.stats["deleted"] += deleted
+            self.last_poll_at = time.time()
+        if changed or deleted:
+            print(f"🔄 Gallery sync: {changed} changed, {deleted} deleted ({len(self.gallery)} encodings)")
+        return changed, deleted
+
+    def _remote_checksum(self):
+        data = self.client.rpc("gallery_checksum").execute().data
+        row = data[0] if isinstance(data, list) else data
+        return int(row["row_count"]), row["checksum"]
+
+    def reconcile(self):
+        """
+        Full drift check. The checksum comparison transfers one row; only on
+        a mismatch is the (id, updated_at) manifest pulled and diffed, and
+        just the drifted rows re-fetched. Returns the number of rows fixed.
+        """
+        if not self.enabled:
+            return 0
+        with self._lock:
+            self.stats["reconciles"] += 1
+            try:
+                if self._remote_checksum() == (len(self.versions), version_checksum(self.versions)):
+                    return 0
+            except Exception as e:
+                print(f"⚠️ gallery_checksum() unavailable ({e}); diffing the id manifest instead.")
+
+            remote, last_id = {}, None
+            while True:
+                query = self.client.table("users").select("id, updated_at").order("id").limit(self.page_size)
+                if last_id is not None:
+                    query = query.gt("id", last_id)
+                rows = query.execute().data or []
+                remote.update((r["id"], timestamp_micros(r["updated_at"])) for r in rows)
+                if len(rows) < self.page_size:
+                    break
+                last_id = rows[-1]["id"]
+
+            stale = [user_id for user_id, version in remote.items() if self.versions.get(user_id) != version]
+            gone = [user_id for user_id in self.versions if user_id not in remote]
+            for user_id in gone:
+                del self.versions[user_id]
+                self.gallery.remove(user_id)
+            self._fetch_and_apply(stale)
+            drift = len(stale) + len(gone)
+            self.stats["drift"] += drift
+        if drift:
+            print(f"⚠️ Gallery reconcile fixed {drift} drifted rows ({len(stale)} stale, {len(gone)} removed)")
+        return drift
@@ -0,0 +1,174 @@
+import os
+import itertools
+import cv2
+import numpy as np
+
+# --- CONFIGURATION ---
+# Run the face detector on every Nth streamed frame; boxes are carried
+# across the frames in between by optical flow.
+KIOSK_DETECT_EVERY = int(os.getenv("KIOSK_DETECT_EVERY", "5"))
+# Minimum overlap for a detection to continue an existing track
+KIOSK_IOU_THRESHOLD = float(os.getenv("KIOSK_IOU_THRESHOLD", "0.3"))
+# Detections a track needs before it is recognized (filters one-off false positives)
+KIOSK_CONFIRM_HITS = int(os.getenv("KIOSK_CONFIRM_HITS", "2"))
+# Consecutive detection rounds a track may be missing before it is dropped
+KIOSK_MAX_MISSES = int(os.getenv("KIOSK_MAX_MISSES", "2"))
+# Recognition attempts per track before it is given up as unknown
+KIOSK_RECOGNIZE_ATTEMPTS = int(os.getenv("KIOSK_RECOGNIZE_ATTEMPTS", "3"))
+# Optical flow runs on a grey copy whose longest side is at most this
+FLOW_MAX_SIDE = 320
+
+
+def iou(a, b):
+    """
+    Intersection over union of two (top, right, bottom, left) boxes.
+    """
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0, bottom - top) * max(0, right - left)
+    if inter == 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return inter / float(area_a + area_b - inter)
+
+
+class Track:
+    """
+    One face followed across frames. state is "pending" until recognition
+    succeeds ("recognized") or runs out of attempts ("unknown").
+    """
+
+    def __init__(self, track_id, box):
+        self.id = track_id
+        self.box = box
+        self.hits = 1
+        self.misses = 0
+        self.state = "pending"
+        self.attempts = 0
+        self.user = None
+        self.confidence = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "box": [int(v) for v in self.box],
+            "state": self.state,
+            "name": self.user["name"] if self.user else None,
+        }
+
+
+class FaceTracker:
+    """
+    Cheap multi-face tracker for a single camera stream.
+
+    update() associates a fresh set of detections with the live tracks by
+    greedy IoU; propagate() moves every track by the median Lucas-Kanade
+    flow of a few points inside its box, so frames without a detection cost
+    one small grey resize plus one optical-flow call.
+    """
+
+    def __init__(self, iou_threshold=KIOSK_IOU_THRESHOLD, confirm_hits=KIOSK_CONFIRM_HITS,
+                 max_misses=KIOSK_MAX_MISSES, max_attempts=KIOSK_RECOGNIZE_ATTEMPTS):
+        self.iou_threshold = iou_threshold
+        self.confirm_hits = confirm_hits
+        self.max_misses = max_misses
+        self.max_attempts = max_attempts
+        self.tracks = []
+        self._ids = itertools.count(1)
+        self._prev_gray = None
+        self._scale = 1.0
+
+    def _gray(self, rgb_image):
+        h, w = rgb_image.shape[:2]
+        self._scale = min(1.0, FLOW_MAX_SIDE / max(h, w))
+        small = rgb_image
+        if self._scale < 1.0:
+            small = cv2.resize(rgb_image, None, fx=self._scale, fy=self._scale, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+
+    def update(self, rgb_image, boxes):
+        """
+        Detection frame: matches `boxes` to tracks, starts tracks for new
+        faces and drops tracks that have been missing too long.
+        """
+        self._prev_gray = self._gray(rgb_image)
+        pairs = sorted(
+            ((iou(track.box, box), t, d) for t, track in enumerate(self.tracks) for d, box in enumerate(boxes)),
+            reverse=True,
+        )
+        used_tracks, used_boxes = set(), set()
+        for overlap, t, d in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if t in used_tracks or d in used_boxes:
+                continue
+            used_tracks.add(t)
+            used_boxes.add(d)
+            track = self.tracks[t]
+            track.box = tuple(int(v) for v in boxes[d])
+            track.hits += 1
+            track.misses = 0
+
+        survivors = []
+        for t, track in enumerate(self.tracks):
+            if t not in used_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    continue
+            survivors.append(track)
+        for d, box in enumerate(boxes):
+            if d not in used_boxes:
+                survivors.append(Track(next(self._ids), tuple(int(v) for v in box)))
+        self.tracks = survivors
+
+    def propagate(self, rgb_image):
+        """
+        Frame without detection: shifts every track by its median optical flow.
+        """
+        gray = self._gray(rgb_image)
+        prev, self._prev_gray = self._prev_gray, gray
+        if prev is None or prev.shape != gray.shape or not self.tracks:
+            return
+        s = self._scale
+        points, owners = [], []
+        for i, (top, right, bottom, left) in enumerate(track.box for track in self.tracks):
+            # 4x4 grid over the inner part of the box (edges are mostly background)
+            ys = np.linspace(top + 0.2 * (bottom - top), bottom - 0.2 * (bottom - top), 4) * s
+            xs = np.linspace(left + 0.2 * (right - left), right - 0.2 * (right - left), 4) * s
+            for y in ys:
+                for x in xs:
+                    points.append((x, y))
+                    owners.append(i)
+        points = np.array(points, dtype=np.float32).reshape(-1, 1, 2)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(prev, gray, points, None, winSize=(15, 15), maxLevel=2)
+        if moved is None:
+            return
+        deltas = (moved - points).reshape(-1, 2) / s
+        ok = status.reshape(-1).astype(bool)
+        owners = np.array(owners)
+        h, w = rgb_image.shape[:2]
+        for i, track in enumerate(self.tracks):
+            mask = ok & (owners == i)
+            if not mask.any():
+                continue
+            dx, dy = np.median(deltas[mask], axis=0)
+            top, right, bottom, left = track.box
+            dx = int(round(min(max(dx, -left), w - right)))
+            dy = int(round(min(max(dy, -top), h - bottom)))
+            track.box = (top + dy, right + dx, bottom + dy, left + dx)
+
+    def due_for_recognition(self):
+        """
+        Confirmed tracks still waiting to be recognized.
+        """
+        return [t for t in self.tracks
+                if t.state == "pending" and t.hits >= self.confirm_hits and t.misses == 0]
+
+    def recognition_failed(self, track):
+        track.attempts += 1
+        if track.attempts >= self.max_attempts:
+            track.state = "unknown"
+
+    def snapshot(self):
+        return [track.to_dict() for track in self.tracks]
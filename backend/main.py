@@ -1,19 +1,37 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Form
-from fastapi.responses import JSONResponse
+from startup import startup_report, PROCESS_START
+from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Form, BackgroundTasks, Request, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 import uvicorn
 import os
 import uuid
-import shutil
-import numpy as np
+import time
+import json
+import base64
+import asyncio
+import threading
 import cv2
-from datetime import datetime
-from face_auth import FaceAuthSystem
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from face_auth import FaceAuthSystem, FaceGallery, make_index, encode_embedding, set_embedding_model, DETECTION_PROFILES
+from face_worker import FaceWorkerPool, PoolSaturated, StageTimeout
+from attendance_writer import AttendanceWriter
+from attendance_dedup import AttendanceCooldown, cooldown_scope, ATTENDANCE_COOLDOWN_SYNC_SECONDS
+from match_batcher import MatchBatcher
+from blob_store import make_blob_store, crop_key, make_face_thumbnail, KEY_PATTERN
+from event_hub import EventHub
+from kiosk import FaceTracker, KIOSK_DETECT_EVERY
+from gallery_snapshot import GallerySnapshotStore, GALLERY_SNAPSHOT, fetch_user_rows
+from gallery_sync import GallerySync, GALLERY_SYNC_SECONDS, GALLERY_RECONCILE_SECONDS, timestamp_micros, row_versions
+from sessions import SessionRegistry, SESSION_CACHE_SECONDS, SESSION_GLOBAL_FALLBACK
 from database import supabase
 from utils.notifications import send_email, send_sms
-from utils.geo import is_within_radius
+from utils.geo import is_within_radius, GeofenceRegistry, RadiusFence
+from utils.response_cache import ResponseCache
+from utils.result_cache import ResultCache, upload_key
+from utils.metrics import metrics, span
 
 app = FastAPI(title="AI Smart Attendance")
 
@@ -30,6 +48,48 @@ MAX_DISTANCE_METERS = 200  # Allow 200m radius
 # Set to False to only log warnings (recommended for testing)
 ENFORCE_GEOFENCING = False
 
+# Every room/building/site, as a JSON list of fences (see utils.geo.GeofenceRegistry.load).
+# Without a file, the single CLASSROOM_COORDS / MAX_DISTANCE_METERS fence is used.
+GEOFENCES_FILE = os.getenv("GEOFENCES_FILE", "")
+geofences = GeofenceRegistry()
+if GEOFENCES_FILE:
+    geofences.load_json(GEOFENCES_FILE)
+    print(f"Loaded {len(geofences)} geofences from {GEOFENCES_FILE}")
+else:
+    geofences.add(RadiusFence("classroom", CLASSROOM_COORDS["lat"], CLASSROOM_COORDS["lng"], MAX_DISTANCE_METERS, name="Classroom"))
+
+# Gallery search index: "brute" (exact), "ivf" (approximate, for very large rosters),
+# or "int8" (quantized scan, exact float32 re-rank of memory-mapped rows).
+# FACE_INDEX_NPROBE is the IVF recall/latency knob (see bench_index.py);
+# FACE_INDEX_RERANK is how many quantized candidates are re-ranked (see bench_quantization.py).
+FACE_INDEX = os.getenv("FACE_INDEX", "brute")
+FACE_INDEX_NPROBE = int(os.getenv("FACE_INDEX_NPROBE", "16"))
+FACE_INDEX_RERANK = int(os.getenv("FACE_INDEX_RERANK", "32"))
+
+# Detection profile per endpoint: "fast", "balanced" or "accurate" (see face_auth.DETECTION_PROFILES).
+# Registration builds the stored template, so it defaults to the most accurate pipeline.
+PROFILE_REGISTER = os.getenv("FACE_PROFILE_REGISTER", "accurate")
+PROFILE_ATTENDANCE = os.getenv("FACE_PROFILE_ATTENDANCE", "balanced")
+PROFILE_LOGIN = os.getenv("FACE_PROFILE_LOGIN", "fast")
+PROFILE_KIOSK = os.getenv("FACE_PROFILE_KIOSK", "fast")
+# Reject blurry, badly exposed or tiny-face frames before liveness and encoding
+# (thresholds: QUALITY_* in face_auth.py)
+QUALITY_GATE = os.getenv("QUALITY_GATE", "true").lower() == "true"
+# Faces encoded per /mark_attendance frame; a crowded photo keeps the largest
+MAX_FACES_PER_FRAME = int(os.getenv("MAX_FACES_PER_FRAME", "80"))
+
+# Liveness results and encodings of recent uploads, keyed by a hash of the
+# bytes, so client retries and double submits skip straight to matching.
+# FACE_CACHE_TTL=0 disables the cache.
+FACE_CACHE_TTL = float(os.getenv("FACE_CACHE_TTL", "120"))
+FACE_CACHE_MAX_MB = float(os.getenv("FACE_CACHE_MAX_MB", "64"))
+# Settings that change what is cached are part of the key
+ATTENDANCE_CACHE_NAMESPACE = f"attendance:{PROFILE_ATTENDANCE}:{MAX_FACES_PER_FRAME}:{QUALITY_GATE}"
+LOGIN_CACHE_NAMESPACE = f"login:{PROFILE_LOGIN}:{QUALITY_GATE}"
+for _profile in (PROFILE_REGISTER, PROFILE_ATTENDANCE, PROFILE_LOGIN, PROFILE_KIOSK):
+    if _profile not in DETECTION_PROFILES:
+        raise ValueError(f"Unknown detection profile '{_profile}', expected one of {list(DETECTION_PROFILES)}")
+
 
 # CORS
 app.add_middleware(
@@ -40,6 +100,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- METRICS ---
+requests_total = metrics.counter("http_requests_total", "Requests handled, by endpoint and status.", ("endpoint", "status"))
+request_seconds = metrics.histogram("http_request_seconds", "Request latency by endpoint.", ("endpoint",))
+kiosk_frames_total = metrics.counter("kiosk_frames_total", "Kiosk stream frames, by how they were handled.", ("kind",))
+quality_checks_total = metrics.counter("quality_checks_total", "Frames checked by the image-quality gate, by endpoint and outcome.", ("endpoint", "outcome"))
+quality_rejections_total = metrics.counter("quality_rejections_total", "Image-quality rejections, by endpoint and reason.", ("endpoint", "reason"))
+quality_sharpness = metrics.histogram("quality_sharpness", "Variance of the Laplacian of checked frames.",
+                                      buckets=(10, 20, 40, 80, 160, 320, 640, 1280))
+
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template (/student/{user_id}), not raw path, to bound cardinality
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        requests_total.inc(endpoint, status)
+        request_seconds.observe(time.perf_counter() - start, endpoint)
+
 @app.exception_handler(500)
 async def internal_exception_handler(request, exc):
     import traceback
@@ -52,12 +136,442 @@ async def internal_exception_handler(request, exc):
 
 
 
-face_auth = FaceAuthSystem()
+# This process only decodes uploads and runs the quality gate; liveness and
+# encoding run in face_pool's workers, which load their own models. So no
+# FaceMesh graph, and detector graphs only as concurrent quality checks need them.
+face_auth = FaceAuthSystem(mesh_pool_size=1, detector_pool_size=os.cpu_count() or 1)
+face_pool = FaceWorkerPool()
+attendance_writer = AttendanceWriter(supabase)
+attendance_cooldown = AttendanceCooldown(supabase)
+blob_store = make_blob_store()
+face_result_cache = ResultCache(max_bytes=int(FACE_CACHE_MAX_MB * 1024 * 1024), ttl=FACE_CACHE_TTL)
+history_cache = ResponseCache(ttl=float(os.getenv("HISTORY_CACHE_TTL", "10")))
+attendance_writer.listeners.append(history_cache.invalidate)
+attendance_hub = EventHub()
+
+def _publish_attendance(rows):
+    """
+    Writer listener: pushes newly inserted attendance rows to live dashboards,
+    shaped like /attendance/history records.
+    """
+    for row in rows:
+        record = {k: v for k, v in row.items() if k != "captured_image"}
+        user = gallery.get_user(row.get("user_id"))
+        record["users"] = {"name": user["name"]} if user else None
+        attendance_hub.publish({"type": "attendance", "record": record})
+
+attendance_writer.listeners.append(_publish_attendance)
+
+metrics.gauge("app_ready", "1 once models are warm and the gallery is loaded.", lambda: int(startup_report.ready))
+metrics.gauge("face_worker_queue_depth", "Face tasks running or queued.", lambda: face_pool.pending)
+metrics.gauge("attendance_writer_queue_depth", "Attendance rows buffered for the next batch.", lambda: attendance_writer.pending)
+metrics.gauge("attendance_rows_written_total", "Attendance rows inserted.", lambda: attendance_writer.stats["rows"], kind="counter")
+metrics.gauge("attendance_insert_calls_total", "Multi-row insert calls made.", lambda: attendance_writer.stats["inserts"], kind="counter")
+metrics.gauge("attendance_insert_retries_total", "Insert retries.", lambda: attendance_writer.stats["retries"], kind="counter")
+metrics.gauge("attendance_duplicates_suppressed_total", "Matches answered \"already marked\" without a new row.",
+              lambda: attendance_cooldown.stats["suppressed"], kind="counter")
+metrics.gauge("attendance_cooldown_entries", "Users in their attendance cooldown window.", lambda: len(attendance_cooldown))
+metrics.gauge("gallery_size", "Encodings in the resident face gallery.", lambda: len(gallery))
+metrics.gauge("live_feed_subscribers", "Open /ws/attendance connections.", lambda: len(attendance_hub))
+metrics.gauge("face_cache_hits_total", "Uploads whose liveness/encodings came from the cache or an identical in-flight request.",
+              lambda: face_result_cache.stats["hits"] + face_result_cache.stats["coalesced"], kind="counter")
+metrics.gauge("face_cache_coalesced_total", "Uploads that waited on an identical in-flight request.",
+              lambda: face_result_cache.stats["coalesced"], kind="counter")
+metrics.gauge("face_cache_misses_total", "Uploads analyzed from scratch.", lambda: face_result_cache.stats["misses"], kind="counter")
+metrics.gauge("face_cache_evictions_total", "Entries evicted to stay under FACE_CACHE_MAX_MB.",
+              lambda: face_result_cache.stats["evictions"], kind="counter")
+metrics.gauge("face_cache_bytes", "Estimated bytes held by the upload result cache.", lambda: face_result_cache.bytes)
+metrics.gauge("history_cache_hits_total", "History responses served from cache.", lambda: history_cache.hits, kind="counter")
+metrics.gauge("history_cache_misses_total", "History responses computed.", lambda: history_cache.misses, kind="counter")
+if FACE_INDEX == "ivf":
+    gallery_index = make_index("ivf", nprobe=FACE_INDEX_NPROBE)
+elif FACE_INDEX == "int8":
+    gallery_index = make_index(FACE_INDEX, rerank=FACE_INDEX_RERANK)
+else:
+    gallery_index = make_index(FACE_INDEX)
+gallery = FaceGallery(index=gallery_index)
+# Concurrent requests' probes are matched in one scan (see match_batcher.py)
+match_batcher = MatchBatcher()
+metrics.gauge("match_batches_total", "Batched gallery scans.", lambda: match_batcher.stats["batches"], kind="counter")
+metrics.gauge("match_requests_total", "Match calls served by the batcher.", lambda: match_batcher.stats["requests"], kind="counter")
+
+# Memory-mapped snapshot shared by the workers on this host (see gallery_snapshot.py)
+gallery_snapshots = GallerySnapshotStore(GALLERY_SNAPSHOT) if GALLERY_SNAPSHOT else None
+metrics.gauge("gallery_snapshot_generation", "Generation of the mapped gallery snapshot (0 = none).",
+              lambda: gallery_snapshots.generation if gallery_snapshots else 0)
+
+# Delta sync: applies rows changed/deleted by other instances (see gallery_sync.py)
+gallery_sync = GallerySync(supabase, gallery)
+metrics.gauge("gallery_sync_rows_total", "User rows applied by incremental gallery sync.", lambda: gallery_sync.stats["rows"], kind="counter")
+metrics.gauge("gallery_sync_deletes_total", "Users removed by gallery sync tombstones.", lambda: gallery_sync.stats["deleted"], kind="counter")
+metrics.gauge("gallery_sync_drift_total", "Rows fixed by the periodic gallery reconcile.", lambda: gallery_sync.stats["drift"], kind="counter")
+
+def _load_gallery():
+    """
+    Full load. Returns the time (epoch seconds) the rows were read at and
+    the sync versions of every row read (see gallery_sync.rebase).
+    """
+    if gallery_snapshots is None:
+        print("Loading face gallery from Supabase...")
+        fetched_at = time.time()
+        with span("gallery_fetch"):
+            rows = fetch_user_rows(supabase)
+            gallery.load(rows)
+        return fetched_at, row_versions(rows)
+    # One worker fetches and writes the snapshot; the others wait and map it
+    with gallery_snapshots.lock():
+        if gallery_snapshots.load_into(gallery, max_age=gallery_snapshots.max_age):
+            return gallery_snapshots.created_at, gallery_snapshots.versions
+        print("Loading face gallery from Supabase...")
+        fetched_at = time.time()
+        with span("gallery_fetch"):
+            rows = fetch_user_rows(supabase)
+            matrix, ids, records = gallery.decode_rows(rows)
+        versions = row_versions(rows)
+        gallery.load_matrix(matrix, ids, records)
+        gallery_snapshots.save(matrix, ids, records, locked=True, created_at=fetched_at, versions=versions)
+        return fetched_at, versions
+
+_gallery_load_lock = threading.Lock()
+# Set by /register: the next snapshot poll writes a generation with the new rows
+_gallery_changed = threading.Event()
+
+def _ensure_gallery():
+    """
+    Loads the gallery from the local snapshot (or Supabase when there is no
+    fresh one) unless it is loaded already. Blocking: run it in a thread.
+    """
+    with _gallery_load_lock:
+        if not gallery.loaded:
+            gallery_sync.rebase(*_load_gallery())
+    return gallery
+
+def _refresh_gallery_snapshot():
+    """
+    Writes a new generation after registrations on this worker, else
+    reloads the gallery if another writer replaced the snapshot. Blocking.
+    """
+    with _gallery_load_lock:
+        if not gallery.loaded:
+            return
+        if _gallery_changed.is_set():
+            _gallery_changed.clear()
+            merged = gallery_snapshots.publish(gallery, gallery_sync.versions.copy() if gallery_sync.enabled else None)
+        else:
+            merged = gallery_snapshots.refresh(gallery)
+        if merged:
+            gallery_sync.rebase(gallery_snapshots.created_at, gallery_snapshots.versions)
+
+async def get_gallery():
+    """
+    Returns the process-resident face gallery. Request paths only read it:
+    the load (normally done by warm-up) runs in a worker thread, and newer
+    snapshot generations are picked up by _gallery_snapshot_loop.
+    """
+    if not gallery.loaded:
+        await asyncio.to_thread(_ensure_gallery)
+    return gallery
+
+async def _gallery_snapshot_loop():
+    """
+    Writes and picks up snapshot generations, off the event loop (a reload
+    parses every record and rebuilds the index).
+    """
+    while True:
+        await asyncio.sleep(gallery_snapshots.poll_seconds)
+        try:
+            await asyncio.to_thread(_refresh_gallery_snapshot)
+        except Exception as e:
+            print(f"⚠️ Gallery snapshot refresh failed: {e}")
+
+# Class sessions: roster-scoped sub-galleries, cached per open session (see sessions.py)
+session_registry = SessionRegistry(supabase)
+metrics.gauge("session_gallery_builds_total", "Session sub-galleries built.", lambda: session_registry.stats["builds"], kind="counter")
+
+async def _session_prebuild_loop():
+    """
+    Builds the sub-gallery of every open session ahead of its first request.
+    """
+    while True:
+        if gallery.loaded:
+            try:
+                await asyncio.to_thread(session_registry.prebuild, gallery)
+            except Exception as e:
+                print(f"⚠️ Session prebuild failed: {e}")
+        await asyncio.sleep(SESSION_CACHE_SECONDS)
+
+async def _gallery_sync_loop():
+    """
+    Polls for changed users every GALLERY_SYNC_SECONDS and reconciles the
+    whole gallery every GALLERY_RECONCILE_SECONDS.
+    """
+    # Without the sync schema, re-check rarely (it may be migrated while running)
+    while not await asyncio.to_thread(gallery_sync.probe):
+        await asyncio.sleep(GALLERY_RECONCILE_SECONDS)
+    last_reconcile = time.monotonic()
+    while True:
+        await asyncio.sleep(GALLERY_SYNC_SECONDS)
+        if not gallery.loaded:
+            continue
+        try:
+            await asyncio.to_thread(gallery_sync.poll)
+            if time.monotonic() - last_reconcile >= GALLERY_RECONCILE_SECONDS:
+                last_reconcile = time.monotonic()
+                await asyncio.to_thread(gallery_sync.reconcile)
+        except Exception as e:
+            print(f"⚠️ Gallery sync failed: {e}")
+
+async def _attendance_cooldown_loop():
+    """
+    Seeds the attendance cooldown index from recent rows, then pulls in marks
+    written by other instances every ATTENDANCE_COOLDOWN_SYNC_SECONDS.
+    """
+    if not attendance_cooldown.enabled:
+        return
+    while True:
+        try:
+            await asyncio.to_thread(attendance_cooldown.sync)
+        except Exception as e:
+            print(f"⚠️ Attendance cooldown sync failed: {e}")
+        await asyncio.sleep(ATTENDANCE_COOLDOWN_SYNC_SECONDS)
+
+def _insert_user(data, encoding):
+    """
+    Inserts a user with the binary face_embedding, or with the legacy JSON
+    face_encoding when the database doesn't have that column yet.
+    """
+    try:
+        return supabase.table("users").insert(dict(data, face_embedding=encode_embedding(encoding))).execute()
+    except Exception as e:
+        if "face_embedding" not in str(e):
+            raise
+        print("⚠️ users.face_embedding column missing; storing the legacy JSON encoding (see add_columns.sql).")
+        # Convert numpy array to list for JSON storage
+        return supabase.table("users").insert(dict(data, face_encoding=encoding.tolist())).execute()
+
+@contextmanager
+def face_pool_errors():
+    """
+    Maps a full face worker queue to 503 + Retry-After and a slow stage to 504.
+    """
+    try:
+        yield
+    except PoolSaturated as e:
+        print(f"⚠️ Face worker queue full ({face_pool.pending} pending). Rejecting with 503.")
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": str(e.retry_after)})
+    except StageTimeout as e:
+        print(f"⚠️ {e}")
+        raise HTTPException(status_code=504, detail="Face processing timed out")
+
+async def run_face_stage(stage, *args):
+    """
+    Runs a CPU-bound FaceAuthSystem stage in the worker pool so the event loop
+    stays free.
+    """
+    with face_pool_errors():
+        return await face_pool.run(stage, *args)
+
+async def run_face_encode(rgb_image, face_locations, profile):
+    """
+    FaceWorkerPool.encode_faces() (split across workers for crowded frames).
+    """
+    with face_pool_errors():
+        return await face_pool.encode_faces(rgb_image, face_locations, profile)
+
+async def check_image_quality(rgb_image, endpoint):
+    """
+    Image-quality gate (FaceAuthSystem.check_quality): rejects a bad frame
+    with 422 and what to fix, before it costs a liveness and encoding pass.
+    Runs on the event loop's thread pool: it takes a few ms and shipping the
+    frame to a face worker would cost about as much.
+    """
+    if not QUALITY_GATE:
+        return
+    with span("quality"):
+        report = await asyncio.to_thread(face_auth.check_quality, rgb_image)
+    quality_sharpness.observe(report["sharpness"])
+    quality_checks_total.inc(endpoint, "accepted" if report["ok"] else "rejected")
+    if report["ok"]:
+        return
+    for reason in report["reasons"]:
+        quality_rejections_total.inc(endpoint, reason)
+    print(f"❌ Image quality: {', '.join(report['reasons'])} "
+          f"(sharpness={report['sharpness']}, brightness={report['brightness']}, face_pixels={report['face_pixels']})")
+    raise HTTPException(status_code=422, detail=" ".join(report["messages"]))
+
+async def _analyze_attendance_frame(rgb_image, burst):
+    """
+    The CPU-heavy part of /mark_attendance, cached per upload: quality gate,
+    liveness (blink check when the client sent a burst, else single frame)
+    and, for a live frame, face boxes and encodings.
+    """
+    await check_image_quality(rgb_image, "mark_attendance")
+    print("Checking liveness...")
+    if burst:
+        liveness = await run_face_stage("check_liveness_burst", burst)
+        is_live, liveness_score = liveness["is_live"], liveness["score"]
+    else:
+        is_live, liveness_score = await run_face_stage("check_liveness_from_array", rgb_image)
+    if not is_live:
+        return {"liveness": (is_live, liveness_score), "faces": ([], [])}
+
+    print("Extracting face encodings...")
+    face_locations, encodings = await run_face_stage("extract_faces_from_array", rgb_image, PROFILE_ATTENDANCE,
+                                                     MAX_FACES_PER_FRAME, face_pool.encode_limit())
+    if encodings is None:
+        # Group photo: per-face encoding is split across the worker pool
+        print(f"Encoding {len(face_locations)} faces in parallel...")
+        encodings = await run_face_encode(rgb_image, face_locations, PROFILE_ATTENDANCE)
+    return {"liveness": (is_live, liveness_score), "faces": (face_locations, encodings)}
+
+async def _warm_up_phase(name, fn):
+    """
+    Runs one startup phase until it succeeds, backing off between attempts.
+    """
+    delay = 1
+    while True:
+        try:
+            with startup_report.phase(name):
+                return await fn()
+        except Exception as e:
+            print(f"⚠️ Startup phase '{name}' failed ({e}); retrying in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+async def _warm_up_workers():
+    """
+    Warms every face worker, then takes the embedding model name from them
+    so this process never has to import face_recognition (and dlib) itself.
+    """
+    timings = await face_pool.warm_up()
+    if set_embedding_model(await face_pool.run("embedding_model")) and gallery.loaded:
+        print("⚠️ Face workers use a different embedding model than assumed; reloading the gallery.")
+        gallery.loaded = False
+    return timings
+
+async def _warm_up():
+    """
+    Background warm-up: loads the quality-gate detector in this process and
+    the models in every face worker (one dummy detection/encoding/liveness
+    pass each), then preloads the gallery. /readyz turns 200 when all of it
+    is done.
+    """
+    await _warm_up_phase("models", lambda: asyncio.to_thread(face_auth.warm_up_quality_gate) if QUALITY_GATE
+                         else asyncio.sleep(0))
+    worker_timings = await _warm_up_phase("workers", _warm_up_workers)
+    for step, seconds in worker_timings.items():
+        startup_report.record(f"workers.{step}", seconds)
+    await _warm_up_phase("gallery", lambda: asyncio.to_thread(_ensure_gallery))
+    startup_report.print_report()
+
+@app.on_event("startup")
+async def start_warm_up():
+    # Not awaited: the server accepts connections (and answers /healthz) while models load
+    app.state.warm_up_task = asyncio.create_task(_warm_up())
+    app.state.gallery_sync_task = asyncio.create_task(_gallery_sync_loop())
+    app.state.session_prebuild_task = asyncio.create_task(_session_prebuild_loop())
+    app.state.attendance_cooldown_task = asyncio.create_task(_attendance_cooldown_loop())
+    app.state.gallery_snapshot_task = asyncio.create_task(_gallery_snapshot_loop()) if gallery_snapshots else None
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    app.state.gallery_sync_task.cancel()
+    app.state.session_prebuild_task.cancel()
+    app.state.attendance_cooldown_task.cancel()
+    if app.state.gallery_snapshot_task is not None:
+        app.state.gallery_snapshot_task.cancel()
+    await attendance_writer.close()
+    face_pool.shutdown()
+
+def _frame_jpeg(contents, rgb_image):
+    """
+    JPEG bytes of the frame for the blob store. JPEG uploads are stored as-is;
+    anything else is encoded to JPEG once from the already-decoded array.
+    """
+    if contents[:3] == b"\xff\xd8\xff":
+        return contents
+    _, buffer = cv2.imencode('.jpg', cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR))
+    return buffer.tobytes()
+
+def _store_face_thumbnails(rgb_image, frame_key, boxes):
+    """
+    Background task: writes the per-face crops referenced by attendance rows.
+    """
+    for box in boxes:
+        key = crop_key(frame_key, box)
+        try:
+            if not blob_store.exists(key):
+                blob_store.put_key(key, make_face_thumbnail(rgb_image, box))
+        except Exception as e:
+            print(f"Warning: Failed to store thumbnail {key}: {e}")
+
+def _attendance_row(user, confidence, liveness_score, latitude, longitude, image_key, session_id=None):
+    row = {
+        "user_id": user['id'],
+        "timestamp": datetime.utcnow().isoformat(),
+        "liveness_score": liveness_score,
+        "confidence": confidence,
+        "image_key": image_key
+    }
+    # Add location if exists
+    if latitude is not None and longitude is not None:
+        row["latitude"] = latitude
+        row["longitude"] = longitude
+    if session_id is not None:
+        row["session_id"] = session_id
+    return row
+
+def _geofence_check(latitude, longitude, session=None):
+    """
+    Location check shared by /mark_attendance and the kiosk stream: the
+    session's fence when it has one, else any registered fence. Returns
+    (is_valid, meters to the fence), or None when no location was sent.
+    """
+    if latitude is None or longitude is None:
+        print("⚠️ Location missing in request. Skipping Geo Check.")
+        return None
+    if session is not None and session.has_location:
+        is_valid, dist = is_within_radius(float(latitude), float(longitude), session.latitude, session.longitude,
+                                          session.radius_m or MAX_DISTANCE_METERS)
+    else:
+        # Inside any registered fence; dist is meters to the nearest one
+        is_valid, dist = geofences.check(float(latitude), float(longitude))
+    print(f"🌍 Geo Check: User at ({latitude}, {longitude}), Dist={dist:.2f}m. Validity={is_valid}")
+    if not is_valid:
+        if ENFORCE_GEOFENCING:
+            print("❌ Geofencing violation enforced.")
+        else:
+            print(f"⚠️ WARNING: User is {dist:.0f}m away from classroom (enforcement disabled)")
+    return is_valid, dist
 
 @app.get("/")
 def read_root():
     return {"status": "online", "message": "AI Smart Attendance System API"}
 
+@app.get("/healthz")
+def healthz():
+    """
+    Liveness probe: the process is up and the event loop is answering.
+    """
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    """
+    Readiness probe: 200 once models are warm and the gallery is loaded,
+    503 (with the startup time breakdown) until then.
+    """
+    summary = startup_report.summary()
+    return JSONResponse(status_code=200 if summary["ready"] else 503, content=summary)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Prometheus text-format metrics: per-stage latency histograms, queue
+    depths, gallery size and per-endpoint request counters.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/register")
 async def register(
     name: str = Form(...),
@@ -67,16 +581,19 @@ async def register(
 ):
     print(f"📝 Register request received for: {name}")
     
-    # Save temp file
-    temp_filename = f"temp_{uuid.uuid4()}_{image.filename}"
     try:
-        with open(temp_filename, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
-        print(f"✅ Image saved to {temp_filename}")
+        # Decode once in memory; every stage below shares the same RGB array
+        contents = await image.read()
+        with span("decode"):
+            rgb_image = face_auth.decode_image(contents)
+        if rgb_image is None:
+            print("❌ Invalid image format received.")
+            raise HTTPException(status_code=400, detail="Invalid image format")
+        await check_image_quality(rgb_image, "register")
         
         # Check Liveness (Anti-Spoofing)
         print("Running liveness check...")
-        is_live, liveness_score = face_auth.check_liveness(temp_filename)
+        is_live, liveness_score = await run_face_stage("check_liveness_from_array", rgb_image)
         print(f"Liveness result: {is_live}, score: {liveness_score}")
         
         if not is_live:
@@ -85,7 +602,7 @@ async def register(
              
         print(f"Extraction started for {name}")
         # Get face encoding
-        encodings = face_auth.extract_face_encodings(temp_filename)
+        encodings = await run_face_stage("extract_face_encodings_from_array", rgb_image, PROFILE_REGISTER)
         print(f"Extraction finished. Found: {len(encodings) if encodings else 0}")
         
         if not encodings:
@@ -97,25 +614,25 @@ async def register(
             
         encoding = encodings[0]
         
-        # Store in Supabase
-        # Convert numpy array to list for JSON storage
-        encoding_list = encoding.tolist()
-        
+        # Store in Supabase (compact binary encoding, see face_auth.encode_embedding)
         data = {
             "name": name,
             "email": email,
-            "phone": phone,
-            "face_encoding": encoding_list
+            "phone": phone
         }
         
         print("Inserting user into Supabase...")
-        response = supabase.table("users").insert(data).execute()
+        response = _insert_user(data, encoding)
         print(f"Supabase response: {response}")
         
         if not response.data:
              print("❌ Failed to save user to database (no data returned).")
              raise HTTPException(status_code=500, detail="Failed to save user to database")
              
+        # Loaded first if need be: a snapshot mapped later wouldn't have this user
+        if (await get_gallery()).add(response.data[0]) and gallery_snapshots:
+            _gallery_changed.set()
+
         print("✅ User registered successfully.")
         return {"status": "success", "user_id": response.data[0]['id'], "message": "User registered successfully"}
 
@@ -126,44 +643,51 @@ async def register(
         traceback.print_exc()
         print(f"🔥 CRITICAL ERROR in /register: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if os.path.exists(temp_filename):
-            try:
-                os.remove(temp_filename)
-            except Exception as e:
-                print(f"Warning: Failed to delete temp file {temp_filename}: {e}")
 
 @app.post("/mark_attendance")
 async def mark_attendance(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     latitude: Optional[float] = Form(None),
-    longitude: Optional[float] = Form(None)
+    longitude: Optional[float] = Form(None),
+    liveness_frames: Optional[List[UploadFile]] = File(None),
+    session_id: Optional[str] = Form(None)
 ):
     print("📝 Mark Attendance request received.")
     image = file
     
     # 1. Read image
     try:
+        # 0. Class session: only its roster is searched, inside its time window
+        session = None
+        if session_id:
+            session = await asyncio.to_thread(session_registry.get, session_id)
+            if session is None:
+                raise HTTPException(status_code=404, detail="Unknown session")
+            if not session.is_open():
+                print(f"❌ Session {session.name} is not open ({session.starts_at} - {session.ends_at}).")
+                raise HTTPException(status_code=403, detail="This class session is not open for attendance")
+
         contents = await image.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        img_cv = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        # Decode once in memory; liveness and encoding share the same RGB array
+        with span("decode"):
+            rgb_image = face_auth.decode_image(contents)
 
-        if img_cv is None:
+        if rgb_image is None:
              print("❌ Invalid image format received.")
              raise HTTPException(status_code=400, detail="Invalid image format")
         
-        temp_filename = f"temp_attend_{uuid.uuid4()}_{image.filename}"
-        
-        # Save temp file for face_auth (if it relies on paths)
-        with open(temp_filename, "wb") as f:
-            f.write(contents)
-        
-        print(f"📸 Processing attendance image: {temp_filename}")
+        print(f"📸 Processing attendance image: {image.filename} ({rgb_image.shape[1]}x{rgb_image.shape[0]})")
         print(f"📍 Location: lat={latitude}, lng={longitude}")
 
-        # 1. Check Liveness
-        print("Checking liveness...")
-        is_live, liveness_score = face_auth.check_liveness(temp_filename)
+        # 1. Quality gate, liveness and encodings, computed once per distinct
+        # upload: a retry or double submit of the same bytes reuses them
+        burst = [await f.read() for f in liveness_frames] if liveness_frames else []
+        analysis, cached = await face_result_cache.get_or_compute(
+            upload_key(ATTENDANCE_CACHE_NAMESPACE, contents, *burst), lambda: _analyze_attendance_frame(rgb_image, burst))
+        if cached:
+            print("♻️ Identical upload: reusing cached liveness and encodings")
+        is_live, liveness_score = analysis["liveness"]
         print(f"👁️ Liveness: is_live={is_live}, score={liveness_score}")
         
         if not is_live:
@@ -171,132 +695,125 @@ async def mark_attendance(
              raise HTTPException(status_code=403, detail="Liveness check failed. Please open eyes and look at camera.")
 
         # 1.5 Geofencing Check
-        if latitude is not None and longitude is not None:
-            is_valid, dist = is_within_radius(float(latitude), float(longitude), CLASSROOM_COORDS['lat'], CLASSROOM_COORDS['lng'], MAX_DISTANCE_METERS)
-            print(f"🌍 Geo Check: User at ({latitude}, {longitude}), Dist={dist:.2f}m. Validity={is_valid}")
-            
-            if not is_valid:
-                if ENFORCE_GEOFENCING:
-                    print("❌ Geofencing violation enforced.")
-                    raise HTTPException(status_code=403, detail=f"You are too far from class! ({dist:.0f}m away)")
-                else:
-                    print(f"⚠️ WARNING: User is {dist:.0f}m away from classroom (enforcement disabled)")
-        else:
-            print("⚠️ Location missing in request. Skipping Geo Check.")
+        geo = _geofence_check(latitude, longitude, session)
+        if geo is not None and not geo[0] and ENFORCE_GEOFENCING:
+            raise HTTPException(status_code=403, detail=f"You are too far from class! ({geo[1]:.0f}m away)")
 
         # 2. Match Face(s)
-        print("Extracting face encodings...")
-        encodings = face_auth.extract_face_encodings(temp_filename)
+        face_locations, encodings = analysis["faces"]
         print(f"👤 Found {len(encodings) if encodings else 0} faces")
         
         if not encodings:
             print("❌ No face detected.")
             raise HTTPException(status_code=404, detail="No face detected")
             
-        # Fetch all users
-        print("Fetching users from Supabase...")
-        response = supabase.table("users").select("*").execute()
-        users = response.data
-        print(f"Fetched {len(users)} users from database.")
+        # Match every face in the frame against the resident gallery (or the
+        # session roster's sub-gallery) in one pass
+        current_gallery = await get_gallery()
+        with span("match"):
+            if session is None:
+                matches = await match_batcher.match(current_gallery, encodings)
+            else:
+                # A roster or gallery change means a rebuild: keep it off the event loop
+                session_gallery = session_registry.cached_gallery(session, current_gallery)
+                if session_gallery is None:
+                    session_gallery = await asyncio.to_thread(session_registry.gallery_for, session, current_gallery)
+                matches = await match_batcher.match(session_gallery, encodings)
+                misses = [i for i, (user, _) in enumerate(matches) if user is None]
+                if SESSION_GLOBAL_FALLBACK and misses:
+                    for i, match in zip(misses, await match_batcher.match(current_gallery, [encodings[i] for i in misses])):
+                        matches[i] = match
         
         results = []
+        frame_key = None
+        matched_boxes = []
+        pending = []  # (result index, user, score, row) waiting for the batched insert
+        marked_at = time.time()
+        scope = cooldown_scope(session.id if session else None, marked_at)
         
-        for encoding in encodings:
-            match_user = None
-            best_score = 0.0
-            
-            for user in users:
-                stored_encoding = user.get('face_encoding')
-                if not stored_encoding: continue
-                
-                # Handle cases where stored_encoding might be None or invalid format
-                if not isinstance(stored_encoding, list):
-                    continue
-
-                is_match, distance = face_auth.match_face(encoding, stored_encoding)
-                if is_match:
-                    score = (1.0 - distance) * 100
-                    if score > best_score:
-                        best_score = score
-                        match_user = user
+        for box, (match_user, distance) in zip(face_locations, matches):
+            best_score = (1.0 - distance) * 100
             
             if match_user:
                 print(f"✅ Match found: {match_user['name']} with score {best_score}")
-                # Log attendance
-                import base64
-                
-                # Convert image for storage (resize to save space?)
-                # For now, just re-encode the original buffer or the cv2 image
-                _, buffer = cv2.imencode('.jpg', img_cv)
-                img_base64 = base64.b64encode(buffer).decode('utf-8')
-                
-                att_data = {
-                    "user_id": match_user['id'],
-                    "timestamp": datetime.utcnow().isoformat(),
-                    "liveness_score": liveness_score,
-                    "confidence": best_score,
-                    "captured_image": img_base64 # storing base64 directly
-                }
-                # Add location if exists
-                if latitude is not None and longitude is not None:
-                    att_data["latitude"] = latitude
-                    att_data["longitude"] = longitude
-
-                try:
-                    print(f"Inserting attendance record for {match_user['name']}...")
-                    supabase.table("attendance").insert(att_data).execute()
-                    
-                    # Send Notifications
-                    user_email = match_user.get('email')
-                    user_phone = match_user.get('phone')
-                    
-                    if user_email:
-                        # process in background if possible, or just catch errors
-                        try:
-                            # send_email(user_email, "Attendance Marked", f"Hello {match_user['name']}, your attendance has been marked at {att_data['timestamp']}.")
-                            pass 
-                        except: pass
-                    
-                    # if user_phone:
-                    #     send_sms(user_phone, f"Attendance marked for {match_user['name']} at {att_data['timestamp']}")
-                    
-                    print(f"[\033[92mNOTIFICATION\033[0m] Attendance notification processed for {match_user['name']}")
-                    
-                    results.append({
-                        "status": "success",
+                # Marked moments ago (retry, burst, same face twice): no new row
+                previous = attendance_cooldown.claim(match_user['id'], scope, marked_at)
+                if previous is not None:
+                    previous_at = datetime.fromtimestamp(previous, timezone.utc).isoformat()
+                    print(f"↩️ {match_user['name']} already marked at {previous_at}")
+                    result = {
+                        "status": "already_marked",
                         "person": match_user['name'],
                         "user_id": match_user['id'],
-                        "liveness": "verified",
                         "confidence": best_score,
-                         "location": {"lat": latitude, "lng": longitude} if latitude else None
-                    })
-                    
-                except Exception as e:
-                     print(f"🔥 DB Insert Error: {e}")
-                     # Retry without image if column missing
-                     if "captured_image" in att_data:
-                         print("Retrying without captured_image...")
-                         del att_data["captured_image"]
-                         try:
-                             supabase.table("attendance").insert(att_data).execute()
-                             results.append({
-                                "status": "success",
-                                "person": match_user['name'],
-                                "user_id": match_user['id'],
-                                "liveness": "verified",
-                                "confidence": best_score,
-                                "message": "Attendance marked (Image save failed)",
-                                "location": {"lat": latitude, "lng": longitude} if latitude else None
-                            })
-                         except Exception as retry_e:
-                             print(f"Retry failed: {retry_e}")
-                             results.append({"status": "error", "message": f"DB Error for {match_user['name']}"})
-                     else:
-                        results.append({"status": "error", "message": f"DB Error for {match_user['name']}"})
+                        "marked_at": previous_at,
+                        "message": f"Attendance already marked for {match_user['name']}"
+                    }
+                    if session is not None:
+                        result["session_id"] = session.id
+                    results.append(result)
+                    continue
+                # Store the frame once, however many faces match; rows reference a face crop
+                if frame_key is None:
+                    with span("blob_store"):
+                        frame_key = await asyncio.to_thread(blob_store.put, _frame_jpeg(contents, rgb_image))
+                matched_boxes.append(box)
+                
+                att_data = _attendance_row(match_user, best_score, liveness_score, latitude, longitude,
+                                           crop_key(frame_key, box), session.id if session else None)
+
+                pending.append((len(results), match_user, best_score, att_data))
+                results.append(None)
             else:
                 print("❌ No match found for face.")
                 results.append({"status": "failed", "message": "Unknown face"})
 
+        # Thumbnails are cut after the response; /images/{key} also builds them on demand
+        if matched_boxes:
+            background_tasks.add_task(_store_face_thumbnails, rgb_image, frame_key, matched_boxes)
+
+        # One multi-row insert for every face in the frame (and concurrent requests)
+        if pending:
+            print(f"Inserting {len(pending)} attendance record(s)...")
+        outcomes = await attendance_writer.write([row for _, _, _, row in pending])
+
+        for (slot, match_user, best_score, att_data), outcome in zip(pending, outcomes):
+            if not outcome["ok"]:
+                attendance_cooldown.release(match_user['id'], scope, marked_at)
+                results[slot] = {"status": "error", "message": f"DB Error for {match_user['name']}"}
+                continue
+
+            # Send Notifications
+            user_email = match_user.get('email')
+            user_phone = match_user.get('phone')
+            
+            if user_email:
+                # process in background if possible, or just catch errors
+                try:
+                    # send_email(user_email, "Attendance Marked", f"Hello {match_user['name']}, your attendance has been marked at {att_data['timestamp']}.")
+                    pass 
+                except: pass
+            
+            # if user_phone:
+            #     send_sms(user_phone, f"Attendance marked for {match_user['name']} at {att_data['timestamp']}")
+            
+            print(f"[\033[92mNOTIFICATION\033[0m] Attendance notification processed for {match_user['name']}")
+            
+            result = {
+                "status": "success",
+                "person": match_user['name'],
+                "user_id": match_user['id'],
+                "liveness": "verified",
+                "confidence": best_score,
+                "location": {"lat": latitude, "lng": longitude} if latitude else None
+            }
+            if session is not None:
+                result["session_id"] = session.id
+                result["enrolled"] = match_user['id'] in session.roster
+            if not outcome["image_saved"]:
+                result["message"] = "Attendance marked (Image save failed)"
+            results[slot] = result
+
         return {
             "status": "processed",
             "results": results,
@@ -311,17 +828,350 @@ async def mark_attendance(
         traceback.print_exc()
         print(f"🔥 CRITICAL ERROR in /mark_attendance: {e}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if os.path.exists(temp_filename):
-            try:
-                os.remove(temp_filename)
-            except: pass
+
+@app.post("/liveness/stream")
+async def liveness_stream(
+    frames: Optional[List[UploadFile]] = File(None),
+    clip: Optional[UploadFile] = File(None)
+):
+    """
+    Blink (eye aspect ratio) liveness over a short burst of frames or a short
+    video clip. Landmarks are tracked across frames and processing stops at the
+    first confirmed blink or when the frame/time budget runs out.
+    """
+    if clip is not None:
+        result = await run_face_stage("check_liveness_clip", await clip.read())
+    elif frames:
+        result = await run_face_stage("check_liveness_burst", [await f.read() for f in frames])
+    else:
+        raise HTTPException(status_code=400, detail="Send either 'frames' (images) or 'clip' (video)")
+
+    if result["frames"] == 0:
+        raise HTTPException(status_code=400, detail="No readable frames")
+    print(f"👁️ Stream liveness: {result}")
+    return {"status": "success", **result}
+
+def _crop_from_frame(frame_key, box):
+    """
+    Thumbnail of `box` (top, right, bottom, left) cut from a stored frame, or
+    None if the frame is missing or the box doesn't lie inside it.
+    """
+    frame = blob_store.get(frame_key)
+    rgb_image = face_auth.decode_image(frame) if frame else None
+    if rgb_image is None:
+        return None
+    top, right, bottom, left = box
+    h, w = rgb_image.shape[:2]
+    if not (0 <= top < bottom <= h and 0 <= left < right <= w):
+        return None
+    return make_face_thumbnail(rgb_image, box)
+
+@app.get("/images/{key}")
+async def get_image(key: str, request: Request):
+    """
+    Serves an attendance image from the blob store. Keys are content hashes,
+    so responses can be cached forever and the key is the ETag (a revalidating
+    client gets a 304 without the blob being read).
+    """
+    match = KEY_PATTERN.match(key)
+    if not match:
+        raise HTTPException(status_code=404, detail="Image not found")
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": f'"{key[:-4]}"'}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    data = await asyncio.to_thread(blob_store.get, key)
+    if data is None and match.group(2) is not None:
+        # Face crop not written yet (the thumbnail task runs after the
+        # response): cut it from the stored frame, without storing it
+        box = tuple(int(match.group(i)) for i in range(2, 6))
+        data = await asyncio.to_thread(_crop_from_frame, match.group(1) + ".jpg", box)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
+# Columns returned by /attendance/history; image blobs only on request
+HISTORY_COLUMNS = "id, user_id, timestamp, liveness_score, confidence, latitude, longitude, image_key, users(name)"
+HISTORY_MAX_LIMIT = 1000
+
+def _encode_cursor(record):
+    raw = json.dumps([record["timestamp"], record["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def _decode_cursor(cursor):
+    """
+    (timestamp, id) from a cursor made by _encode_cursor(). Both end up in a
+    PostgREST filter string, so they are re-serialized from parsed values
+    (an ISO timestamp, an integer or UUID id) rather than passed through.
+    """
+    try:
+        timestamp, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        timestamp = datetime.fromisoformat(timestamp.replace("Z", "+00:00")).isoformat()
+        if isinstance(record_id, int) and not isinstance(record_id, bool):
+            return timestamp, str(record_id)
+        return timestamp, str(uuid.UUID(record_id))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _query_history(limit, cursor, user_id, start, end, include_images):
+    """
+    One page of attendance, newest first, keyset-paginated on (timestamp, id).
+    cursor is a decoded (timestamp, id) pair, see _decode_cursor().
+    """
+    def run(columns):
+        query = supabase.table("attendance").select(columns)
+        if user_id:
+            query = query.eq("user_id", user_id)
+        if start:
+            query = query.gte("timestamp", start)
+        if end:
+            query = query.lt("timestamp", end)
+        if cursor:
+            ts, record_id = cursor
+            query = query.or_(f'timestamp.lt."{ts}",and(timestamp.eq."{ts}",id.lt.{record_id})')
+        # Fetch one extra row to know whether another page exists
+        return query.order("timestamp", desc=True).order("id", desc=True).limit(limit + 1).execute().data
+
+    columns = HISTORY_COLUMNS + (", captured_image" if include_images else "")
+    try:
+        records = run(columns)
+    except HTTPException:
+        raise
+    except Exception as e:
+        # Older databases may lack the optional columns (see add_columns.sql)
+        print(f"⚠️ Projected history query failed ({e}); falling back to all columns.")
+        records = run("*, users(name)")
+        if not include_images:
+            for record in records:
+                record.pop("captured_image", None)
+
+    next_cursor = _encode_cursor(records[limit - 1]) if len(records) > limit else None
+    return {"status": "success", "records": records[:limit], "next_cursor": next_cursor}
+
+def _validate_timestamp(value, name):
+    if value is None:
+        return None
+    try:
+        datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}: expected an ISO date or timestamp")
+    return value
+
+async def _history_entry(limit, cursor, user_id, start, end, include_images):
+    key = (limit, cursor, user_id, start, end, include_images)
+    entry = history_cache.get(key)
+    if entry is None:
+        generation = history_cache.generation
+        page = await asyncio.to_thread(_query_history, limit, cursor, user_id, start, end, include_images)
+        entry = history_cache.put(key, json.dumps(page, default=str).encode(), generation)
+    return entry
 
 @app.get("/attendance/history")
-async def get_history():
-    # Join with users table
-    response = supabase.table("attendance").select("*, users(name)").order("timestamp", desc=True).execute()
-    return {"status": "success", "records": response.data}
+async def get_history(
+    request: Request,
+    limit: int = Query(100, ge=1, le=HISTORY_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    user_id: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    include_images: bool = False
+):
+    """
+    Attendance history, newest first. Pass next_cursor back as `cursor` for
+    the following page. Responses carry an ETag; an unchanged poll with
+    If-None-Match is answered 304 from the in-process cache.
+    """
+    start = _validate_timestamp(start, "start")
+    end = _validate_timestamp(end, "end")
+    cursor = _decode_cursor(cursor) if cursor else None
+    entry = await _history_entry(limit, cursor, user_id, start, end, include_images)
+
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == entry.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+@app.websocket("/ws/attendance")
+async def attendance_feed(websocket: WebSocket, start: Optional[str] = None, limit: int = 100):
+    """
+    Live attendance feed for the admin dashboard.
+    Handshake: one {"type": "snapshot", "page": <history page>} message, then
+    {"type": "attendance", "record": ...} deltas as rows are written. A slow
+    client whose buffer overflows gets {"type": "resync"} and a fresh snapshot.
+    """
+    await websocket.accept()
+    try:
+        start = _validate_timestamp(start, "start")
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+    # Subscribe before reading the snapshot so no delta falls in between;
+    # clients de-duplicate by record id.
+    sub = attendance_hub.subscribe()
+
+    async def send_snapshot():
+        entry = await _history_entry(limit, None, None, start, None, False)
+        await websocket.send_text('{"type": "snapshot", "page": ' + entry.body.decode() + '}')
+
+    try:
+        await send_snapshot()
+        while True:
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), timeout=30)
+            except asyncio.TimeoutError:
+                # Keep-alive; also how a silently dropped client gets noticed
+                await websocket.send_json({"type": "ping"})
+                continue
+            await websocket.send_json(event)
+            if event["type"] == "resync":
+                await send_snapshot()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"⚠️ Attendance feed closed: {e}")
+    finally:
+        attendance_hub.unsubscribe(sub)
+
+async def _recognize_track(websocket, tracker, track, contents, rgb_image, latitude, longitude):
+    """
+    Encodes, liveness-checks and matches one kiosk track, writing its
+    attendance row on success unless the user is still in their cooldown
+    window. Runs once per track (plus retries on failure).
+    """
+    top, right, bottom, left = track.box
+    margin = int(0.25 * max(bottom - top, right - left))
+    h, w = rgb_image.shape[:2]
+    face_crop = rgb_image[max(0, top - margin):min(h, bottom + margin), max(0, left - margin):min(w, right + margin)]
+    try:
+        encodings, (is_live, liveness_score) = await asyncio.gather(
+            run_face_stage("encode_faces_from_array", rgb_image, [track.box], PROFILE_KIOSK),
+            run_face_stage("check_liveness_from_array", face_crop if face_crop.size else rgb_image),
+        )
+    except HTTPException:
+        return  # Pool busy: the track stays pending and is retried on the next frame
+    if not encodings or not is_live:
+        tracker.recognition_failed(track)
+        return
+
+    with span("match"):
+        match_user, distance = (await match_batcher.match(await get_gallery(), encodings))[0]
+    if not match_user:
+        tracker.recognition_failed(track)
+        return
+
+    confidence = (1.0 - distance) * 100
+    marked_at = time.time()
+    scope = cooldown_scope(None, marked_at)
+    previous = attendance_cooldown.claim(match_user['id'], scope, marked_at)
+    if previous is None:
+        with span("blob_store"):
+            frame_key = await asyncio.to_thread(blob_store.put, _frame_jpeg(contents, rgb_image))
+        await asyncio.to_thread(_store_face_thumbnails, rgb_image, frame_key, [track.box])
+        row = _attendance_row(match_user, confidence, liveness_score, latitude, longitude, crop_key(frame_key, track.box))
+        outcome = (await attendance_writer.write([row]))[0]
+        if not outcome["ok"]:
+            attendance_cooldown.release(match_user['id'], scope, marked_at)
+            tracker.recognition_failed(track)
+            return
+
+    track.state = "recognized"
+    track.user = match_user
+    track.confidence = confidence
+    print(f"✅ Kiosk: {match_user['name']} recognized on track {track.id} with score {confidence}")
+    await websocket.send_json({
+        "type": "attendance",
+        "track": track.id,
+        "person": match_user['name'],
+        "user_id": match_user['id'],
+        "confidence": confidence,
+        "liveness_score": liveness_score,
+        "already_marked": previous is not None
+    })
+
+@app.websocket("/ws/kiosk")
+async def kiosk_stream(websocket: WebSocket, latitude: Optional[float] = None, longitude: Optional[float] = None):
+    """
+    Continuous attendance for door kiosks. The client streams JPEG frames as
+    binary messages; faces are detected every KIOSK_DETECT_EVERY frames and
+    tracked by optical flow in between, and each new track is recognized once.
+    Server messages:
+      {"type": "tracks", "frame": n, "tracks": [{"id", "box", "state", "name"}]} per processed frame
+      {"type": "attendance", "track", "person", "user_id", "confidence", "liveness_score", "already_marked"} per recognized track
+    Only the newest unprocessed frame is kept, so a slow server skips frames
+    instead of falling behind the camera.
+    The kiosk's latitude/longitude is checked against the geofences once per
+    connection, like /mark_attendance checks each request: with
+    ENFORCE_GEOFENCING a kiosk outside every fence is closed (code 1008).
+    """
+    await websocket.accept()
+    geo = _geofence_check(latitude, longitude)
+    if geo is not None and not geo[0] and ENFORCE_GEOFENCING:
+        await websocket.close(code=1008, reason=f"Kiosk is too far from class ({geo[1]:.0f}m away)")
+        return
+    frames = asyncio.Queue(maxsize=1)
+
+    async def receive():
+        try:
+            while True:
+                data = await websocket.receive_bytes()
+                if frames.full():
+                    frames.get_nowait()
+                    kiosk_frames_total.inc("dropped")
+                frames.put_nowait(data)
+        except Exception:
+            pass  # Disconnect (or a non-binary message): stop the stream
+        finally:
+            if frames.full():
+                frames.get_nowait()
+            frames.put_nowait(None)
+
+    receiver = asyncio.create_task(receive())
+    tracker = FaceTracker()
+    frame_no = 0
+    since_detection = KIOSK_DETECT_EVERY
+    try:
+        while True:
+            contents = await frames.get()
+            if contents is None:
+                break
+            with span("decode"):
+                rgb_image = await asyncio.to_thread(face_auth.decode_image, contents)
+            frame_no += 1
+            if rgb_image is None:
+                # Still acknowledged, so clients that wait for each reply keep streaming
+                kiosk_frames_total.inc("invalid")
+                await websocket.send_json({"type": "tracks", "frame": frame_no, "tracks": tracker.snapshot()})
+                continue
+
+            detected = False
+            if since_detection >= KIOSK_DETECT_EVERY:
+                try:
+                    boxes = await run_face_stage("locate_faces_from_array", rgb_image, PROFILE_KIOSK)
+                    # Resizes and converts the frame for the next optical flow step
+                    await asyncio.to_thread(tracker.update, rgb_image, boxes)
+                    detected = True
+                except HTTPException:
+                    pass  # Pool busy: keep tracking and detect on the next frame
+            if detected:
+                since_detection = 1
+                kiosk_frames_total.inc("detected")
+            else:
+                with span("track"):
+                    # Optical flow over the frame: off the event loop like the other CPU stages.
+                    # Only this loop touches the tracker, and it awaits the call.
+                    await asyncio.to_thread(tracker.propagate, rgb_image)
+                since_detection += 1
+                kiosk_frames_total.inc("tracked")
+
+            for track in tracker.due_for_recognition():
+                await _recognize_track(websocket, tracker, track, contents, rgb_image, latitude, longitude)
+            await websocket.send_json({"type": "tracks", "frame": frame_no, "tracks": tracker.snapshot()})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"⚠️ Kiosk stream closed: {e}")
+    finally:
+        receiver.cancel()
 
 
 # --- STUDENT PORTAL ENDPOINTS ---
@@ -332,41 +1182,30 @@ async def student_login(image: UploadFile = File(...)):
     Face-based login. Returns user_id if face matches a registered user.
     """
     print("📝 Student Login request received.")
-    temp_filename = f"login_{uuid.uuid4()}_{image.filename}"
     try:
-        with open(temp_filename, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
-        print(f"✅ Login image saved to {temp_filename}")
+        contents = await image.read()
+        with span("decode"):
+            rgb_image = face_auth.decode_image(contents)
+        if rgb_image is None:
+            print("❌ Invalid image format received.")
+            raise HTTPException(status_code=400, detail="Invalid image format")
 
-        # 1. Extract Face
-        print("Extracting face for login...")
-        encodings = face_auth.extract_face_encodings(temp_filename)
+        # 1. Extract Face (once per distinct upload, see face_result_cache)
+        async def extract():
+            await check_image_quality(rgb_image, "login")
+            print("Extracting face for login...")
+            return await run_face_stage("extract_face_encodings_from_array", rgb_image, PROFILE_LOGIN)
+        encodings, _ = await face_result_cache.get_or_compute(upload_key(LOGIN_CACHE_NAMESPACE, contents), extract)
         if not encodings:
             print("❌ No face detected.")
             raise HTTPException(status_code=401, detail="No face detected")
         
         login_encoding = encodings[0]
 
-        # 2. Fetch all users to compare
-        print("Fetching users for comparison...")
-        response = supabase.table("users").select("*").execute()
-        users = response.data
-
-        match_user = None
-        best_score = 0.0
-
-        for user in users:
-            stored_encoding = user.get('face_encoding')
-            if not stored_encoding: continue
-
-            # Match
-            is_match, distance = face_auth.match_face(login_encoding, stored_encoding)
-            
-            if is_match:
-                score = (1.0 - distance) * 100
-                if score > best_score:
-                    best_score = score
-                    match_user = user
+        # 2. Compare against the resident gallery
+        current_gallery = await get_gallery()
+        with span("match"):
+            match_user, distance = (await match_batcher.match(current_gallery, [login_encoding]))[0]
         
         if match_user:
             print(f"✅ Login Successful for: {match_user['name']}")
@@ -387,11 +1226,6 @@ async def student_login(image: UploadFile = File(...)):
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail="Login processing failed")
-    finally:
-        if os.path.exists(temp_filename):
-            try:
-                os.remove(temp_filename)
-            except: pass
 
 @app.get("/student/{user_id}")
 async def get_student_profile(user_id: str):
@@ -419,6 +1253,44 @@ async def get_student_attendance(user_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# --- CLASS SESSIONS ---
+class SessionCreate(BaseModel):
+    token: str
+    name: str
+    starts_at: str
+    ends_at: str
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    radius_m: Optional[float] = None
+    roster: List[str] = []
+
+@app.post("/sessions")
+async def create_session(body: SessionCreate):
+    """
+    Admin: schedules a class session with its roster (user ids).
+    """
+    if body.token not in admin_sessions:
+        raise HTTPException(status_code=401, detail="Admin login required")
+    try:
+        if timestamp_micros(body.ends_at) <= timestamp_micros(body.starts_at):
+            raise ValueError("ends_at must be after starts_at")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    row = {k: getattr(body, k) for k in ("name", "starts_at", "ends_at", "latitude", "longitude", "radius_m")}
+    try:
+        session = await asyncio.to_thread(session_registry.create, row, body.roster)
+    except Exception as e:
+        print(f"🔥 Failed to create session: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"status": "success", "session": session.to_dict()}
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    session = await asyncio.to_thread(session_registry.get, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown session")
+    return {"status": "success", "session": session.to_dict()}
+
 # --- ADMIN AUTHENTICATION ---
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
@@ -443,6 +1315,8 @@ async def admin_logout(token: str = Form(...)):
     admin_sessions.discard(token)
     return {"status": "success"}
 
+startup_report.record("import", time.monotonic() - PROCESS_START)
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
     uvicorn.run("main:app", host="0.0.0.0", port=port, reload=False)
@@ -0,0 +1,85 @@
+import os
+import asyncio
+from utils.metrics import metrics
+
+# --- CONFIGURATION ---
+# Probes from concurrent requests arriving within this window are matched
+# together in one gallery scan (0 disables batching)
+MATCH_BATCH_WINDOW_MS = float(os.getenv("MATCH_BATCH_WINDOW_MS", "3"))
+# A batch is matched straight away once it holds this many probes
+MATCH_BATCH_MAX_PROBES = int(os.getenv("MATCH_BATCH_MAX_PROBES", "256"))
+
+batch_probes = metrics.histogram(
+    "match_batch_probes", "Probe embeddings per batched gallery scan.", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+
+
+class MatchBatcher:
+    """
+    Micro-batches FaceGallery.match() across requests. Probes that arrive
+    within `window_seconds` of the first one are stacked and matched in a
+    single scan (one matrix-matrix distance computation instead of one
+    memory-bound pass over the gallery per request), and each caller gets
+    back its own slice of the results. Added latency is at most the window.
+
+    Probes are only batched with others for the same gallery object and
+    tolerance, so session sub-galleries batch among themselves.
+    """
+
+    def __init__(self, window_seconds=MATCH_BATCH_WINDOW_MS / 1000, max_probes=MATCH_BATCH_MAX_PROBES):
+        self.window_seconds = window_seconds
+        self.max_probes = max(1, max_probes)
+        self.stats = {"requests": 0, "batches": 0, "probes": 0}
+        self._groups = {}  # (id(gallery), tolerance) -> [gallery, probe count, [(encodings, future)]]
+        self._timer = None
+
+    async def match(self, gallery, encodings, tolerance=None):
+        encodings = list(encodings)
+        if not encodings:
+            return []
+        self.stats["requests"] += 1
+        if self.window_seconds <= 0:
+            self._record(len(encodings))
+            return gallery.match(encodings, tolerance)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (id(gallery), tolerance)
+        group = self._groups.setdefault(key, [gallery, 0, []])
+        group[1] += len(encodings)
+        group[2].append((encodings, future))
+        if group[1] >= self.max_probes:
+            del self._groups[key]
+            loop.create_task(self._run(group, tolerance))
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_seconds, self._flush)
+        return await future
+
+    def _record(self, probes):
+        self.stats["batches"] += 1
+        self.stats["probes"] += probes
+        batch_probes.observe(probes)
+
+    def _flush(self):
+        self._timer = None
+        groups, self._groups = self._groups, {}
+        loop = asyncio.get_running_loop()
+        for (_, tolerance), group in groups.items():
+            loop.create_task(self._run(group, tolerance))
+
+    async def _run(self, group, tolerance):
+        gallery, count, waiters = group
+        probes = [encoding for encodings, _ in waiters for encoding in encodings]
+        self._record(count)
+        try:
+            # Off the event loop: the scan of a large gallery can take milliseconds
+            results = await asyncio.to_thread(gallery.match, probes, tolerance)
+        except Exception as e:
+            for _, future in waiters:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        offset = 0
+        for encodings, future in waiters:
+            if not future.done():  # The request may have been cancelled meanwhile
+                future.set_result(results[offset:offset + len(encodings)])
+            offset += len(encodings)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Convert legacy JSON face encodings (users.face_encoding) to the compact
+binary format in users.face_embedding.
+
+Runs in small batches with a pause between them so it can run next to the
+live backend, and is resumable: only rows without face_embedding are read.
+Requires the face_embedding column (see add_columns.sql).
+
+Usage:
+    python migrate_embeddings.py [--batch-size 200] [--sleep 0.5] [--clear-legacy] [--dry-run]
+
+--clear-legacy also empties face_encoding on converted rows, which is what
+shrinks gallery downloads; leave it off until every backend instance runs a
+version that reads face_embedding.
+"""
+import sys
+import time
+import argparse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import supabase
+from face_auth import decode_embedding, encode_embedding, guess_legacy_model, ENCODING_DIM
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate face encodings to the binary format")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--sleep", type=float, default=0.5, help="Seconds to pause between batches")
+    parser.add_argument("--clear-legacy", action="store_true", help="Null face_encoding after converting")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    try:
+        supabase.table("users").select("face_embedding").limit(1).execute()
+    except Exception as e:
+        print(f"❌ users.face_embedding is not readable ({e}). Run add_columns.sql first.")
+        sys.exit(1)
+
+    converted = skipped = failed = 0
+    legacy_bytes = binary_bytes = 0
+    last_id = None
+    print("🔧 Migrating face encodings to the binary format...")
+    while True:
+        # Keyset pagination on id. With --clear-legacy, rows converted by an
+        # earlier run are revisited too, to drop their JSON copy.
+        query = supabase.table("users").select("id, face_encoding, face_embedding") \
+            .not_.is_("face_encoding", "null").order("id").limit(args.batch_size)
+        if not args.clear_legacy:
+            query = query.is_("face_embedding", "null")
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        rows = query.execute().data or []
+        if not rows:
+            break
+
+        for row in rows:
+            last_id = row["id"]
+            update = {}
+            if decode_embedding(row.get("face_embedding"))[0] is None:
+                vector, _ = decode_embedding(row["face_encoding"])
+                if vector is None or vector.shape[0] != ENCODING_DIM:
+                    print(f"⚠️ Skipping user {row['id']}: unreadable encoding")
+                    skipped += 1
+                    continue
+                update["face_embedding"] = encode_embedding(vector, model=guess_legacy_model(vector))
+                legacy_bytes += len(str(row["face_encoding"]))
+                binary_bytes += len(update["face_embedding"])
+            if args.clear_legacy:
+                update["face_encoding"] = None
+            if args.dry_run:
+                converted += 1
+                continue
+            try:
+                supabase.table("users").update(update).eq("id", row["id"]).execute()
+                converted += 1
+            except Exception as e:
+                print(f"❌ Failed to update user {row['id']}: {e}")
+                failed += 1
+
+        print(f"   ... {converted} converted, {skipped} skipped, {failed} failed")
+        time.sleep(args.sleep)
+
+    print("=" * 70)
+    print(f"✅ Converted {converted} users ({skipped} skipped, {failed} failed){' [dry run]' if args.dry_run else ''}")
+    if binary_bytes:
+        print(f"📦 Encoding payload: {legacy_bytes} -> {binary_bytes} bytes ({legacy_bytes / binary_bytes:.1f}x smaller)")
+    if not args.clear_legacy and converted and not args.dry_run:
+        print("ℹ️  Legacy face_encoding values were kept; re-run with --clear-legacy once all instances are upgraded.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import os
+import time
+import threading
+from gallery_sync import timestamp_micros
+
+# --- CONFIGURATION ---
+# How long a session (and its roster) is cached before it is re-read
+SESSION_CACHE_SECONDS = float(os.getenv("SESSION_CACHE_SECONDS", "60"))
+# Attendance is accepted this many minutes before start / after end
+SESSION_GRACE_MINUTES = float(os.getenv("SESSION_GRACE_MINUTES", "15"))
+# When a face is not on the session roster, also search every registered user
+SESSION_GLOBAL_FALLBACK = os.getenv("SESSION_GLOBAL_FALLBACK", "false").lower() == "true"
+
+SESSION_COLUMNS = "id, name, starts_at, ends_at, latitude, longitude, radius_m"
+
+
+class ClassSession:
+    """
+    One scheduled class: a roster of user ids, a time window and optionally
+    its own geofence (latitude/longitude/radius_m from class_sessions).
+    """
+
+    def __init__(self, row, roster):
+        self.id = row["id"]
+        self.name = row.get("name")
+        self.starts_at = row["starts_at"]
+        self.ends_at = row["ends_at"]
+        self.latitude = row.get("latitude")
+        self.longitude = row.get("longitude")
+        self.radius_m = row.get("radius_m")
+        self.roster = frozenset(roster)
+        self._window = (timestamp_micros(self.starts_at) / 1e6, timestamp_micros(self.ends_at) / 1e6)
+
+    def is_open(self, now=None, grace_seconds=SESSION_GRACE_MINUTES * 60):
+        now = time.time() if now is None else now
+        return self._window[0] - grace_seconds <= now <= self._window[1] + grace_seconds
+
+    @property
+    def has_location(self):
+        return self.latitude is not None and self.longitude is not None
+
+    def to_dict(self):
+        return {
+            "id": self.id, "name": self.name, "starts_at": self.starts_at, "ends_at": self.ends_at,
+            "latitude": self.latitude, "longitude": self.longitude, "radius_m": self.radius_m,
+            "roster_size": len(self.roster), "open": self.is_open(),
+        }
+
+
+class SessionRegistry:
+    """
+    Caches sessions with their rosters, and one exact-search sub-gallery per
+    session built from the resident gallery. A sub-gallery is rebuilt only
+    when the roster or the gallery (FaceGallery.version) changed, so a class
+    is matched against tens of encodings instead of the whole campus.
+    """
+
+    def __init__(self, client, cache_seconds=SESSION_CACHE_SECONDS):
+        self.client = client
+        self.cache_seconds = cache_seconds
+        self._sessions = {}   # id -> (ClassSession, fetched at)
+        self._galleries = {}  # id -> (roster, gallery version, sub-gallery)
+        self._lock = threading.Lock()
+        self.stats = {"fetches": 0, "builds": 0}
+
+    def _fetch(self, session_id):
+        rows = self.client.table("class_sessions").select(SESSION_COLUMNS).eq("id", session_id).execute().data
+        if not rows:
+            return None
+        return self._with_roster(rows[0])
+
+    def _with_roster(self, row):
+        roster = self.client.table("session_roster").select("user_id").eq("session_id", row["id"]).execute().data or []
+        self.stats["fetches"] += 1
+        return ClassSession(row, [r["user_id"] for r in roster])
+
+    def get(self, session_id):
+        """
+        The session, from cache if fresh. None if it doesn't exist.
+        """
+        with self._lock:
+            cached = self._sessions.get(session_id)
+        if cached and time.monotonic() - cached[1] < self.cache_seconds:
+            return cached[0]
+        session = self._fetch(session_id)
+        with self._lock:
+            if session is None:
+                self._sessions.pop(session_id, None)
+                self._galleries.pop(session_id, None)
+            else:
+                self._sessions[session_id] = (session, time.monotonic())
+        return session
+
+    def cached_gallery(self, session, gallery):
+        """
+        The session's sub-gallery if it is current, else None. Cheap enough
+        for the event loop.
+        """
+        with self._lock:
+            cached = self._galleries.get(session.id)
+        if cached and cached[0] == session.roster and cached[1] == gallery.version:
+            return cached[2]
+        return None
+
+    def gallery_for(self, session, gallery):
+        """
+        The session's sub-gallery, rebuilt if its roster or the gallery changed.
+        A rebuild copies the roster's rows out of the gallery: run it in a
+        worker thread.
+        """
+        sub = self.cached_gallery(session, gallery)
+        if sub is not None:
+            return sub
+        version = gallery.version
+        sub = gallery.subset(session.roster)
+        self.stats["builds"] += 1
+        with self._lock:
+            self._galleries[session.id] = (session.roster, version, sub)
+        return sub
+
+    def prebuild(self, gallery, grace_seconds=SESSION_GRACE_MINUTES * 60):
+        """
+        Fetches every session open now (or within the grace period) and builds
+        its sub-gallery, so the first request of a class doesn't pay for it.
+        Sessions that have closed are dropped from the cache. Returns the
+        number of open sessions.
+        """
+        now = time.time()
+        lower = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now + grace_seconds))
+        upper = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now - grace_seconds))
+        rows = self.client.table("class_sessions").select(SESSION_COLUMNS) \
+            .lte("starts_at", lower).gte("ends_at", upper).execute().data or []
+        fetched = time.monotonic()
+        sessions = [self._with_roster(row) for row in rows]
+        with self._lock:
+            for session in sessions:
+                self._sessions[session.id] = (session, fetched)
+            for session_id, (session, _) in list(self._sessions.items()):
+                if not session.is_open(now, grace_seconds):
+                    del self._sessions[session_id]
+                    self._galleries.pop(session_id, None)
+        for session in sessions:
+            self.gallery_for(session, gallery)
+        return len(sessions)
+
+    def create(self, row, roster):
+        """
+        Inserts a session and its roster. Returns the ClassSession.
+        """
+        created = self.client.table("class_sessions").insert(row).execute().data[0]
+        if roster:
+            self.client.table("session_roster").insert(
+                [{"session_id": created["id"], "user_id": user_id} for user_id in roster]).execute()
+        session = ClassSession(created, roster)
+        with self._lock:
+            self._sessions[session.id] = (session, time.monotonic())
+        return session
@@ -0,0 +1,69 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Imported first by main.py, so this approximates the start of app import
+PROCESS_START = time.monotonic()
+
+
+class StartupReport:
+    """
+    Wall-clock breakdown of process startup (module import, model warm-up,
+    gallery preload, ...). The app is ready once every `required` phase has
+    completed; /readyz reports that, /healthz only that the process is up.
+    """
+
+    def __init__(self, required=("import", "models", "workers", "gallery")):
+        self.required = tuple(required)
+        self.phases = {}  # name -> seconds, in completion order
+        self.errors = {}
+        self.ready_after = None
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases[name] = seconds
+            self.errors.pop(name, None)
+            if self.ready_after is None and all(p in self.phases for p in self.required):
+                self.ready_after = time.monotonic() - PROCESS_START
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Times the enclosed block as phase `name`; a failure is kept as the
+        phase's last error and re-raised.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            with self._lock:
+                self.errors[name] = str(e)
+            raise
+        self.record(name, time.monotonic() - start)
+
+    @property
+    def ready(self):
+        return self.ready_after is not None
+
+    def summary(self):
+        with self._lock:
+            return {
+                "ready": self.ready_after is not None,
+                "ready_after_seconds": self.ready_after,
+                "uptime_seconds": time.monotonic() - PROCESS_START,
+                "phases": dict(self.phases),
+                "pending": [p for p in self.required if p not in self.phases],
+                "errors": dict(self.errors),
+            }
+
+    def print_report(self):
+        summary = self.summary()
+        print("Startup time breakdown:")
+        for name, seconds in summary["phases"].items():
+            print(f"  {name:<24} {seconds * 1000:9.1f} ms")
+        if summary["ready"]:
+            print(f"  {'ready after':<24} {summary['ready_after_seconds'] * 1000:9.1f} ms")
+
+
+startup_report = StartupReport()
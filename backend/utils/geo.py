@@ -1,5 +1,7 @@
 
 import math
+import json
+import numpy as np
 
 def calculate_distance(lat1, lon1, lat2, lon2):
     """
@@ -22,3 +24,218 @@ def is_within_radius(user_lat, user_lng, target_lat, target_lng, radius_meters=1
         return False
     distance = calculate_distance(user_lat, user_lng, target_lat, target_lng)
     return distance <= radius_meters, distance
+
+
+# --- Geofence registry ---
+EARTH_RADIUS_M = 6371 * 1000
+METERS_PER_DEGREE = EARTH_RADIUS_M * math.pi / 180
+
+
+def haversine_matrix(lats, lngs, fence_lats, fence_lngs):
+    """
+    Great-circle distances in meters between every point and every fence
+    centre, shape [n_points, n_fences]. Vectorized counterpart of
+    calculate_distance().
+    """
+    lat1 = np.radians(np.asarray(lats, dtype=np.float64))[:, None]
+    lng1 = np.radians(np.asarray(lngs, dtype=np.float64))[:, None]
+    lat2 = np.radians(np.asarray(fence_lats, dtype=np.float64))[None, :]
+    lng2 = np.radians(np.asarray(fence_lngs, dtype=np.float64))[None, :]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class RadiusFence:
+    """
+    A circle of radius_m meters around (lat, lng).
+    """
+
+    def __init__(self, fence_id, lat, lng, radius_m, name=None):
+        self.id = fence_id
+        self.name = name or fence_id
+        self.lat = float(lat)
+        self.lng = float(lng)
+        self.radius_m = float(radius_m)
+        dlat = self.radius_m / METERS_PER_DEGREE
+        dlng = dlat / max(math.cos(math.radians(self.lat)), 0.01)
+        self.bbox = (self.lat - dlat, self.lng - dlng, self.lat + dlat, self.lng + dlng)
+
+    def distance_outside(self, lats, lngs):
+        """
+        Meters outside the fence for each point (<= 0 means inside).
+        """
+        return haversine_matrix(lats, lngs, [self.lat], [self.lng])[:, 0] - self.radius_m
+
+    def distance_to(self, lat, lng):
+        return calculate_distance(lat, lng, self.lat, self.lng) - self.radius_m
+
+
+class PolygonFence:
+    """
+    A polygon given as [(lat, lng), ...] vertices (closed implicitly). Meant
+    for buildings and campuses: distances use a local flat projection and
+    polygons must not cross the antimeridian.
+    """
+
+    def __init__(self, fence_id, vertices, name=None):
+        self.id = fence_id
+        self.name = name or fence_id
+        self.vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+        if len(self.vertices) < 3:
+            raise ValueError(f"Polygon fence {fence_id} needs at least 3 vertices")
+        lo, hi = self.vertices.min(axis=0), self.vertices.max(axis=0)
+        self.bbox = (lo[0], lo[1], hi[0], hi[1])
+        self.lat, self.lng = self.vertices.mean(axis=0)
+
+    def contains(self, lats, lngs):
+        """
+        Even-odd ray casting for every point at once.
+        """
+        y = np.asarray(lats, dtype=np.float64)[:, None]
+        x = np.asarray(lngs, dtype=np.float64)[:, None]
+        y1, x1 = self.vertices[:, 0][None, :], self.vertices[:, 1][None, :]
+        y2, x2 = np.roll(y1, -1, axis=1), np.roll(x1, -1, axis=1)
+        crosses = (y1 > y) != (y2 > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_at = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        return (crosses & (x < x_at)).sum(axis=1) % 2 == 1
+
+    def distance_outside(self, lats, lngs):
+        """
+        Meters to the nearest edge for points outside, 0 for points inside.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        scale = np.cos(np.radians(self.lat))
+        # Local metric projection around the polygon centre
+        px = ((lngs - self.lng) * scale * METERS_PER_DEGREE)[:, None]
+        py = ((lats - self.lat) * METERS_PER_DEGREE)[:, None]
+        vx = (self.vertices[:, 1] - self.lng) * scale * METERS_PER_DEGREE
+        vy = (self.vertices[:, 0] - self.lat) * METERS_PER_DEGREE
+        ax, ay, bx, by = vx[None, :], vy[None, :], np.roll(vx, -1)[None, :], np.roll(vy, -1)[None, :]
+        ex, ey = bx - ax, by - ay
+        t = np.clip(((px - ax) * ex + (py - ay) * ey) / np.maximum(ex * ex + ey * ey, 1e-12), 0.0, 1.0)
+        edge = np.hypot(px - (ax + t * ex), py - (ay + t * ey)).min(axis=1)
+        return np.where(self.contains(lats, lngs), 0.0, edge)
+
+    def distance_to(self, lat, lng):
+        return float(self.distance_outside([lat], [lng])[0])
+
+
+class GeofenceRegistry:
+    """
+    Every known geofence (rooms, buildings, sites) with a uniform lat/lng
+    grid index: each fence is listed in all cells its bounding box touches,
+    so the candidates for a point are one dict lookup however many fences
+    there are. cell_degrees ~0.01 is about 1 km.
+    """
+
+    def __init__(self, cell_degrees=0.01):
+        self.cell_degrees = cell_degrees
+        self.fences = {}
+        self._grid = {}
+
+    def __len__(self):
+        return len(self.fences)
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lng / self.cell_degrees))
+
+    def add(self, fence):
+        if fence.id in self.fences:
+            self.remove(fence.id)
+        self.fences[fence.id] = fence
+        (r0, c0), (r1, c1) = self._cell(fence.bbox[0], fence.bbox[1]), self._cell(fence.bbox[2], fence.bbox[3])
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                self._grid.setdefault((r, c), []).append(fence)
+        return fence
+
+    def remove(self, fence_id):
+        fence = self.fences.pop(fence_id, None)
+        if fence is None:
+            return False
+        for key in [k for k, cell in self._grid.items() if fence in cell]:
+            self._grid[key].remove(fence)
+            if not self._grid[key]:
+                del self._grid[key]
+        return True
+
+    def candidates(self, lat, lng):
+        return self._grid.get(self._cell(lat, lng), [])
+
+    def locate(self, lat, lng):
+        """
+        Fences containing the point, nearest centre first.
+        """
+        inside = [f for f in self.candidates(lat, lng) if f.distance_to(lat, lng) <= 0]
+        return sorted(inside, key=lambda f: calculate_distance(lat, lng, f.lat, f.lng))
+
+    def check(self, lat, lng):
+        """
+        (inside any fence, meters to the nearest fence; 0 when inside).
+        Drop-in for is_within_radius() against every registered fence.
+        """
+        if self.locate(lat, lng):
+            return True, 0.0
+        if not self.fences:
+            return False, float("inf")
+        return False, max(0.0, min(f.distance_to(lat, lng) for f in self.fences.values()))
+
+    def load(self, entries):
+        """
+        Adds fences from dicts: {"id", "name", "lat", "lng", "radius_m"} for
+        radius fences or {"id", "name", "polygon": [[lat, lng], ...]}.
+        """
+        for entry in entries:
+            if "polygon" in entry:
+                self.add(PolygonFence(entry["id"], entry["polygon"], entry.get("name")))
+            else:
+                self.add(RadiusFence(entry["id"], entry["lat"], entry["lng"], entry["radius_m"], entry.get("name")))
+        return self
+
+    def load_json(self, path):
+        with open(path) as f:
+            return self.load(json.load(f))
+
+    def audit(self, lats, lngs, expected=None, chunk=4096):
+        """
+        Bulk check of many points (e.g. historical attendance rows) against
+        every fence. Returns per point: inside (bool), nearest fence id, and
+        meters outside it (0 when inside). With `expected` (one fence id or
+        None per point) the point is judged against that fence only.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        fences = list(self.fences.values())
+        n = len(lats)
+        outside = np.full(n, np.inf)
+        nearest = np.full(n, -1)
+        circles = [i for i, f in enumerate(fences) if isinstance(f, RadiusFence)]
+        polygons = [i for i, f in enumerate(fences) if not isinstance(f, RadiusFence)]
+        radii = np.array([fences[i].radius_m for i in circles])
+        if expected is not None:
+            index = {f.id: i for i, f in enumerate(fences)}
+            expected = np.array([index.get(e, -1) for e in expected])
+        for start in range(0, n, chunk):
+            part = slice(start, min(start + chunk, n))
+            columns = np.empty((part.stop - part.start, len(fences)))
+            if circles:
+                columns[:, circles] = haversine_matrix(lats[part], lngs[part], [fences[i].lat for i in circles],
+                                                       [fences[i].lng for i in circles]) - radii[None, :]
+            for i in polygons:
+                columns[:, i] = fences[i].distance_outside(lats[part], lngs[part])
+            if expected is not None:
+                wanted = expected[part]
+                chosen = np.where(wanted >= 0, wanted, columns.argmin(axis=1))
+            else:
+                chosen = columns.argmin(axis=1) if len(fences) else np.full(part.stop - part.start, -1)
+            if len(fences):
+                nearest[part] = chosen
+                outside[part] = columns[np.arange(len(chosen)), chosen]
+        inside = outside <= 0
+        return {
+            "inside": inside,
+            "fence_ids": [fences[i].id if i >= 0 else None for i in nearest],
+            "meters_outside": np.maximum(outside, 0.0),
+        }
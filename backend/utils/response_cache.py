@@ -0,0 +1,64 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class CachedResponse:
+    def __init__(self, body, etag, generation, created):
+        self.body = body
+        self.etag = etag
+        self.generation = generation
+        self.created = created
+
+
+class ResponseCache:
+    """
+    Small in-process LRU cache of serialized responses with ETags.
+
+    Every entry is tagged with the cache generation it was computed in;
+    invalidate() bumps the generation, so all older entries become misses
+    without having to walk the cache. ttl bounds staleness from writes made
+    by other instances, which never call invalidate() here.
+    """
+
+    def __init__(self, max_entries=256, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def invalidate(self, *_):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.generation != self.generation or time.monotonic() - entry.created > self.ttl:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, generation):
+        """
+        Stores a body computed while the cache was at `generation`. If a
+        write invalidated the cache in the meantime the body is returned
+        uncached, so a stale result never outlives the write that made it stale.
+        """
+        etag = f'W/"{generation}-{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        entry = CachedResponse(body, etag, generation, time.monotonic())
+        with self._lock:
+            if generation != self.generation:
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
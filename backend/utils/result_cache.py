@@ -0,0 +1,118 @@
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+def upload_key(namespace, *blobs):
+    """
+    Cache key for the uploaded bytes: a 128-bit BLAKE2b digest of every blob
+    (length-prefixed, so blob boundaries count) under a pipeline namespace.
+    """
+    digest = hashlib.blake2b(namespace.encode(), digest_size=16)
+    for blob in blobs:
+        digest.update(len(blob).to_bytes(8, "little"))
+        digest.update(blob)
+    return digest.hexdigest()
+
+
+def estimate_size(value):
+    """
+    Approximate bytes held by a cached value: array buffers plus a flat
+    per-object overhead for the containers and scalars around them.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 112
+    if isinstance(value, dict):
+        return 64 + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(estimate_size(v) for v in value)
+    if isinstance(value, (bytes, str)):
+        return 49 + len(value)
+    return 32
+
+
+class ResultCache:
+    """
+    In-process LRU cache of pipeline results keyed by upload hash, bounded
+    by total (estimated) bytes and entry age.
+
+    get_or_compute() is single-flight: concurrent callers with the same key
+    share one computation. The computation runs as its own task, so a caller
+    that disconnects doesn't cancel it for the others. Exceptions (rejected
+    frames, timeouts) are passed to every waiter and never cached.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=120.0, sizeof=estimate_size):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+        self._entries = OrderedDict()  # key -> (value, size, stored at)
+        self._inflight = {}            # key -> task
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_bytes > 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[2] > self.ttl:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        self._drop(key)
+        self._entries[key] = (value, size, time.monotonic())
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    async def get_or_compute(self, key, compute):
+        """
+        Returns (value, cached): the stored value, or the result of awaiting
+        compute() (shared with any identical request already computing it).
+        """
+        if not self.enabled:
+            return await compute(), False
+        entry = self.get(key)
+        if entry is not None:
+            self.stats["hits"] += 1
+            return entry[0], True
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(task), True
+        self.stats["misses"] += 1
+        task = asyncio.ensure_future(compute())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task), False
+
+    def _finish(self, key, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
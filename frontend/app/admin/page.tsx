@@ -1,6 +1,6 @@
 'use client';
 import { useEffect, useState } from 'react';
-import { getAttendanceHistory } from '@/utils/api';
+import { getAttendanceHistory, subscribeAttendance } from '@/utils/api';
 import Link from 'next/link';
 import { useRouter } from 'next/navigation';
 import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer } from 'recharts';
@@ -19,6 +19,9 @@ interface Record {
     longitude?: number;
 }
 
+// Rows fetched for the dashboard; live deltas are trimmed to the same size
+const HISTORY_LIMIT = 1000;
+
 export default function Admin() {
     const router = useRouter();
     const [stats, setStats] = useState({
@@ -41,17 +44,34 @@ export default function Admin() {
         }
 
         fetchData();
-        const interval = setInterval(fetchData, 5000);
-        return () => clearInterval(interval);
+        // Live updates instead of polling: snapshot on connect, then new records as they are marked
+        return subscribeAttendance({ start: historyStart(), limit: HISTORY_LIMIT }, {
+            onSnapshot: (history) => {
+                setRecords(history);
+                setLoading(false);
+            },
+            onRecord: (record) => setRecords(prev =>
+                prev.some(r => r.id === record.id) ? prev : [record, ...prev].slice(0, HISTORY_LIMIT)
+            ),
+        });
     }, [router]);
 
+    useEffect(() => {
+        calculateStats(records);
+    }, [records]);
+
+    // Stats cover the last month, so only that window is fetched
+    const historyStart = () => {
+        const monthStart = new Date();
+        monthStart.setMonth(monthStart.getMonth() - 1);
+        return monthStart.toISOString();
+    };
+
     const fetchData = async () => {
         try {
-            const res = await getAttendanceHistory();
+            const res = await getAttendanceHistory({ start: historyStart(), limit: HISTORY_LIMIT });
             if (res.status === 'success') {
-                const history = res.records;
-                setRecords(history);
-                calculateStats(history);
+                setRecords(res.records);
             }
         } catch (error) {
             console.error("Failed to fetch history:", error);
@@ -256,9 +276,11 @@ export default function Admin() {
                                                 {new Date(record.timestamp).toLocaleString()}
                                             </td>
                                             <td className="px-5 py-5 border-b border-gray-200 bg-white text-sm">
-                                                {(record as any).captured_image ? (
+                                                {(record as any).image_key || (record as any).captured_image ? (
                                                     <img
-                                                        src={`data:image/jpeg;base64,${(record as any).captured_image}`}
+                                                        src={(record as any).image_key
+                                                            ? `/api/images/${(record as any).image_key}`
+                                                            : `data:image/jpeg;base64,${(record as any).captured_image}`}
                                                         alt="Capture"
                                                         className="h-10 w-10 rounded-full object-cover border border-gray-200"
                                                     />
@@ -44,17 +44,24 @@ export default function Attendance() {
 
         try {
             console.log("🚀 Calling markAttendance API...");
-            const response = await markAttendance(file, location || undefined);
+            // Kiosks for one class are opened as /attendance?session=<id>
+            const sessionId = new URLSearchParams(window.location.search).get('session') || undefined;
+            const response = await markAttendance(file, location || undefined, sessionId);
             console.log("✅ API Response:", response);
 
             if (response.status === 'processed' || response.status === 'success') {
                 const results = response.results || [response];
                 const successes = results.filter((r: any) => r.status === 'success');
+                const repeats = results.filter((r: any) => r.status === 'already_marked');
 
                 if (successes.length > 0) {
                     const names = successes.map((r: any) => r.person).join(', ');
                     speak(`Attendance marked for ${names}`);
                     setStatus("Success!");
+                } else if (repeats.length > 0) {
+                    const names = repeats.map((r: any) => r.person).join(', ');
+                    speak(`Attendance already marked for ${names}`);
+                    setStatus("Already marked");
                 } else {
                     speak("Attendance failed. No recognized faces.");
                     setStatus("Failed");
@@ -178,12 +185,17 @@ export default function Attendance() {
 
                     <div className="space-y-4 max-h-60 overflow-y-auto">
                         {Array.isArray(result) ? result.map((res: any, idx: number) => (
-                            <div key={idx} className={`p-4 rounded border ${res.status === 'success' ? 'bg-green-50 border-green-200' : 'bg-red-50 border-red-200'}`}>
+                            <div key={idx} className={`p-4 rounded border ${res.status === 'success' ? 'bg-green-50 border-green-200' : res.status === 'already_marked' ? 'bg-yellow-50 border-yellow-200' : 'bg-red-50 border-red-200'}`}>
                                 {res.status === 'success' ? (
                                     <>
                                         <p className="font-bold text-lg">{res.person}</p>
                                         <p className="text-sm text-gray-600">Confidence: {res.confidence?.toFixed(1)}%</p>
                                     </>
+                                ) : res.status === 'already_marked' ? (
+                                    <>
+                                        <p className="font-bold text-lg">{res.person}</p>
+                                        <p className="text-sm text-gray-600">Already marked at {new Date(res.marked_at).toLocaleTimeString()}</p>
+                                    </>
                                 ) : (
                                     <p className="text-red-600 font-semibold">{res.message || 'Unknown Face'}</p>
                                 )}
@@ -207,6 +219,9 @@ export default function Attendance() {
 
             <div className="mt-8 text-center">
                 {error && <p className="text-red-600 font-semibold mb-2">{error}</p>}
+                <Link href="/kiosk" className="text-blue-500 hover:underline mr-4">
+                    Kiosk Mode
+                </Link>
                 <Link href="/" className="text-blue-500 hover:underline">
                     Back to Home
                 </Link>
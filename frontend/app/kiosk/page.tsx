@@ -0,0 +1,121 @@
+'use client';
+import { useState, useRef, useEffect } from 'react';
+import Webcam from 'react-webcam';
+import Link from 'next/link';
+import { openKioskStream } from '@/utils/api';
+import { speak } from '@/utils/voice';
+
+// Upper bound on the frame rate sent to the backend
+const FRAME_INTERVAL_MS = 125;
+
+export default function Kiosk() {
+    const [tracks, setTracks] = useState<any[]>([]);
+    const [marked, setMarked] = useState<any[]>([]);
+    const [connected, setConnected] = useState(false);
+
+    const webcamRef = useRef<Webcam>(null);
+
+    useEffect(() => {
+        let stopped = false;
+        let timer: ReturnType<typeof setTimeout> | undefined;
+        let stream: ReturnType<typeof openKioskStream> | null = null;
+
+        // Send one frame, then wait for the server's 'tracks' acknowledgement before the next
+        const sendFrame = async () => {
+            if (stopped || !stream) return;
+            const imageSrc = webcamRef.current?.getScreenshot();
+            if (!imageSrc || !stream.ready()) {
+                timer = setTimeout(sendFrame, FRAME_INTERVAL_MS);
+                return;
+            }
+            const blob = await (await fetch(imageSrc)).blob();
+            stream.send(blob);
+        };
+
+        const start = (location: { lat: number; lng: number } | null) => {
+            if (stopped) return;
+            stream = openKioskStream(location, {
+                onTracks: (current) => {
+                    setConnected(true);
+                    setTracks(current);
+                    timer = setTimeout(sendFrame, FRAME_INTERVAL_MS);
+                },
+                onAttendance: (event) => {
+                    speak(`Welcome ${event.person}`);
+                    setMarked((prev) => [{ ...event, time: new Date().toLocaleTimeString() }, ...prev].slice(0, 20));
+                },
+                onClose: () => {
+                    setConnected(false);
+                    if (!stopped) timer = setTimeout(() => start(location), 2000);
+                },
+            });
+            timer = setTimeout(sendFrame, 500);
+        };
+
+        if (navigator.geolocation) {
+            navigator.geolocation.getCurrentPosition(
+                (pos) => start({ lat: pos.coords.latitude, lng: pos.coords.longitude }),
+                () => start(null)
+            );
+        } else {
+            start(null);
+        }
+
+        return () => {
+            stopped = true;
+            clearTimeout(timer);
+            stream?.close();
+        };
+    }, []);
+
+    return (
+        <div className="flex flex-col items-center justify-center min-h-screen bg-gray-50 p-4">
+            <h1 className="text-3xl font-bold mb-4 text-green-700">Attendance Kiosk</h1>
+
+            <div className="flex flex-col lg:flex-row gap-6 w-full max-w-5xl">
+                <div className="relative flex-1 bg-black rounded-2xl overflow-hidden shadow-2xl border-4 border-white">
+                    <Webcam
+                        audio={false}
+                        ref={webcamRef}
+                        screenshotFormat="image/jpeg"
+                        videoConstraints={{ facingMode: "user", width: 640, height: 480 }}
+                        className="w-full h-auto"
+                    />
+                    <div className="absolute top-3 left-3 text-white text-sm font-medium bg-black/50 px-3 py-1 rounded-full">
+                        {connected ? `${tracks.length} face(s) in view` : 'Connecting...'}
+                    </div>
+                    <div className="absolute bottom-3 left-3 right-3 flex flex-wrap gap-2">
+                        {tracks.filter((t) => t.name).map((t) => (
+                            <span key={t.id} className="bg-green-600 text-white text-sm px-3 py-1 rounded-full">{t.name}</span>
+                        ))}
+                    </div>
+                </div>
+
+                <div className="bg-white p-6 rounded-xl shadow-md w-full lg:w-80">
+                    <h2 className="text-xl font-bold text-gray-800 mb-4">Marked</h2>
+                    {marked.length === 0 ? (
+                        <p className="text-gray-500">Walk up to the camera to mark attendance.</p>
+                    ) : (
+                        <ul className="space-y-3 max-h-96 overflow-y-auto">
+                            {marked.map((m, idx) => (
+                                <li key={idx} className="p-3 rounded border bg-green-50 border-green-200">
+                                    <p className="font-bold">{m.person}</p>
+                                    <p className="text-sm text-gray-600">{m.time} · {m.confidence?.toFixed(1)}%</p>
+                                </li>
+                            ))}
+                        </ul>
+                    )}
+                </div>
+            </div>
+
+            <div className="mt-8 text-center">
+                <Link href="/attendance" className="text-blue-500 hover:underline mr-4">
+                    Single Capture
+                </Link>
+                <Link href="/" className="text-blue-500 hover:underline">
+                    Back to Home
+                </Link>
+            </div>
+        </div>
+    );
+}
@@ -234,9 +234,11 @@ function StudentDashboardContent() {
                                                     {record.confidence ? `${record.confidence.toFixed(1)}%` : 'N/A'}
                                                 </td>
                                                 <td className="p-4">
-                                                    {record.captured_image ? (
+                                                    {record.image_key || record.captured_image ? (
                                                         <img
-                                                            src={`data:image/jpeg;base64,${record.captured_image}`}
+                                                            src={record.image_key
+                                                                ? `/api/images/${record.image_key}`
+                                                                : `data:image/jpeg;base64,${record.captured_image}`}
                                                             alt="Proof"
                                                             className="w-10 h-10 rounded-full object-cover border border-gray-200"
                                                         />
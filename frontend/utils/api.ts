@@ -50,8 +50,8 @@ export async function registerUser(name: string, image: File, email?: string, ph
     }
 }
 
-export async function markAttendance(image: File, location?: { lat: number; lng: number }) {
-    console.log("🔵 markAttendance called with:", { imageSize: image.size, imageType: image.type, location });
+export async function markAttendance(image: File, location?: { lat: number; lng: number }, sessionId?: string) {
+    console.log("🔵 markAttendance called with:", { imageSize: image.size, imageType: image.type, location, sessionId });
 
     const formData = new FormData();
     formData.append('file', image);
@@ -60,6 +60,10 @@ export async function markAttendance(image: File, location?: { lat: number; lng:
         formData.append('latitude', location.lat.toString());
         formData.append('longitude', location.lng.toString());
     }
+    // Class session: only that roster is searched
+    if (sessionId) {
+        formData.append('session_id', sessionId);
+    }
 
     const controller = new AbortController();
     const timeoutId = setTimeout(() => controller.abort(), 60000); // 60s timeout
@@ -106,11 +110,106 @@ export async function markAttendance(image: File, location?: { lat: number; lng:
     }
 }
 
-export async function getAttendanceHistory() {
-    const response = await fetch(`${API_BASE_URL}/attendance/history`);
+export interface HistoryQuery {
+    limit?: number;
+    cursor?: string;
+    userId?: string;
+    start?: string;
+    end?: string;
+}
+
+export async function getAttendanceHistory(query: HistoryQuery = {}) {
+    const params = new URLSearchParams();
+    if (query.limit) params.set('limit', String(query.limit));
+    if (query.cursor) params.set('cursor', query.cursor);
+    if (query.userId) params.set('user_id', query.userId);
+    if (query.start) params.set('start', query.start);
+    if (query.end) params.set('end', query.end);
+    const qs = params.toString();
+    // The backend sends an ETag; the browser revalidates with If-None-Match and
+    // an unchanged page comes back as a cheap 304.
+    const response = await fetch(`${API_BASE_URL}/attendance/history${qs ? `?${qs}` : ''}`);
     if (!response.ok) {
         const text = await response.text();
         throw new Error(`Failed to fetch attendance history: ${response.status} ${response.statusText} - ${text.substring(0, 100)}`);
     }
     return response.json();
 }
+
+// WebSockets are not proxied by the /api rewrite, so connect to the backend directly
+const WS_BASE_URL = (process.env.NEXT_PUBLIC_BACKEND_URL || 'http://127.0.0.1:8000').replace(/^http/, 'ws');
+
+export interface AttendanceFeedHandlers {
+    onSnapshot: (records: any[]) => void;
+    onRecord: (record: any) => void;
+}
+
+// Live attendance feed: a snapshot on (re)connect, then one message per new record.
+// Reconnects with backoff; returns a function that closes the feed.
+export function subscribeAttendance(query: HistoryQuery, handlers: AttendanceFeedHandlers) {
+    const params = new URLSearchParams();
+    if (query.limit) params.set('limit', String(query.limit));
+    if (query.start) params.set('start', query.start);
+
+    let socket: WebSocket | null = null;
+    let closed = false;
+    let retryDelay = 1000;
+    let retryTimer: ReturnType<typeof setTimeout> | undefined;
+
+    const connect = () => {
+        socket = new WebSocket(`${WS_BASE_URL}/ws/attendance?${params.toString()}`);
+        socket.onmessage = (event) => {
+            const message = JSON.parse(event.data);
+            if (message.type === 'snapshot') {
+                retryDelay = 1000;
+                handlers.onSnapshot(message.page.records);
+            } else if (message.type === 'attendance') {
+                handlers.onRecord(message.record);
+            }
+            // 'resync' is followed by a fresh snapshot; 'ping' is keep-alive
+        };
+        socket.onclose = () => {
+            if (closed) return;
+            retryTimer = setTimeout(connect, retryDelay);
+            retryDelay = Math.min(retryDelay * 2, 30000);
+        };
+    };
+    connect();
+
+    return () => {
+        closed = true;
+        clearTimeout(retryTimer);
+        socket?.close();
+    };
+}
+
+export interface KioskHandlers {
+    onTracks: (tracks: { id: number; box: number[]; state: string; name: string | null }[]) => void;
+    onAttendance: (event: { person: string; user_id: string; confidence: number }) => void;
+    onClose?: () => void;
+}
+
+// Continuous kiosk stream: send JPEG frames, receive face tracks and one
+// attendance event per recognized person. Each 'tracks' message acknowledges
+// a processed frame, so callers can wait for it before sending the next one.
+export function openKioskStream(location: { lat: number; lng: number } | null, handlers: KioskHandlers) {
+    const params = new URLSearchParams();
+    if (location) {
+        params.set('latitude', String(location.lat));
+        params.set('longitude', String(location.lng));
+    }
+    const socket = new WebSocket(`${WS_BASE_URL}/ws/kiosk?${params.toString()}`);
+    socket.binaryType = 'arraybuffer';
+    socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === 'tracks') handlers.onTracks(message.tracks);
+        else if (message.type === 'attendance') handlers.onAttendance(message);
+    };
+    socket.onclose = () => handlers.onClose?.();
+
+    return {
+        ready: () => socket.readyState === WebSocket.OPEN,
+        send: (frame: Blob) => socket.send(frame),
+        close: () => socket.close(),
+    };
+}
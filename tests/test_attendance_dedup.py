@@ -0,0 +1,113 @@
+import sys
+import os
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.join(current_dir, '..')
+# attendance_dedup imports its siblings the way main.py does (flat, from backend/)
+sys.path.append(os.path.join(project_root, 'backend'))
+
+from attendance_dedup import AttendanceCooldown, cooldown_scope
+from gallery_sync import timestamp_micros, format_micros
+
+WINDOW = 3600
+NOON = timestamp_micros("2026-01-01T12:00:00Z") / 1e6
+
+
+class FakeQuery:
+    def __init__(self, client):
+        self.client = client
+        self.since = None
+        self.row_limit = None
+
+    def select(self, columns):
+        return self
+
+    def gte(self, column, value):
+        self.since = timestamp_micros(value)
+        return self
+
+    def order(self, column):
+        return self
+
+    def limit(self, count):
+        self.row_limit = count
+        return self
+
+    def execute(self):
+        rows = sorted((r for r in self.client.rows if timestamp_micros(r["timestamp"]) >= self.since),
+                      key=lambda r: timestamp_micros(r["timestamp"]))
+
+        class Response:
+            data = rows[:self.row_limit]
+        return Response()
+
+
+class FakeClient:
+    """
+    Attendance rows written by other instances, read back by sync().
+    """
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+
+    def table(self, name):
+        return FakeQuery(self)
+
+
+def mark(user_id, at, session_id=None):
+    return {"user_id": user_id, "timestamp": format_micros(int(at * 1_000_000)), "session_id": session_id}
+
+
+class TestAttendanceCooldown(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.cooldown = AttendanceCooldown(self.client, window_seconds=WINDOW)
+        self.scope = cooldown_scope(None, NOON)
+
+    def test_claim_within_window_returns_previous_mark(self):
+        self.assertIsNone(self.cooldown.claim("u1", self.scope, NOON))
+        self.assertEqual(self.cooldown.claim("u1", self.scope, NOON + 60), NOON)
+        # Other users and other sessions are independent
+        self.assertIsNone(self.cooldown.claim("u2", self.scope, NOON + 60))
+        self.assertIsNone(self.cooldown.claim("u1", cooldown_scope(7, NOON), NOON + 60))
+        self.assertEqual(self.cooldown.stats["suppressed"], 1)
+
+    def test_release_allows_claim_again(self):
+        self.cooldown.claim("u1", self.scope, NOON)
+        self.cooldown.release("u1", self.scope, NOON)
+        self.assertIsNone(self.cooldown.claim("u1", self.scope, NOON + 1))
+        # A stale release (another claim since) leaves the newer mark alone
+        self.cooldown.release("u1", self.scope, NOON)
+        self.assertEqual(self.cooldown.claim("u1", self.scope, NOON + 2), NOON + 1)
+
+    def test_expired_entries_are_popped(self):
+        self.cooldown.claim("u1", self.scope, NOON)
+        self.cooldown.claim("u2", self.scope, NOON + 600)
+        self.assertIsNone(self.cooldown.claim("u1", self.scope, NOON + WINDOW))
+        self.assertEqual(len(self.cooldown), 2)  # u1's new mark and u2's
+        self.cooldown.claim("u3", self.scope, NOON + 600 + 2 * WINDOW)
+        self.assertEqual(len(self.cooldown), 1)
+        self.assertEqual(len(self.cooldown._heap), 1)
+
+    def test_synced_rows_block_claims(self):
+        self.client.rows = [mark("u1", NOON - 120), mark("u2", NOON - 60, session_id=7), mark("u3", NOON - 2 * WINDOW)]
+        self.assertEqual(self.cooldown.sync(NOON), 2)  # u3 is outside the window
+        self.assertEqual(self.cooldown.claim("u1", self.scope, NOON), NOON - 120)
+        self.assertEqual(self.cooldown.claim("u2", cooldown_scope(7, NOON), NOON), NOON - 60)
+        self.assertIsNone(self.cooldown.claim("u2", self.scope, NOON))
+        self.assertIsNone(self.cooldown.claim("u3", self.scope, NOON))
+
+        # Later syncs read only rows past the newest one seen (minus the overlap)
+        self.client.rows.append(mark("u4", NOON + 5))
+        self.cooldown.sync(NOON + 10)
+        self.assertEqual(self.cooldown.claim("u4", self.scope, NOON + 10), NOON + 5)
+
+    def test_disabled_window_never_suppresses(self):
+        cooldown = AttendanceCooldown(self.client, window_seconds=0)
+        self.assertIsNone(cooldown.claim("u1", self.scope, NOON))
+        self.assertIsNone(cooldown.claim("u1", self.scope, NOON + 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
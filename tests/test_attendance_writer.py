@@ -0,0 +1,144 @@
+import sys
+import os
+import asyncio
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.join(current_dir, '..')
+# The writer imports its siblings the way main.py does (flat, from backend/)
+sys.path.append(os.path.join(project_root, 'backend'))
+
+from attendance_writer import AttendanceWriter
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeTable:
+    def __init__(self, client):
+        self.client = client
+        self.rows = None
+
+    def insert(self, rows):
+        self.rows = rows
+        return self
+
+    def execute(self):
+        self.client.calls.append(self.rows)
+        if self.client.failures:
+            raise Exception(self.client.failures.pop(0))
+        if self.client.missing_column and any(self.client.missing_column in row for row in self.rows):
+            raise Exception(f'column "{self.client.missing_column}" of relation "attendance" does not exist')
+        self.client.inserted.extend(self.rows)
+        return FakeResponse([dict(row, id=len(self.client.inserted) - i) for i, row in enumerate(self.rows)])
+
+
+class FakeClient:
+    """
+    Minimal Supabase client: records every insert call. `failures` are raised
+    by the next calls in order; `missing_column` rejects rows that have it.
+    """
+
+    def __init__(self, failures=(), missing_column=None):
+        self.calls = []
+        self.inserted = []
+        self.failures = list(failures)
+        self.missing_column = missing_column
+
+    def table(self, name):
+        return FakeTable(self)
+
+
+def row(user, **extra):
+    return dict({"user_id": user, "timestamp": "2026-01-01T09:00:00", "confidence": 90.0}, **extra)
+
+
+class TestAttendanceWriter(unittest.TestCase):
+    def run_writer(self, client, batches, **kwargs):
+        """
+        Writes each list of rows from its own concurrent "request"; returns
+        (outcomes per request, writer) after closing the writer.
+        """
+        async def scenario():
+            writer = AttendanceWriter(client, flush_seconds=0.02, **kwargs)
+            outcomes = await asyncio.gather(*(writer.write(rows) for rows in batches))
+            await writer.close()
+            return outcomes, writer
+        return asyncio.run(scenario())
+
+    def test_concurrent_rows_share_one_insert(self):
+        client = FakeClient()
+        outcomes, writer = self.run_writer(client, [[row("a")], [row("b"), row("c")], [row("d")]])
+        self.assertEqual(len(client.calls), 1)
+        self.assertEqual([r["user_id"] for r in client.calls[0]], ["a", "b", "c", "d"])
+        self.assertTrue(all(o["ok"] for outs in outcomes for o in outs))
+        self.assertEqual(writer.stats["rows"], 4)
+        self.assertEqual(writer.stats["inserts"], 1)
+
+    def test_batch_size_splits_inserts(self):
+        client = FakeClient()
+        self.run_writer(client, [[row(str(i)) for i in range(5)]], batch_size=2)
+        self.assertEqual([len(call) for call in client.calls], [2, 2, 1])
+
+    def test_rows_grouped_by_key_set(self):
+        client = FakeClient()
+        outcomes, _ = self.run_writer(client, [[row("a"), row("b", latitude=1.0, longitude=2.0), row("c")]])
+        self.assertEqual(sorted(len(call) for call in client.calls), [1, 2])
+        for call in client.calls:
+            self.assertEqual(len({tuple(sorted(r)) for r in call}), 1)
+        self.assertTrue(all(o["ok"] for o in outcomes[0]))
+
+    def test_transient_errors_retried_with_backoff(self):
+        client = FakeClient(failures=["timeout", "connection reset"])
+        outcomes, writer = self.run_writer(client, [[row("a")]], max_retries=3)
+        self.assertTrue(outcomes[0][0]["ok"])
+        self.assertEqual(writer.stats["retries"], 2)
+        self.assertEqual(writer.stats["inserts"], 1)
+        self.assertEqual(len(client.inserted), 1)
+
+    def test_failed_rows_not_counted_as_written(self):
+        client = FakeClient(failures=["down"] * 3)
+        outcomes, writer = self.run_writer(client, [[row("a"), row("b")]], max_retries=2)
+        self.assertEqual([o["ok"] for o in outcomes[0]], [False, False])
+        self.assertEqual(writer.stats["rows"], 0)
+        self.assertEqual(writer.stats["failed_rows"], 2)
+
+    def test_missing_image_column_falls_back(self):
+        client = FakeClient(missing_column="image_key")
+        outcomes, writer = self.run_writer(client, [[row("a", image_key="x.jpg")]])
+        self.assertEqual(outcomes[0][0], {"ok": True, "image_saved": False})
+        self.assertNotIn("image_key", client.inserted[0])
+        self.assertEqual(writer.stats["images_dropped"], 1)
+        self.assertEqual(writer.stats["retries"], 0)  # No backoff for a schema error
+
+    def test_queued_durability_returns_before_insert(self):
+        async def scenario():
+            client = FakeClient()
+            writer = AttendanceWriter(client, flush_seconds=0.02, durability="queued")
+            outcome = await writer.write([row("a", image_key="x.jpg")])
+            inserted_before_close = len(client.inserted)
+            await writer.close()
+            return outcome, inserted_before_close, client
+        outcome, inserted_before_close, client = asyncio.run(scenario())
+        self.assertEqual(outcome, [{"ok": True, "queued": True, "image_saved": True}])
+        self.assertEqual(inserted_before_close, 0)
+        self.assertEqual(len(client.inserted), 1)  # close() drains the buffer
+
+    def test_listeners_get_inserted_rows(self):
+        client = FakeClient()
+        seen = []
+
+        async def scenario():
+            writer = AttendanceWriter(client, flush_seconds=0.01)
+            writer.listeners.append(seen.extend)
+            await writer.write([row("a")])
+            await writer.close()
+        asyncio.run(scenario())
+        self.assertEqual([r["user_id"] for r in seen], ["a"])
+        self.assertIn("id", seen[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
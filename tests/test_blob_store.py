@@ -0,0 +1,117 @@
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import cv2
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.join(current_dir, '..')
+sys.path.append(os.path.join(project_root, 'backend'))
+
+# main.py is imported as the server runs it; nothing here talks to Supabase
+os.environ.setdefault("SUPABASE_URL", "http://localhost:1")
+os.environ.setdefault("SUPABASE_KEY", "test")
+os.environ.setdefault("BLOB_STORE_DIR", tempfile.mkdtemp())
+os.environ.setdefault("GALLERY_SNAPSHOT", "")
+os.environ.setdefault("FACE_WORKER_MODE", "thread")
+
+from fastapi.testclient import TestClient
+from blob_store import LocalBlobStore, content_key, crop_key
+import main
+
+
+def jpeg(color, size=(120, 160)):
+    image = np.full(size + (3,), color, dtype=np.uint8)
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+
+class CountingStore(LocalBlobStore):
+    def __init__(self, root):
+        super().__init__(root)
+        self.writes = 0
+
+    def put_key(self, key, data):
+        self.writes += 1
+        super().put_key(key, data)
+
+
+class TestLocalBlobStore(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = CountingStore(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_round_trip(self):
+        data = jpeg((0, 0, 200))
+        key = self.store.put(data)
+        self.assertEqual(key, content_key(data))
+        self.assertEqual(self.store.get(key), data)
+        self.assertTrue(os.path.exists(os.path.join(self.root, key[:2], key[2:4], key)))
+        self.assertTrue(self.store.delete(key))
+        self.assertIsNone(self.store.get(key))
+        self.assertFalse(self.store.delete(key))
+
+    def test_identical_content_stored_once(self):
+        data = jpeg((0, 200, 0))
+        self.assertEqual(self.store.put(data), self.store.put(data))
+        self.assertEqual(self.store.writes, 1)
+        self.store.put(jpeg((200, 0, 0)))
+        self.assertEqual(self.store.writes, 2)
+
+    def test_keys_validated(self):
+        digest = "a" * 64
+        for key in ("../../etc/passwd", f"../{digest}.jpg", f"{digest}.png", f"{digest.upper()}.jpg",
+                    f"{digest}_1_2_3.jpg", f"{digest}.jpg/../x.jpg", ""):
+            with self.assertRaises(ValueError, msg=key):
+                self.store.get(key)
+        self.assertEqual(crop_key(f"{digest}.jpg", (1, 2, 3, 4)), f"{digest}_1_2_3_4.jpg")
+        self.assertIsNone(self.store.get(f"{digest}_1_2_3_4.jpg"))  # Valid, just absent
+
+
+class TestImagesEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.original = main.blob_store
+        main.blob_store = LocalBlobStore(self.root)
+        self.client = TestClient(main.app)
+
+    def tearDown(self):
+        main.blob_store = self.original
+        shutil.rmtree(self.root)
+
+    def test_served_with_etag_and_304(self):
+        data = jpeg((10, 20, 30))
+        key = main.blob_store.put(data)
+        response = self.client.get(f"/images/{key}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, data)
+        self.assertEqual(response.headers["content-type"], "image/jpeg")
+        etag = response.headers["etag"]
+        self.assertEqual(etag, f'"{key[:-4]}"')
+        self.assertIn("immutable", response.headers["cache-control"])
+
+        again = self.client.get(f"/images/{key}", headers={"If-None-Match": etag})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b"")
+
+    def test_invalid_or_missing_keys_are_404(self):
+        for key in ("..%2F..%2Fetc%2Fpasswd", "%2E%2E", "abc.jpg", "a" * 64 + ".jpg"):
+            self.assertEqual(self.client.get(f"/images/{key}").status_code, 404, key)
+
+    def test_crop_cut_on_demand_without_storing(self):
+        frame_key = main.blob_store.put(jpeg((90, 90, 90), size=(200, 200)))
+        key = crop_key(frame_key, (20, 120, 120, 20))
+        response = self.client.get(f"/images/{key}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content[:2], b"\xff\xd8")
+        self.assertFalse(main.blob_store.exists(key))
+        # A box outside the frame is not served
+        self.assertEqual(self.client.get(f"/images/{crop_key(frame_key, (0, 900, 900, 0))}").status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import sys
+import os
+import asyncio
+import tempfile
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.join(current_dir, '..')
+sys.path.append(os.path.join(project_root, 'backend'))
+
+# main.py is imported as the server runs it; nothing here talks to Supabase
+os.environ.setdefault("SUPABASE_URL", "http://localhost:1")
+os.environ.setdefault("SUPABASE_KEY", "test")
+os.environ.setdefault("BLOB_STORE_DIR", tempfile.mkdtemp())
+os.environ.setdefault("GALLERY_SNAPSHOT", "")
+os.environ.setdefault("FACE_WORKER_MODE", "thread")
+
+from fastapi.testclient import TestClient
+from event_hub import EventHub
+import main
+
+
+def drain(queue):
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    return events
+
+
+class TestEventHub(unittest.TestCase):
+    def test_events_fan_out_in_order(self):
+        async def scenario():
+            hub = EventHub(buffer_size=8)
+            first, second = hub.subscribe(), hub.subscribe()
+            hub.publish({"type": "attendance", "n": 1})
+            hub.publish({"type": "attendance", "n": 2})
+            return drain(first.queue), drain(second.queue)
+        first, second = asyncio.run(scenario())
+        self.assertEqual([e["seq"] for e in first], [1, 2])
+        self.assertEqual(first, second)
+
+    def test_overflow_replaces_backlog_with_resync(self):
+        async def scenario():
+            hub = EventHub(buffer_size=3)
+            slow, fast = hub.subscribe(), hub.subscribe()
+            for n in range(3):
+                hub.publish({"type": "attendance", "n": n})
+            drain(fast.queue)
+            hub.publish({"type": "attendance", "n": 3})  # slow's queue is full
+            overflowed = drain(slow.queue)
+            hub.publish({"type": "attendance", "n": 4})
+            return slow, overflowed, drain(slow.queue), drain(fast.queue)
+        slow, overflowed, after, fast = asyncio.run(scenario())
+        self.assertEqual(overflowed, [{"type": "resync", "seq": 4}])
+        self.assertEqual(slow.resyncs, 1)
+        # The slow consumer carries on with new deltas once it reloads
+        self.assertEqual([e["n"] for e in after], [4])
+        # Other subscribers are unaffected
+        self.assertEqual([e["n"] for e in fast], [3, 4])
+
+    def test_unsubscribed_clients_get_nothing(self):
+        async def scenario():
+            hub = EventHub()
+            sub = hub.subscribe()
+            hub.unsubscribe(sub)
+            hub.publish({"type": "attendance"})
+            return hub, sub
+        hub, sub = asyncio.run(scenario())
+        self.assertEqual(len(hub), 0)
+        self.assertTrue(sub.queue.empty())
+
+
+class TestAttendanceFeed(unittest.TestCase):
+    def setUp(self):
+        self.original = main._history_entry
+
+    def tearDown(self):
+        main._history_entry = self.original
+
+    def test_subscribed_before_snapshot(self):
+        """
+        A row written while the snapshot is being read still reaches the
+        client as a delta after the snapshot.
+        """
+        class Entry:
+            body = b'{"status": "success", "records": [], "next_cursor": null}'
+
+        async def history_entry(*args):
+            main.attendance_hub.publish({"type": "attendance", "record": {"id": 7}})
+            return Entry()
+        main._history_entry = history_entry
+
+        with TestClient(main.app).websocket_connect("/ws/attendance") as ws:
+            snapshot = ws.receive_json()
+            delta = ws.receive_json()
+        self.assertEqual(snapshot["type"], "snapshot")
+        self.assertEqual(snapshot["page"]["records"], [])
+        self.assertEqual(delta["type"], "attendance")
+        self.assertEqual(delta["record"], {"id": 7})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@
 import sys
 import os
 import unittest
+import asyncio
 import numpy as np
 import cv2
 
@@ -10,7 +11,12 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.join(current_dir, '..')
 sys.path.append(project_root)
 
-from backend.face_auth import FaceAuthSystem
+from backend.face_auth import FaceAuthSystem, FaceGallery, BruteForceIndex, IVFIndex, QuantizedIndex, BlinkDetector, FaceMeshPool, recall_report
+from backend.face_auth import encode_embedding, decode_embedding, current_embedding_model
+from backend.kiosk import FaceTracker
+from backend.gallery_sync import GallerySync, timestamp_micros, format_micros, version_checksum, row_versions
+from backend.utils.result_cache import ResultCache, upload_key
+from backend.utils.geo import GeofenceRegistry, RadiusFence, PolygonFence, calculate_distance
 
 class TestFaceAuth(unittest.TestCase):
     def setUp(self):
@@ -56,5 +62,334 @@ class TestFaceAuth(unittest.TestCase):
         self.assertFalse(is_match, "Should not match random noise")
         print(f"Non-match successful. Distance: {distance}")
 
+    def test_in_memory_pipeline(self):
+        print("\nTesting in-memory decode + ndarray APIs...")
+        with open(self.test_image_path, "rb") as f:
+            rgb = FaceAuthSystem.decode_image(f.read())
+        self.assertEqual(rgb.shape, (100, 100, 3))
+        self.assertIsNone(FaceAuthSystem.decode_image(b"not an image"))
+
+        from_array = self.auth.extract_face_encodings_from_array(rgb)
+        from_path = self.auth.extract_face_encodings(self.test_image_path)
+        self.assertEqual(len(from_array), len(from_path))
+        self.assertTrue(np.allclose(from_array[0], from_path[0]))
+        self.assertEqual(self.auth.check_liveness_from_array(rgb)[0], self.auth.check_liveness(self.test_image_path)[0])
+
+    def test_largest_faces_cap(self):
+        boxes = [(0, 10, 10, 0), (0, 100, 100, 0), (50, 60, 60, 50), (0, 40, 40, 0)]
+        # The biggest faces are kept, in detection order
+        self.assertEqual(FaceAuthSystem.largest_faces(boxes, 2), [boxes[1], boxes[3]])
+        self.assertEqual(FaceAuthSystem.largest_faces(boxes, None), boxes)
+
+    def test_quality_gate(self):
+        rng = np.random.default_rng(0)
+        frame = rng.integers(0, 255, size=(480, 640, 3), dtype=np.uint8)
+        self.assertTrue(self.auth.check_quality(frame)["ok"])
+        self.assertIn("blurry", self.auth.check_quality(cv2.GaussianBlur(frame, (31, 31), 15))["reasons"])
+        self.assertIn("too_dark", self.auth.check_quality(frame // 8)["reasons"])
+        self.assertIn("overexposed", self.auth.check_quality(np.maximum(frame, 245))["reasons"])
+
+    def test_result_cache(self):
+        async def scenario():
+            cache = ResultCache(max_bytes=3000, ttl=60)
+            calls = []
+
+            async def compute(value):
+                calls.append(value)
+                await asyncio.sleep(0.01)
+                return np.zeros(128, dtype=np.float64) + value
+
+            # Identical concurrent uploads compute once
+            key = upload_key("v1", b"frame")
+            first, second = await asyncio.gather(cache.get_or_compute(key, lambda: compute(1)),
+                                                 cache.get_or_compute(key, lambda: compute(2)))
+            self.assertEqual(calls, [1])
+            self.assertEqual((first[1], second[1]), (False, True))
+            self.assertIs(first[0], second[0])
+            self.assertTrue((await cache.get_or_compute(key, lambda: compute(3)))[1])
+            self.assertNotEqual(upload_key("v2", b"frame"), key)
+
+            # Byte bound evicts least recently used (each entry ~1.1 KB)
+            for i in range(3):
+                await cache.get_or_compute(upload_key("v1", bytes([i])), lambda: compute(i))
+            self.assertLessEqual(cache.bytes, 3000)
+            self.assertIsNone(cache.get(key))
+            self.assertEqual(cache.stats["evictions"], 2)
+
+        asyncio.run(scenario())
+
+    def test_gallery_match(self):
+        print("\nTesting vectorized gallery matching...")
+        encoding = self.auth.extract_face_encodings(self.test_image_path)[0]
+        rng = np.random.default_rng(0)
+        users = [{"id": f"u{i}", "name": f"User {i}", "face_encoding": (rng.random(128) * 3).tolist()} for i in range(50)]
+        users.append({"id": "me", "name": "Me", "face_encoding": np.asarray(encoding).tolist()})
+        users.append({"id": "broken", "name": "Broken", "face_encoding": None})
+
+        gallery = FaceGallery()
+        gallery.load(users)
+        self.assertEqual(len(gallery), 51)
+
+        (user, distance), (other, _) = gallery.match([encoding, rng.random(128) * 3 + 10])
+        self.assertEqual(user["id"], "me")
+        self.assertLess(distance, 0.1)
+        self.assertIsNone(other)
+
+        # Registration/removal keep the gallery in sync without a reload
+        gallery.remove("me")
+        self.assertIsNone(gallery.match([encoding])[0][0])
+        gallery.add({"id": "me", "name": "Me", "face_encoding": np.asarray(encoding).tolist()})
+        self.assertEqual(gallery.match([encoding])[0][0]["name"], "Me")
+
+    def test_gallery_subset(self):
+        rng = np.random.default_rng(4)
+        users = [{"id": f"u{i}", "name": f"User {i}", "face_encoding": rng.random(128).tolist()} for i in range(100)]
+        for index in (None, IVFIndex(nprobe=2), QuantizedIndex()):
+            gallery = FaceGallery(index=index)
+            gallery.load(users)
+            roster = gallery.subset(["u3", "u7", "not-registered"])
+            self.assertEqual(len(roster), 2)
+            (inside, _), (outside, _) = roster.match([users[7]["face_encoding"], users[9]["face_encoding"]])
+            self.assertEqual(inside["id"], "u7")
+            self.assertIsNone(outside)
+            version = gallery.version
+            gallery.remove("u3")
+            self.assertGreater(gallery.version, version)
+
+    def test_ivf_index(self):
+        print("\nTesting IVF index against exact search...")
+        rng = np.random.default_rng(1)
+        vectors = rng.normal(0, 0.056, size=(2000, 128)).astype(np.float32)
+        ids = [f"u{i}" for i in range(2000)]
+        exact = BruteForceIndex()
+        exact.build(vectors, ids)
+        ivf = IVFIndex(nlist=20, nprobe=20)
+        ivf.build(vectors, ids)
+
+        probes = vectors[:50] + rng.normal(0, 0.01, size=(50, 128)).astype(np.float32)
+        # Probing every cell is exact search
+        report = recall_report(ivf, exact, probes)
+        self.assertEqual(report["recall_at_k"], 1.0)
+        self.assertEqual(report["decision_agreement"], 1.0)
+
+        ivf.remove("u0")
+        ivf.add(vectors[0], "u0-new")
+        _, found = ivf.search(vectors[:1])
+        self.assertEqual(found[0], ["u0-new"])
+        self.assertEqual(len(ivf), 2000)
+
+        gallery = FaceGallery(index=IVFIndex(nprobe=4))
+        gallery.load([{"id": i, "name": i, "face_encoding": v} for i, v in zip(ids[:300], vectors[:300])])
+        user, distance = gallery.match([probes[5]], tolerance=0.5)[0]
+        self.assertEqual(user["id"], "u5")
+
+    def test_quantized_index(self):
+        rng = np.random.default_rng(2)
+        vectors = rng.normal(0, 0.056, size=(3000, 128)).astype(np.float32)
+        ids = [f"u{i}" for i in range(3000)]
+        exact = BruteForceIndex()
+        exact.build(vectors, ids)
+        probes = np.vstack([vectors[:40] + rng.normal(0, 0.02, size=(40, 128)),
+                            rng.normal(0, 0.056, size=(40, 128))]).astype(np.float32)
+        index = QuantizedIndex(rerank=8)
+        index.build(vectors, ids)
+        self.assertLess(index.scan_nbytes, exact.nbytes / 3.5)
+        report = recall_report(index, exact, probes, k=3)
+        self.assertEqual(report["decision_agreement"], 1.0)
+        # Re-ranked distances are the full-precision ones
+        exact_d, _ = exact.search(probes[:5])
+        quant_d, _ = index.search(probes[:5])
+        np.testing.assert_allclose(quant_d, exact_d, rtol=1e-6)
+
+        index.remove("u0")
+        index.add(vectors[0], "u0-new")
+        self.assertEqual(index.search(vectors[:1])[1][0], ["u0-new"])
+        self.assertEqual(len(index), 3000)
+        rows, found = index.vectors(["u0-new", "u7"])
+        self.assertEqual(found, ["u7", "u0-new"])
+        np.testing.assert_array_equal(rows, vectors[[7, 0]])
+
+    def test_quantized_index_keeps_float32_rows_off_the_heap(self):
+        rng = np.random.default_rng(4)
+        vectors = rng.normal(0, 0.056, size=(2000, 128)).astype(np.float32)
+        ids = [f"u{i}" for i in range(2000)]
+        exact = BruteForceIndex()
+        exact.build(vectors, ids)
+        index = QuantizedIndex(rerank=8)
+        index.build(vectors, ids)
+        # Codes, norms and row slots only: the float32 rows are mapped from a spill file
+        self.assertLess(index.nbytes, exact.nbytes / 3.5)
+        # Rows added since the build are held in memory until the next rebuild
+        before = index.nbytes
+        for i in range(20):
+            index.add(vectors[i] + 0.01, f"new{i}")
+        self.assertGreater(index.nbytes, before + 20 * 128 * 4)
+        index.rebuild()
+        self.assertLess(index.nbytes, exact.nbytes * 1.01 / 3.5)
+        self.assertEqual(index.search(vectors[3:4] + 0.01)[1][0], ["new3"])
+
+    def test_gallery_load_matrix(self):
+        rng = np.random.default_rng(3)
+        vectors = rng.random((5, 128)).astype(np.float32)
+        path = "test_gallery_matrix.bin"
+        vectors.tofile(path)
+        try:
+            mapped = np.memmap(path, dtype=np.float32, mode="r", shape=(5, 128))
+            ids = [f"u{i}" for i in range(5)]
+            gallery = FaceGallery()
+            gallery.load_matrix(mapped, ids, {i: {"id": i} for i in ids})
+            gallery.add({"id": "new", "face_encoding": rng.random(128).tolist()})
+            # Rows registered locally survive a reload that doesn't include them yet
+            gallery.load_matrix(mapped, ids, {i: {"id": i} for i in ids}, keep_local=True)
+            self.assertEqual(len(gallery), 6)
+            self.assertIn("new", gallery)
+            self.assertEqual(gallery.match([vectors[2]])[0][0]["id"], "u2")
+            gallery.load_matrix(mapped[:2], ids[:2], {i: {"id": i} for i in ids[:2]})
+            self.assertEqual(len(gallery), 2)
+            del mapped, gallery
+        finally:
+            os.remove(path)
+
+    def test_sync_timestamps(self):
+        us = timestamp_micros("2026-01-02T03:04:05.123+00:00")
+        self.assertEqual(us, timestamp_micros("2026-01-02T05:04:05.123+02:00"))
+        self.assertEqual(timestamp_micros(format_micros(us)), us)
+        self.assertEqual(us % 1_000_000, 123000)
+        # Order-independent, and sensitive to a changed version
+        a = version_checksum({"b": 2, "a": 1})
+        self.assertEqual(a, version_checksum({"a": 1, "b": 2}))
+        self.assertNotEqual(a, version_checksum({"a": 1, "b": 3}))
+
+    def test_sync_rebase_counts_unencoded_rows(self):
+        # gallery_checksum() covers every user, so rows without an encoding
+        # must be seeded too or each rebase reports drift
+        rows = [{"id": "u1", "updated_at": "2026-01-01T00:00:00Z", "face_encoding": [0.1] * 128},
+                {"id": "u2", "updated_at": "2026-01-01T00:00:01Z", "face_encoding": None}]
+        gallery = FaceGallery()
+        gallery.load(rows)
+        sync = GallerySync(None, gallery)
+        sync.rebase(timestamp_micros("2026-01-01T00:01:00Z") / 1e6, row_versions(rows))
+        self.assertEqual(len(gallery), 1)
+        self.assertEqual(sorted(sync.versions), ["u1", "u2"])
+
+    def test_geofence_registry(self):
+        registry = GeofenceRegistry()
+        registry.add(RadiusFence("room", 12.9716, 77.5946, 50))
+        registry.add(PolygonFence("campus", [(12.97, 77.59), (12.97, 77.60), (12.98, 77.60), (12.98, 77.59)]))
+        self.assertEqual([f.id for f in registry.locate(12.9716, 77.5947)], ["room", "campus"])
+        self.assertEqual([f.id for f in registry.locate(12.975, 77.599)], ["campus"])
+        inside, dist = registry.check(13.0, 77.5946)
+        self.assertFalse(inside)
+        self.assertGreater(dist, 2000)
+
+        # Vectorized audit agrees with the scalar haversine
+        lats, lngs = [12.9716, 12.9800, 12.9690], [77.5946, 77.6100, 77.5946]
+        report = registry.audit(lats, lngs, expected=["room", None, "room"])
+        self.assertEqual(report["inside"].tolist(), [True, False, False])
+        self.assertAlmostEqual(report["meters_outside"][2], calculate_distance(12.9690, 77.5946, 12.9716, 77.5946) - 50, places=6)
+        self.assertEqual(report["fence_ids"][1], "campus")
+
+    def test_blink_detector(self):
+        print("\nTesting incremental blink detection...")
+        detector = BlinkDetector()
+        seen = [detector.update(ear) for ear in [0.30, 0.31, 0.18, 0.15, 0.23, 0.29]]
+        self.assertEqual(seen, [False, False, False, False, False, True])
+
+        # Eyes already closed in the first frame are not a blink
+        detector = BlinkDetector()
+        self.assertFalse(any(detector.update(ear) for ear in [0.15, 0.15, 0.30]))
+
+    def test_face_tracker(self):
+        rng = np.random.default_rng(0)
+        texture = rng.integers(0, 255, (60, 60, 3), dtype=np.uint8)
+
+        def frame(x):
+            img = np.full((240, 320, 3), 40, dtype=np.uint8)
+            img[80:140, x:x + 60] = texture
+            return img
+
+        tracker = FaceTracker(confirm_hits=2)
+        tracker.update(frame(100), [(80, 160, 140, 100)])
+        self.assertEqual(tracker.due_for_recognition(), [])
+        # Optical flow follows the face between detections
+        for x in (104, 108, 112):
+            tracker.propagate(frame(x))
+        top, right, bottom, left = tracker.tracks[0].box
+        self.assertLessEqual(abs(left - 112), 2)
+        self.assertLessEqual(abs(top - 80), 2)
+
+        # The next detection continues the same track and confirms it
+        tracker.update(frame(116), [(80, 176, 140, 116), (10, 40, 40, 10)])
+        self.assertEqual(len(tracker.tracks), 2)
+        self.assertEqual([t.id for t in tracker.due_for_recognition()], [1])
+
+        # Tracks missing for more than max_misses detections are dropped
+        for _ in range(tracker.max_misses + 1):
+            tracker.update(frame(116), [(80, 176, 140, 116)])
+        self.assertEqual([t.id for t in tracker.tracks], [1])
+
+    def test_face_mesh_pool(self):
+        import threading
+        import time
+
+        class FakeMesh:
+            def process(self, image):
+                pass
+
+        pool = FaceMeshPool(FakeMesh, max_size=3, initial=1)
+        self.assertEqual(len(pool), 1)
+
+        in_use = []
+        lock = threading.Lock()
+
+        def worker():
+            for _ in range(5):
+                with pool.mesh() as mesh:
+                    with lock:
+                        self.assertNotIn(mesh, in_use)
+                        in_use.append(mesh)
+                    time.sleep(0.002)
+                    with lock:
+                        in_use.remove(mesh)
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # Grew on demand, never past max_size, and graphs were reused
+        self.assertEqual(len(pool), 3)
+        with pool.mesh(), pool.mesh(), pool.mesh():
+            with self.assertRaises(TimeoutError):
+                pool.checkout(timeout=0.01)
+
+    def test_embedding_format(self):
+        vec = np.random.default_rng(3).standard_normal(128)
+        stored = encode_embedding(vec, model="dlib_resnet_v1")
+        decoded, model = decode_embedding(stored)
+        self.assertEqual(model, "dlib_resnet_v1")
+        self.assertEqual(decoded.dtype, np.float32)
+        np.testing.assert_allclose(decoded, vec, rtol=1e-6)
+        self.assertLess(len(stored), len(str(vec.tolist())) / 3)
+
+        # Legacy rows (JSON list or JSON text) stay readable
+        np.testing.assert_allclose(decode_embedding(vec.tolist())[0], vec, rtol=1e-6)
+        np.testing.assert_allclose(decode_embedding(str(vec.tolist()))[0], vec, rtol=1e-6)
+        # Corrupted payloads are rejected by the checksum
+        corrupted = stored[:40] + ("A" if stored[40] != "A" else "B") + stored[41:]
+        self.assertIsNone(decode_embedding(corrupted)[0])
+
+        encoding = self.auth.extract_face_encodings(self.test_image_path)[0]
+        gallery = FaceGallery()
+        gallery.load([
+            {"id": "binary", "name": "Binary", "face_embedding": encode_embedding(encoding)},
+            {"id": "legacy", "name": "Legacy", "face_encoding": np.asarray(encoding).tolist()},
+            {"id": "other", "name": "Other model", "face_embedding": encode_embedding(
+                encoding, model="hsv_histogram_v1" if current_embedding_model() == "dlib_resnet_v1" else "dlib_resnet_v1")},
+        ])
+        self.assertEqual(len(gallery), 2)
+        self.assertNotIn("other", gallery)
+        self.assertNotIn("face_embedding", gallery.get_user("binary"))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,143 @@
+import sys
+import os
+import time
+import asyncio
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.join(current_dir, '..')
+# face_worker imports its siblings the way main.py does (flat, from backend/)
+sys.path.append(os.path.join(project_root, 'backend'))
+
+# main.py is imported as the server runs it; nothing here talks to Supabase
+os.environ.setdefault("SUPABASE_URL", "http://localhost:1")
+os.environ.setdefault("SUPABASE_KEY", "test")
+os.environ.setdefault("BLOB_STORE_DIR", tempfile.mkdtemp())
+os.environ.setdefault("GALLERY_SNAPSHOT", "")
+os.environ.setdefault("FACE_WORKER_MODE", "thread")
+
+from face_worker import FaceWorkerPool, PoolSaturated, StageTimeout, _init_worker
+import main
+
+
+class StubFaceAuth:
+    """
+    Stands in for FaceAuthSystem in thread workers: records encode calls and
+    "encodes" each box as itself.
+    """
+
+    def __init__(self):
+        self.stage_timings = {}
+        self.encode_calls = []
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        return {}
+
+    def blocked(self, release):
+        release.wait(5)
+        return "done"
+
+    def quick(self):
+        return "done"
+
+    def encode_faces_from_array(self, rgb_image, face_locations, profile):
+        with self._lock:
+            self.encode_calls.append(len(face_locations))
+        return list(face_locations)
+
+
+def stub_pool(face_auth, workers=4, **kwargs):
+    pool = FaceWorkerPool(workers=workers, mode="thread", **kwargs)
+    pool._executor = ThreadPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(face_auth,))
+    return pool
+
+
+class TestEncodeSplit(unittest.TestCase):
+    def test_inline_limit_matches_split_threshold(self):
+        frame = np.zeros((8, 8, 3), dtype=np.uint8)
+        face_auth = StubFaceAuth()
+        pool = stub_pool(face_auth, workers=4)
+        limit = pool.encode_limit(min_faces=8)
+        self.assertEqual(limit, 15)
+        for n in range(1, 41):
+            face_auth.encode_calls.clear()
+            boxes = [(i, i + 1, i + 1, i) for i in range(n)]
+            encodings = asyncio.run(pool.encode_faces(frame, boxes, "fast", min_faces=8))
+            self.assertEqual(encodings, boxes)  # Box order is kept
+            # Anything above the inline limit really is split; nothing below is
+            self.assertEqual(len(face_auth.encode_calls) > 1, n > limit, n)
+            self.assertTrue(all(c >= 8 for c in face_auth.encode_calls) or n <= limit)
+        pool.shutdown()
+
+    def test_single_worker_never_splits(self):
+        self.assertIsNone(FaceWorkerPool(workers=1, mode="thread").encode_limit())
+
+
+
+class TestBackpressure(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.pool = stub_pool(StubFaceAuth(), workers=2, max_pending=2)
+
+    def tearDown(self):
+        self.release.set()
+        self.pool.shutdown()
+
+    def test_full_queue_rejected_with_retry_after(self):
+        async def scenario():
+            running = [asyncio.ensure_future(self.pool.run("blocked", self.release)) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            self.assertEqual(self.pool.pending, 2)
+            with self.assertRaises(PoolSaturated) as raised:
+                await self.pool.run("quick")
+            self.assertGreaterEqual(raised.exception.retry_after, 1)
+
+            # The API answers the same condition with 503 + Retry-After
+            original, main.face_pool = main.face_pool, self.pool
+            try:
+                with self.assertRaises(main.HTTPException) as http:
+                    await main.run_face_stage("quick")
+            finally:
+                main.face_pool = original
+            self.assertEqual(http.exception.status_code, 503)
+            self.assertEqual(http.exception.headers["Retry-After"], str(raised.exception.retry_after))
+
+            self.release.set()
+            self.assertEqual(await asyncio.gather(*running), ["done", "done"])
+            self.assertEqual(await self.pool.run("quick"), "done")
+        asyncio.run(scenario())
+
+    def test_timed_out_task_releases_its_slot_when_it_ends(self):
+        async def scenario():
+            with self.assertRaises(StageTimeout):
+                await self.pool.run("blocked", self.release, timeout=0.05)
+            # Abandoned work still occupies a worker, so it still counts
+            self.assertEqual(self.pool.pending, 1)
+            self.release.set()
+            deadline = time.monotonic() + 5
+            while self.pool.pending and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            self.assertEqual(self.pool.pending, 0)
+            self.assertEqual(await self.pool.run("quick"), "done")
+        asyncio.run(scenario())
+
+    def test_timeout_maps_to_504(self):
+        async def scenario():
+            original, main.face_pool = main.face_pool, self.pool
+            try:
+                with self.assertRaises(main.HTTPException) as http:
+                    await main.run_face_stage("blocked", self.release)
+            finally:
+                main.face_pool = original
+            return http.exception
+        self.pool.stage_timeout = 0.05
+        self.assertEqual(asyncio.run(scenario()).status_code, 504)
+
+
+if __name__ == '__main__':
+    unittest.main()
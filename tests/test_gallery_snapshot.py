@@ -0,0 +1,116 @@
+import sys
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.join(current_dir, '..')
+# gallery_snapshot imports its siblings the way main.py does (flat, from backend/)
+sys.path.append(os.path.join(project_root, 'backend'))
+
+import gallery_snapshot
+from gallery_snapshot import GallerySnapshot, GallerySnapshotStore, write_snapshot, read_generation
+from face_auth import FaceGallery, ENCODING_DIM
+
+
+def user(user_id, vector):
+    return {"id": user_id, "name": user_id, "face_encoding": vector.tolist()}
+
+
+class TestGallerySnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "gallery.snapshot")
+        rng = np.random.default_rng(5)
+        self.vectors = rng.random((4, ENCODING_DIM)).astype(np.float32)
+        self.ids = ["u0", "u1", "u2", "u3"]
+        self.records = {i: {"id": i, "name": i.upper()} for i in self.ids}
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_write_and_read_round_trip(self):
+        generation = write_snapshot(self.path, self.vectors, self.ids, self.records,
+                                    created_at=1234.5, versions={"u0": 10, "u9": 20})
+        self.assertEqual(generation, 1)
+        snapshot = GallerySnapshot(self.path)
+        self.assertEqual((snapshot.count, snapshot.dim, snapshot.generation), (4, ENCODING_DIM, 1))
+        self.assertEqual(snapshot.created_at, 1234.5)
+        self.assertEqual(snapshot.ids, self.ids)
+        self.assertEqual(snapshot.records[2], {"id": "u2", "name": "U2"})
+        # Versions cover rows without an encoding too (u9)
+        self.assertEqual(snapshot.versions, {"u0": 10, "u9": 20})
+        np.testing.assert_array_equal(snapshot.matrix, self.vectors)
+        self.assertIsInstance(snapshot.matrix, np.memmap)
+
+        # Each write bumps the generation
+        self.assertEqual(write_snapshot(self.path, self.vectors[:2], self.ids[:2], self.records), 2)
+        self.assertEqual(read_generation(self.path), 2)
+        self.assertEqual(GallerySnapshot(self.path).count, 2)
+
+    def test_older_snapshot_without_versions(self):
+        write_snapshot(self.path, self.vectors, self.ids, self.records)
+        # Rewrite the metadata the way snapshots did before versions were stored
+        with open(self.path, "rb") as f:
+            header = gallery_snapshot.HEADER.unpack(f.read(gallery_snapshot.HEADER.size))
+        meta_offset = header[7]
+        meta = json.dumps([self.records[i] for i in self.ids]).encode()
+        with open(self.path, "r+b") as f:
+            f.seek(0)
+            f.write(gallery_snapshot.HEADER.pack(*header[:8], len(meta)))
+            f.seek(meta_offset)
+            f.write(meta)
+            f.truncate()
+        snapshot = GallerySnapshot(self.path)
+        self.assertIsNone(snapshot.versions)
+        self.assertEqual(snapshot.ids, self.ids)
+
+    def test_rejects_foreign_file(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a snapshot" * 400)
+        with self.assertRaises(ValueError):
+            GallerySnapshot(self.path)
+        self.assertFalse(GallerySnapshotStore(self.path).load_into(FaceGallery()))
+
+    def test_refresh_switches_to_new_generation(self):
+        write_snapshot(self.path, self.vectors[:2], self.ids[:2], self.records)
+        store = GallerySnapshotStore(self.path, poll_seconds=0)
+        gallery = FaceGallery()
+        self.assertTrue(store.load_into(gallery))
+        self.assertFalse(store.refresh(gallery))  # Nothing new
+
+        # Another worker writes the next generation
+        write_snapshot(self.path, self.vectors, self.ids, self.records)
+        self.assertTrue(store.refresh(gallery))
+        self.assertEqual(store.generation, 2)
+        self.assertEqual(len(gallery), 4)
+        self.assertEqual(gallery.match([self.vectors[3]], tolerance=0.01)[0][0]["id"], "u3")
+
+    def test_publish_writes_registered_rows(self):
+        write_snapshot(self.path, self.vectors[:2], self.ids[:2], self.records, created_at=100.0)
+        first, second = GallerySnapshotStore(self.path), GallerySnapshotStore(self.path)
+        gallery_a, gallery_b = FaceGallery(), FaceGallery()
+        first.load_into(gallery_a)
+        second.load_into(gallery_b)
+
+        # Each worker registers a user; the second publish merges the first
+        gallery_a.add(user("u2", self.vectors[2]))
+        self.assertFalse(first.publish(gallery_a))
+        gallery_b.add(user("u3", self.vectors[3]))
+        self.assertTrue(second.publish(gallery_b))
+
+        snapshot = GallerySnapshot(self.path)
+        self.assertEqual(snapshot.generation, 3)
+        self.assertEqual(sorted(snapshot.ids), self.ids)
+        self.assertEqual(snapshot.created_at, 100.0)  # Rows keep the age they were fetched at
+        # A worker starting now maps both registrations
+        fresh = FaceGallery()
+        GallerySnapshotStore(self.path).load_into(fresh)
+        self.assertEqual(len(fresh), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import sys
+import os
+import re
+import json
+import base64
+import tempfile
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.join(current_dir, '..')
+sys.path.append(os.path.join(project_root, 'backend'))
+
+# main.py is imported as the server runs it; nothing here talks to Supabase
+os.environ.setdefault("SUPABASE_URL", "http://localhost:1")
+os.environ.setdefault("SUPABASE_KEY", "test")
+os.environ.setdefault("BLOB_STORE_DIR", tempfile.mkdtemp())
+os.environ.setdefault("GALLERY_SNAPSHOT", "")
+os.environ.setdefault("FACE_WORKER_MODE", "thread")
+
+from fastapi.testclient import TestClient
+import main
+
+CURSOR_FILTER = re.compile(r'^timestamp\.lt\."([^"]+)",and\(timestamp\.eq\."([^"]+)",id\.lt\.(\d+)\)$')
+
+
+class FakeQuery:
+    def __init__(self, db):
+        self.db = db
+        self.predicates = []
+        self.row_limit = None
+
+    def select(self, columns):
+        self.db.selects.append(columns)
+        return self
+
+    def eq(self, column, value):
+        self.predicates.append(lambda r: str(r[column]) == str(value))
+        return self
+
+    def or_(self, expression):
+        self.db.cursor_filters.append(expression)
+        ts, same_ts, record_id = CURSOR_FILTER.match(expression).groups()
+        self.predicates.append(lambda r: r["timestamp"] < ts or (r["timestamp"] == same_ts and r["id"] < int(record_id)))
+        return self
+
+    def order(self, column, desc=False):
+        return self  # Rows are kept newest first
+
+    def limit(self, count):
+        self.row_limit = count
+        return self
+
+    def execute(self):
+        rows = [dict(r) for r in self.db.rows if all(p(r) for p in self.predicates)]
+
+        class Response:
+            data = rows[:self.row_limit]
+        return Response()
+
+
+class FakeDB:
+    def __init__(self, rows):
+        self.rows = sorted(rows, key=lambda r: (r["timestamp"], r["id"]), reverse=True)
+        self.selects = []
+        self.cursor_filters = []
+
+    def table(self, name):
+        return FakeQuery(self)
+
+
+def cursor_for(timestamp, record_id):
+    return base64.urlsafe_b64encode(json.dumps([timestamp, record_id]).encode()).decode()
+
+
+class TestHistory(unittest.TestCase):
+    def setUp(self):
+        rows = [{"id": i, "user_id": "u1", "timestamp": f"2026-01-0{1 + i // 2}T09:00:00", "confidence": 90.0}
+                for i in range(1, 6)]
+        self.db = FakeDB(rows)
+        self.original = main.supabase
+        main.supabase = self.db
+        main.history_cache.invalidate()
+        self.client = TestClient(main.app)
+
+    def tearDown(self):
+        main.supabase = self.original
+
+    def test_cursor_round_trip(self):
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+            page = self.client.get("/attendance/history", params=params).json()
+            seen.extend(r["id"] for r in page["records"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, [r["id"] for r in self.db.rows])
+        self.assertEqual(len(self.db.cursor_filters), 2)
+
+    def test_malformed_cursor_rejected(self):
+        bad = [
+            "not base64!",
+            cursor_for("2026-01-01T09:00:00", "1),id.gt.(0"),
+            cursor_for('2026-01-01T09:00:00",id.gt."0', 1),
+            cursor_for("yesterday", 1),
+            cursor_for("2026-01-01T09:00:00", True),
+        ]
+        for cursor in bad:
+            response = self.client.get("/attendance/history", params={"cursor": cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+        self.assertEqual(self.db.cursor_filters, [])
+        self.assertEqual(self.db.selects, [])
+
+    def test_uuid_cursor_accepted(self):
+        record_id = "6f1c2b7e-8a43-4d2e-9c0a-1b2c3d4e5f60"
+        decoded = main._decode_cursor(cursor_for("2026-01-01T09:00:00Z", record_id))
+        self.assertEqual(decoded, ("2026-01-01T09:00:00+00:00", record_id))
+
+    def test_images_only_when_requested(self):
+        self.client.get("/attendance/history")
+        self.client.get("/attendance/history", params={"include_images": "true"})
+        self.assertNotIn("captured_image", self.db.selects[0])
+        self.assertIn("captured_image", self.db.selects[1])
+
+    def test_etag_not_modified(self):
+        first = self.client.get("/attendance/history")
+        etag = first.headers["etag"]
+        again = self.client.get("/attendance/history", headers={"If-None-Match": etag})
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(len(self.db.selects), 1)  # Served from the cache
+
+        # A new attendance row invalidates the cache and changes the ETag
+        self.db.rows.insert(0, {"id": 6, "user_id": "u1", "timestamp": "2026-01-04T09:00:00", "confidence": 90.0})
+        main.history_cache.invalidate()
+        changed = self.client.get("/attendance/history", headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["etag"], etag)
+        self.assertEqual(changed.json()["records"][0]["id"], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
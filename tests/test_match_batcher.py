@@ -0,0 +1,71 @@
+import sys
+import os
+import asyncio
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.join(current_dir, '..')
+# match_batcher imports utils.metrics the way main.py does (flat, from backend/)
+sys.path.append(os.path.join(project_root, 'backend'))
+
+from match_batcher import MatchBatcher
+
+
+class CountingGallery:
+    """
+    Stands in for FaceGallery: records each match() call and answers every
+    probe with (probe, tolerance) so callers can check they got their own.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def match(self, probes, tolerance=None):
+        self.calls.append((list(probes), tolerance))
+        return [(probe, tolerance) for probe in probes]
+
+
+class TestMatchBatcher(unittest.TestCase):
+    def gather(self, batcher, requests):
+        """
+        Issues every (gallery, encodings, tolerance) request concurrently.
+        """
+        async def scenario():
+            return await asyncio.gather(*(batcher.match(g, e, t) for g, e, t in requests))
+        return asyncio.run(scenario())
+
+    def test_concurrent_probes_share_one_scan(self):
+        gallery = CountingGallery()
+        batcher = MatchBatcher(window_seconds=0.01)
+        results = self.gather(batcher, [(gallery, ["a"], None), (gallery, ["b", "c"], None), (gallery, ["d"], None)])
+        self.assertEqual(len(gallery.calls), 1)
+        self.assertEqual(gallery.calls[0][0], ["a", "b", "c", "d"])
+        self.assertEqual([[probe for probe, _ in r] for r in results], [["a"], ["b", "c"], ["d"]])
+        self.assertEqual(batcher.stats, {"requests": 3, "batches": 1, "probes": 4})
+
+    def test_groups_split_by_gallery_and_tolerance(self):
+        first, second = CountingGallery(), CountingGallery()
+        batcher = MatchBatcher(window_seconds=0.01)
+        results = self.gather(batcher, [(first, ["a"], None), (first, ["b"], 0.4),
+                                        (second, ["c"], None), (first, ["d"], None)])
+        self.assertEqual(sorted(first.calls, key=str), [(["a", "d"], None), (["b"], 0.4)])
+        self.assertEqual(second.calls, [(["c"], None)])
+        self.assertEqual(results, [[("a", None)], [("b", 0.4)], [("c", None)], [("d", None)]])
+
+    def test_max_probes_flushes_early(self):
+        gallery = CountingGallery()
+        batcher = MatchBatcher(window_seconds=60, max_probes=2)
+        results = self.gather(batcher, [(gallery, ["a"], None), (gallery, ["b"], None)])
+        self.assertEqual(gallery.calls, [(["a", "b"], None)])  # Didn't wait out the window
+        self.assertEqual(results, [[("a", None)], [("b", None)]])
+
+    def test_zero_window_bypasses_batching(self):
+        gallery = CountingGallery()
+        batcher = MatchBatcher(window_seconds=0)
+        self.gather(batcher, [(gallery, ["a"], None), (gallery, ["b"], None)])
+        self.assertEqual(gallery.calls, [(["a"], None), (["b"], None)])
+        self.assertEqual(batcher.stats["batches"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import sys
+import os
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.join(current_dir, '..')
+sys.path.append(project_root)
+
+from backend.utils.metrics import MetricsRegistry
+
+
+class TestPrometheusRender(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def lines(self):
+        text = self.registry.render()
+        self.assertTrue(text.endswith("\n"))
+        return text.splitlines()
+
+    def test_counter_lines(self):
+        requests = self.registry.counter("http_requests_total", "Requests served.", ("endpoint", "status"))
+        requests.inc("/login", "200")
+        requests.inc("/login", "200")
+        requests.inc("/register", "500", amount=3)
+        self.assertEqual(self.lines(), [
+            "# HELP http_requests_total Requests served.",
+            "# TYPE http_requests_total counter",
+            'http_requests_total{endpoint="/login",status="200"} 2',
+            'http_requests_total{endpoint="/register",status="500"} 3',
+        ])
+
+    def test_histogram_lines(self):
+        latency = self.registry.histogram("stage_seconds", "Stage latency.", ("stage",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            latency.observe(value, "encode")
+        self.assertEqual(self.lines(), [
+            "# HELP stage_seconds Stage latency.",
+            "# TYPE stage_seconds histogram",
+            'stage_seconds_bucket{stage="encode",le="0.1"} 2',  # Upper bounds are inclusive
+            'stage_seconds_bucket{stage="encode",le="1.0"} 3',
+            'stage_seconds_bucket{stage="encode",le="+Inf"} 4',
+            'stage_seconds_sum{stage="encode"} 3.65',
+            'stage_seconds_count{stage="encode"} 4',
+        ])
+
+    def test_label_values_escaped(self):
+        errors = self.registry.counter("errors_total", "Errors.", ("reason",))
+        errors.inc('bad "quote"\\path\nnext line')
+        self.assertEqual(self.lines()[-1], 'errors_total{reason="bad \\"quote\\"\\\\path\\nnext line"} 1')
+
+    def test_gauges_and_unlabelled_series(self):
+        self.registry.gauge("queue_depth", "Queued tasks.", lambda: 7)
+        self.registry.gauge("rows_total", "Rows written.", lambda: 12, kind="counter")
+        self.registry.gauge("broken", "Raises at scrape time.", lambda: 1 / 0)
+        self.assertEqual(self.lines(), [
+            "# HELP queue_depth Queued tasks.", "# TYPE queue_depth gauge", "queue_depth 7",
+            "# HELP rows_total Rows written.", "# TYPE rows_total counter", "rows_total 12",
+        ])
+
+    def test_reregistering_returns_existing_metric(self):
+        first = self.registry.counter("c_total", "C.")
+        self.assertIs(self.registry.counter("c_total", "C."), first)
+        first.inc()
+        self.assertIn("c_total 1", self.lines())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import sys
+import os
+import unittest
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.join(current_dir, '..')
+# sessions imports its siblings the way main.py does (flat, from backend/)
+sys.path.append(os.path.join(project_root, 'backend'))
+
+from sessions import ClassSession, SessionRegistry
+from face_auth import FaceGallery, BruteForceIndex, ENCODING_DIM
+from gallery_sync import timestamp_micros
+
+START = "2026-03-02T09:00:00Z"
+END = "2026-03-02T10:00:00Z"
+
+
+def session(roster, session_id=1):
+    return ClassSession({"id": session_id, "name": "Algebra", "starts_at": START, "ends_at": END}, roster)
+
+
+class TestClassSession(unittest.TestCase):
+    def test_is_open_within_grace(self):
+        s = session(["u1"])
+        start, end = timestamp_micros(START) / 1e6, timestamp_micros(END) / 1e6
+        self.assertTrue(s.is_open(start + 60, grace_seconds=0))
+        self.assertTrue(s.is_open(end, grace_seconds=0))
+        self.assertFalse(s.is_open(start - 60, grace_seconds=0))
+        self.assertTrue(s.is_open(start - 60, grace_seconds=300))
+        self.assertTrue(s.is_open(end + 299, grace_seconds=300))
+        self.assertFalse(s.is_open(end + 301, grace_seconds=300))
+
+    def test_location_and_dict(self):
+        s = session(["u1", "u2", "u1"])
+        self.assertFalse(s.has_location)
+        self.assertEqual(s.to_dict()["roster_size"], 2)
+
+
+class TestSessionGalleries(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(6)
+        self.vectors = rng.random((5, ENCODING_DIM)).astype(np.float32)
+        self.gallery = FaceGallery()
+        self.gallery.load([{"id": f"u{i}", "name": f"u{i}", "face_encoding": v.tolist()}
+                           for i, v in enumerate(self.vectors)])
+        self.registry = SessionRegistry(client=None)
+
+    def test_sub_gallery_holds_only_the_roster(self):
+        sub = self.registry.gallery_for(session(["u1", "u3", "missing"]), self.gallery)
+        self.assertEqual(sorted(r["id"] for r in sub.records()), ["u1", "u3"])
+        self.assertEqual(sub.match([self.vectors[3]], tolerance=0.01)[0][0]["id"], "u3")
+        self.assertIsNone(sub.match([self.vectors[0]], tolerance=0.01)[0][0])
+
+    def test_cached_until_gallery_changes(self):
+        s = session(["u1", "u2"])
+        self.assertIsNone(self.registry.cached_gallery(s, self.gallery))
+        sub = self.registry.gallery_for(s, self.gallery)
+        self.assertIs(self.registry.gallery_for(s, self.gallery), sub)
+        self.assertIs(self.registry.cached_gallery(s, self.gallery), sub)
+        self.assertEqual(self.registry.stats["builds"], 1)
+
+        # Any gallery change (registration, synced row) bumps its version
+        self.gallery.remove("u2")
+        self.assertIsNone(self.registry.cached_gallery(s, self.gallery))
+        rebuilt = self.registry.gallery_for(s, self.gallery)
+        self.assertEqual([r["id"] for r in rebuilt.records()], ["u1"])
+        self.assertEqual(self.registry.stats["builds"], 2)
+
+    def test_rebuilt_when_roster_changes(self):
+        sub = self.registry.gallery_for(session(["u1"]), self.gallery)
+        changed = self.registry.gallery_for(session(["u1", "u4"]), self.gallery)
+        self.assertIsNot(changed, sub)
+        self.assertEqual(len(changed), 2)
+
+    def test_index_vectors_by_id(self):
+        index = BruteForceIndex()
+        index.build(self.vectors, [f"u{i}" for i in range(5)])
+        index.remove("u1")
+        index.add(self.vectors[1], "u1")
+        matrix, ids = index.vectors(["u1", "u4", "nobody"])
+        self.assertEqual(ids, ["u4", "u1"])  # Row order
+        np.testing.assert_array_equal(matrix, self.vectors[[4, 1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
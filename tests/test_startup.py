@@ -0,0 +1,104 @@
+import sys
+import os
+import tempfile
+import subprocess
+import unittest
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.join(current_dir, '..')
+backend_dir = os.path.join(project_root, 'backend')
+sys.path.append(backend_dir)
+
+# main.py is imported as the server runs it; nothing here talks to Supabase
+os.environ.setdefault("SUPABASE_URL", "http://localhost:1")
+os.environ.setdefault("SUPABASE_KEY", "test")
+os.environ.setdefault("BLOB_STORE_DIR", tempfile.mkdtemp())
+os.environ.setdefault("GALLERY_SNAPSHOT", "")
+os.environ.setdefault("FACE_WORKER_MODE", "thread")
+
+from fastapi.testclient import TestClient
+from startup import StartupReport
+import main
+
+
+class TestStartupReport(unittest.TestCase):
+    def test_ready_once_required_phases_complete(self):
+        report = StartupReport(required=("import", "models"))
+        report.record("import", 0.5)
+        self.assertFalse(report.ready)
+        self.assertEqual(report.summary()["pending"], ["models"])
+        with report.phase("models"):
+            pass
+        self.assertTrue(report.ready)
+        summary = report.summary()
+        self.assertEqual(list(summary["phases"]), ["import", "models"])
+        self.assertEqual(summary["pending"], [])
+        self.assertIsNotNone(summary["ready_after_seconds"])
+
+    def test_failed_phase_keeps_error_until_it_succeeds(self):
+        report = StartupReport(required=("gallery",))
+        with self.assertRaises(RuntimeError):
+            with report.phase("gallery"):
+                raise RuntimeError("supabase down")
+        self.assertEqual(report.summary()["errors"], {"gallery": "supabase down"})
+        self.assertFalse(report.ready)
+        with report.phase("gallery"):
+            pass
+        self.assertEqual(report.summary()["errors"], {})
+        self.assertTrue(report.ready)
+
+    def test_optional_phases_do_not_gate_readiness(self):
+        report = StartupReport(required=("import",))
+        report.record("workers.encode", 1.0)
+        self.assertFalse(report.ready)
+        report.record("import", 0.1)
+        self.assertTrue(report.ready)
+
+
+class TestProbes(unittest.TestCase):
+    def setUp(self):
+        self.original = main.startup_report
+        main.startup_report = StartupReport(required=("import", "gallery"))
+        # No context manager: startup (warm-up) doesn't run
+        self.client = TestClient(main.app)
+
+    def tearDown(self):
+        main.startup_report = self.original
+
+    def test_healthz_answers_before_ready(self):
+        response = self.client.get("/healthz")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"status": "ok"})
+
+    def test_readyz_turns_ready(self):
+        main.startup_report.record("import", 0.2)
+        response = self.client.get("/readyz")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["pending"], ["gallery"])
+
+        main.startup_report.record("gallery", 0.3)
+        response = self.client.get("/readyz")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["ready"])
+
+
+class TestEmbeddingModel(unittest.TestCase):
+    def test_resolved_without_importing_face_recognition(self):
+        # A fresh interpreter: this one may have imported it through other tests
+        script = (
+            "import sys, numpy as np\n"
+            "import face_auth\n"
+            "from face_auth import FaceGallery, encode_embedding, current_embedding_model\n"
+            "blob = encode_embedding(np.ones(128, dtype=np.float32))\n"
+            "FaceGallery().decode_rows([{'id': 1, 'face_embedding': blob}])\n"
+            "current_embedding_model()\n"
+            "assert 'face_recognition' not in sys.modules and face_auth.FACE_REC_AVAILABLE is None\n"
+            "face_auth.set_embedding_model('hsv_histogram_v1')\n"
+            "assert current_embedding_model() == 'hsv_histogram_v1'\n"
+        )
+        result = subprocess.run([sys.executable, "-c", script], cwd=backend_dir, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()